@@ -0,0 +1,42 @@
+"""session tables
+
+Revision ID: 5b1e2f7a9c31
+Revises: c4cf53a74a62
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '5b1e2f7a9c31'
+down_revision = 'c4cf53a74a62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('session',
+    sa.Column('key', sa.String(length=64), nullable=False),
+    sa.Column('data', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.Column('expires', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('key')
+    )
+    op.create_index(op.f('ix_session_expires'), 'session', ['expires'], unique=False)
+    op.create_table('session_unlogged',
+    sa.Column('key', sa.String(length=64), nullable=False),
+    sa.Column('data', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.Column('expires', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('key'),
+    prefixes=['UNLOGGED']
+    )
+    op.create_index(op.f('ix_session_unlogged_expires'), 'session_unlogged', ['expires'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_session_unlogged_expires'), table_name='session_unlogged')
+    op.drop_table('session_unlogged')
+    op.drop_index(op.f('ix_session_expires'), table_name='session')
+    op.drop_table('session')
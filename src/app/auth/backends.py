@@ -1,33 +1,179 @@
+import asyncio
+import typing
+
+import anyio
 import sqlalchemy as sa
 from starlette.authentication import (
     AuthCredentials,
     AuthenticationBackend,
+    BaseUser,
     UnauthenticatedUser,
 )
 from starlette.requests import HTTPConnection
 
+from app.auth.cache import register, restore, snapshot
+from app.auth.snapshot import SESSION_KEY, SessionSnapshot
 from app.auth.tables import User
+from app.utils.cache import TTLCache
+from app.utils.singleflight import flights
 
 
 class AuthBackend(AuthenticationBackend):
+    """
+    Loads the user in the session along with their scopes. When a ``cache`` is
+    given users are kept in it, see ``app.auth.cache``, otherwise they are
+    loaded on every request.
+    Concurrent loads of the same user share one query, and all but the first
+    get a detached copy of the user as if it were cached.
+    When a ``snapshot`` is given a signed copy of the user is kept in the
+    session, requests with a fresh copy are authenticated without loading the
+    user and ``request.user`` is a ``SnapshotUser``.
+    """
+
+    def __init__(
+        self,
+        cache: typing.Optional[TTLCache] = None,
+        snapshot: typing.Optional[SessionSnapshot] = None,
+    ) -> None:
+        self.cache = cache
+        if cache is not None:
+            register(cache)
+        self.snapshot = snapshot
+
     async def get_user(self, conn: HTTPConnection):
         user_id = conn.session.get("user")
-        if user_id:
-            try:
-                qs = (
-                    sa.select(User)
-                    .where(User.id == int(user_id))
-                    .options(sa.orm.selectinload(User.scopes))
-                )
-                result = await User.execute(qs)
-                return result.scalars().first()
-            except:
-                conn.session.pop("user")
+        if not user_id:
+            return None
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            conn.session.pop("user")
+            return None
+        # errors loading the user, such as a statement timeout, are raised
+        # rather than logging them out
+        if self.cache is not None:
+            data = self.cache.get(user_id)
+            if data is not None:
+                return restore(data)
+
+        qs = (
+            sa.select(User)
+            .where(User.id == user_id)
+            .options(sa.orm.selectinload(User.scopes))
+        )
+        users: typing.List[User] = []
+
+        async def load() -> typing.Optional[dict]:
+            result = await User.execute_read(qs)
+            users.extend(result.scalars())
+            return snapshot(users[0]) if users else None
+
+        if User.db.is_sticky:
+            data, shared = await load(), False
+        else:
+            # a burst of requests by the user share the one query
+            key = ("AuthBackend.get_user", user_id)
+            data, shared = await flights.do(key, load)
+        if data is not None and self.cache is not None:
+            self.cache.set(user_id, data)
+        if shared:
+            return restore(data) if data is not None else None
+        return users[0] if users else None
 
     async def authenticate(self, conn: HTTPConnection):
+        if self.snapshot is not None:
+            data = self.snapshot.load(conn.session)
+            if data is not None and data["active"]:
+                scopes = ["authenticated"] + data["scopes"]
+                return AuthCredentials(scopes), self.snapshot.user(data)
+
         user = await self.get_user(conn)
+        if user and self.snapshot is not None:
+            if self.snapshot.is_revoked(conn.session, user):
+                # their password changed since the session was checked
+                conn.session.pop("user", None)
+                conn.session.pop(SESSION_KEY, None)
+                user = None
+            elif user.is_authenticated:
+                self.snapshot.save(conn.session, user)
+
         if user and user.is_authenticated:
             scopes = ["authenticated"] + sorted([str(s) for s in user.scopes])
             return AuthCredentials(scopes), user
         scopes = ["unauthenticated"]
         return AuthCredentials(scopes), UnauthenticatedUser()
+
+
+class LazyAuthentication:
+    """
+    Authenticates a connection with ``backend`` the first time the result is
+    needed, then memoizes it for the rest of the request.
+    """
+
+    def __init__(self, backend: AuthenticationBackend, conn: HTTPConnection) -> None:
+        self.backend = backend
+        self.conn = conn
+        self.lock = asyncio.Lock()
+        self._result: typing.Optional[typing.Tuple[AuthCredentials, BaseUser]] = None
+
+    async def resolve(self) -> typing.Tuple[AuthCredentials, BaseUser]:
+        if self._result is None:
+            async with self.lock:
+                if self._result is None:
+                    result = await self.backend.authenticate(self.conn)
+                    self._result = result or (
+                        AuthCredentials(),
+                        UnauthenticatedUser(),
+                    )
+        return self._result
+
+    @property
+    def result(self) -> typing.Tuple[AuthCredentials, BaseUser]:
+        if self._result is not None:
+            return self._result
+
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # accessed from a worker thread, such as a sync endpoint, so we can
+            # wait on the event loop for the user to load
+            return anyio.from_thread.run(self.resolve)
+
+        raise RuntimeError(
+            "The user has not been loaded. Await request.user.resolve() before "
+            "using it in an endpoint marked with app.auth.decorators.lazy_user."
+        )
+
+
+class LazyCredentials:
+    """Stands in for ``request.auth`` until the user is loaded."""
+
+    def __init__(self, auth: LazyAuthentication) -> None:
+        self._auth = auth
+
+    async def resolve(self) -> AuthCredentials:
+        return (await self._auth.resolve())[0]
+
+    @property
+    def scopes(self) -> typing.List[str]:
+        return self._auth.result[0].scopes
+
+
+class LazyUser:
+    """Stands in for ``request.user`` until the user is loaded."""
+
+    def __init__(self, auth: LazyAuthentication) -> None:
+        self._auth = auth
+
+    async def resolve(self) -> BaseUser:
+        return (await self._auth.resolve())[1]
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._auth._result is not None
+
+    def __getattr__(self, name: str) -> typing.Any:
+        return getattr(self._auth.result[1], name)
+
+    def __str__(self) -> str:
+        return str(self._auth.result[1])
@@ -0,0 +1,135 @@
+import time
+import typing
+import weakref
+
+import sqlalchemy as sa
+from sqlalchemy import orm
+
+from app import settings
+from app.auth.tables import Scope, User
+from app.auth.tables.user import user_scopes
+from app.utils.cache import TTLCache
+from app.utils.rowcache import statement_table
+
+# every cache of users by id, kept up to date as users are saved
+caches: "weakref.WeakSet[TTLCache]" = weakref.WeakSet()
+
+
+def register(cache: TTLCache) -> TTLCache:
+    """Invalidate users in ``cache`` when they are changed."""
+
+    caches.add(cache)
+    return cache
+
+
+# the cache used by the app, None unless AUTH_USER_CACHE_TTL is set
+user_cache: typing.Optional[TTLCache] = None
+if settings.AUTH_USER_CACHE_TTL:
+    user_cache = register(
+        TTLCache(
+            max_entries=settings.AUTH_USER_CACHE_MAX_ENTRIES,
+            ttl=settings.AUTH_USER_CACHE_TTL,
+        )
+    )
+
+
+# when each user last changed in this process, for anything that keeps a copy
+# of a user for up to AUTH_SESSION_SNAPSHOT_MAX_AGE, see ``changed_since``
+changes = TTLCache(
+    max_entries=settings.AUTH_USER_CACHE_MAX_ENTRIES * 10,
+    ttl=settings.AUTH_SESSION_SNAPSHOT_MAX_AGE or 60,
+)
+ALL_USERS = "*"
+
+
+def changed_since(user_id: typing.Any, timestamp: float) -> bool:
+    """Whether ``user_id`` was changed in this process since ``timestamp``."""
+
+    changed_at = max(changes.get(user_id, 0), changes.get(ALL_USERS, 0))
+    return changed_at >= timestamp
+
+
+def snapshot(user: User) -> dict:
+    """Return the column values of ``user`` and its scopes as plain data."""
+
+    def values(instance: typing.Any) -> dict:
+        table = instance.__table__
+        return {c.key: getattr(instance, c.key) for c in table.columns}
+
+    return {"user": values(user), "scopes": [values(s) for s in user.scopes]}
+
+
+def restore(data: dict) -> User:
+    """
+    Build a detached ``User`` from a ``snapshot``. It behaves as if it had just
+    been loaded, but a new object is made every time so changing it can't
+    affect the cached copy.
+    """
+
+    scopes = [Scope(**values) for values in data["scopes"]]
+    for scope in scopes:
+        orm.make_transient_to_detached(scope)
+    user = User(**data["user"])
+    user.scopes = scopes
+    orm.make_transient_to_detached(user)
+    return user
+
+
+def invalidate(user_id: typing.Any = None) -> None:
+    """Remove the user ``user_id`` from the caches, or every user if None."""
+
+    changes.set(ALL_USERS if user_id is None else user_id, time.time())
+    for cache in caches:
+        if user_id is None:
+            cache.clear()
+        else:
+            cache.delete(user_id)
+
+
+@sa.event.listens_for(orm.Session, "after_flush")
+def _invalidate_on_flush(session, flush_context):
+    # a user's scopes are changed through the user, so it is dirty too
+    changed = set()
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(instance, Scope):
+            changed.add(None)
+        elif isinstance(instance, User):
+            changed.add(instance.id)
+    for user_id in changed:
+        invalidate(user_id)
+    session.info.setdefault("auth_user_cache", set()).update(changed)
+
+
+@sa.event.listens_for(orm.Session, "do_orm_execute")
+def _invalidate_on_write(state):
+    # statements such as bulk inserts and updates don't flush instances
+    table = statement_table(state)
+    if not (state.is_insert or state.is_update or state.is_delete):
+        return None
+    if table not in (User.__table__, Scope.__table__, user_scopes):
+        return None
+
+    result = state.invoke_statement()
+    changed: typing.Set[typing.Any] = {None}
+    if table is User.__table__ and result.returns_rows and "id" in result.keys():
+        # the users written are known, ie ModelBase.update returns ids
+        frozen = result.freeze()
+        changed = {row.id for row in frozen()}
+        result = frozen()
+    for user_id in changed:
+        invalidate(user_id)
+    state.session.info.setdefault("auth_user_cache", set()).update(changed)
+    return result
+
+
+@sa.event.listens_for(orm.Session, "after_commit")
+def _invalidate_on_commit(session):
+    # again, in case another request cached the old row before the commit
+    for user_id in session.info.pop("auth_user_cache", ()):
+        invalidate(user_id)
+
+
+@sa.event.listens_for(orm.Session, "after_soft_rollback")
+def _discard_on_rollback(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop("auth_user_cache", None)
@@ -0,0 +1,54 @@
+import asyncio
+import functools
+import itertools
+import typing
+
+from starlette import authentication
+from starlette.requests import HTTPConnection
+
+from app.auth.backends import LazyUser
+
+
+def lazy_user(func: typing.Callable) -> typing.Callable:
+    """
+    Mark an async endpoint, or ``HTTPEndpoint`` method, as loading the user
+    only when it needs it, by awaiting ``request.user.resolve()``, so requests
+    that don't need it skip the query. Others have it loaded before they run.
+    """
+
+    func.lazy_user = True  # type: ignore
+    return func
+
+
+def requires(
+    scopes: typing.Union[str, typing.Sequence[str]],
+    status_code: int = 403,
+    redirect: typing.Optional[str] = None,
+) -> typing.Callable:
+    """
+    As ``starlette.authentication.requires``, but async endpoints first load a
+    lazily authenticated user so that its scopes can be checked.
+    """
+
+    def decorator(func: typing.Callable) -> typing.Callable:
+        wrapped = authentication.requires(
+            scopes, status_code, redirect  # type: ignore
+        )(func)
+
+        if not asyncio.iscoroutinefunction(func):
+            # sync endpoints run in a thread, where the user loads on access
+            return wrapped
+
+        @functools.wraps(func)
+        async def wrapper(*args: typing.Any, **kwargs: typing.Any) -> typing.Any:
+            for arg in itertools.chain(args, kwargs.values()):
+                if isinstance(arg, HTTPConnection):
+                    user = arg.scope.get("user")
+                    if isinstance(user, LazyUser):
+                        await user.resolve()
+                    break
+            return await wrapped(*args, **kwargs)
+
+        return lazy_user(wrapper)
+
+    return decorator
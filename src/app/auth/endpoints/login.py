@@ -7,6 +7,7 @@ from starlette.endpoints import HTTPEndpoint
 from starlette.responses import RedirectResponse
 
 from app.auth.forms import LoginForm
+from app.auth.snapshot import SESSION_KEY
 from app.auth.tables import User
 from app.utils.templating import templates
 
@@ -33,10 +34,14 @@ class Login(HTTPEndpoint):
             qs = sa.select(User).where(User.email == form.email.data.lower())
             result = await User.execute(qs)
             user = result.scalars().one()
-            if user.check_password(form.password.data):
+            if await user.acheck_password(form.password.data):
                 request.session["user"] = str(user.id)
-                user.last_login = datetime.utcnow()
-                await user.save()
+                request.session.pop(SESSION_KEY, None)
+                values = {"last_login": datetime.utcnow()}
+                if user.password_must_update():
+                    # upgrade the hash now the plain password is known
+                    values["password"] = await User.ahash_password(form.password.data)
+                await User.update(user, **values)
                 return RedirectResponse(url="/", status_code=status.HTTP_302_FOUND)
 
         except NoResultFound:
@@ -1,9 +1,11 @@
 from starlette import status
-from starlette.authentication import requires
 from starlette.endpoints import HTTPEndpoint
 from starlette.responses import RedirectResponse
 
+from app.auth.decorators import requires
 from app.auth.forms import PasswordChangeForm
+from app.auth.snapshot import session_snapshot
+from app.auth.tables import User
 from app.utils.templating import templates
 
 
@@ -27,13 +29,19 @@ class PasswordChange(HTTPEndpoint):
             context = {"request": request, "form": form}
             return templates.TemplateResponse(template, context)
 
-        if not request.user.check_password(form.current_password.data):
+        # request.user may be a cached or session copy, change the stored user
+        user = await User.get_or_404(request.user.id)
+
+        if not await user.acheck_password(form.current_password.data):
             form.current_password.errors.append("Enter your current password.")
             context = {"request": request, "form": form}
             return templates.TemplateResponse(template, context)
 
         else:
-            request.user.set_password(form.new_password.data)
-            await request.user.save()
+            password = await User.ahash_password(form.new_password.data)
+            await User.update(user, password=password)
+            if session_snapshot is not None:
+                # stay logged in here, other sessions are logged out
+                session_snapshot.update_version(request.session, user)
 
         return RedirectResponse(url="/", status_code=status.HTTP_302_FOUND)
@@ -32,8 +32,7 @@ class PasswordReset(HTTPEndpoint):
             return templates.TemplateResponse(template, context)
 
         qs = sa.select(User).where(User.email == form.email.data.lower())
-        result = await User.execute(qs)
-        user = result.scalars().first()
+        user = await User.first(qs)
 
         background = None
         if user and user.is_active:
@@ -101,8 +100,8 @@ class PasswordResetConfirm(HTTPEndpoint):
             context = {"request": request, "form": form}
             return templates.TemplateResponse(template, context)
 
-        user.set_password(form.new_password.data)
-        await user.save()
+        password = await User.ahash_password(form.new_password.data)
+        await User.update(user, password=password)
 
         return RedirectResponse(
             url=request.url_for("auth:password_reset_complete"),
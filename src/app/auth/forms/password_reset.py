@@ -21,8 +21,7 @@ class PasswordResetForm(form.Form):
 
     async def send_email(self, request: Request):
         qs = sa.select(User).where(User.email == self.data["email"])
-        result = await User.execute(qs)
-        user = result.scalars().first()
+        user = await User.first(qs)
         if not user:
             return
 
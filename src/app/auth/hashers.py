@@ -0,0 +1,276 @@
+import binascii
+import functools
+import hashlib
+import secrets
+import typing
+
+from app import settings
+from app.utils.crypto import constant_time_compare
+from app.utils.executor import BoundedExecutor
+from app.utils.klass import import_string
+
+# hashing is cpu bound, so it is run here rather than on the event loop
+executor = BoundedExecutor(
+    kind=settings.PASSWORD_HASHING_EXECUTOR,
+    max_workers=settings.PASSWORD_HASHING_WORKERS,
+    max_concurrency=settings.PASSWORD_HASHING_MAX_CONCURRENCY,
+)
+
+
+class BasePasswordHasher:
+    """
+    Base class for password hashers.
+    Subclasses must set ``algorithm`` and ``cost`` and overwrite encode() and
+    verify(). Encoded hashes are prefixed with the algorithm and cost, ie
+    ``<algorithm>$<cost>$...``, so they can be identified and upgraded later.
+    """
+
+    algorithm: str
+    cost: int
+
+    def __init__(self, cost: typing.Optional[int] = None) -> None:
+        if cost is not None:
+            self.cost = cost
+
+    def salt(self) -> str:
+        return secrets.token_hex(16)
+
+    def encode(self, password: str, salt: str) -> str:
+        msg = "subclasses of BasePasswordHasher must override encode() method"
+        raise NotImplementedError(msg)
+
+    def verify(self, password: str, encoded: str) -> bool:
+        msg = "subclasses of BasePasswordHasher must override verify() method"
+        raise NotImplementedError(msg)
+
+    def decode_cost(self, encoded: str) -> int:
+        return int(encoded.split("$")[1])
+
+    def must_update(self, encoded: str) -> bool:
+        """Return whether ``encoded`` was hashed at a different cost."""
+
+        return self.decode_cost(encoded) != self.cost
+
+    def recommend_cost(self, seconds: float, target: float) -> int:
+        """
+        Given that hashing at the current cost took ``seconds``, return the
+        cost that should take about ``target`` seconds.
+        """
+
+        return max(1, int(self.cost * target / seconds))
+
+
+class PBKDF2PasswordHasher(BasePasswordHasher):
+    """PBKDF2-HMAC-SHA512, cost is the number of iterations."""
+
+    algorithm = "pbkdf2_sha512"
+    digest = "sha512"
+    cost = settings.PASSWORD_PBKDF2_ITERATIONS
+
+    def encode(self, password: str, salt: str) -> str:
+        password_hash = hashlib.pbkdf2_hmac(
+            self.digest, password.encode("utf-8"), salt.encode("ascii"), self.cost
+        )
+        hexdigest = binascii.hexlify(password_hash).decode("ascii")
+        return "%s$%d$%s$%s" % (self.algorithm, self.cost, salt, hexdigest)
+
+    def verify(self, password: str, encoded: str) -> bool:
+        algorithm, cost, salt, _ = encoded.split("$", 3)
+        assert algorithm == self.algorithm
+        hasher = self.__class__(cost=int(cost))
+        return constant_time_compare(hasher.encode(password, salt), encoded)
+
+
+class ScryptPasswordHasher(BasePasswordHasher):
+    """scrypt, cost is the work factor N and must be a power of two."""
+
+    algorithm = "scrypt"
+    cost = settings.PASSWORD_SCRYPT_WORK_FACTOR
+    block_size = 8
+    parallelism = 1
+
+    def encode(self, password: str, salt: str) -> str:
+        password_hash = hashlib.scrypt(
+            password.encode("utf-8"),
+            salt=salt.encode("ascii"),
+            n=self.cost,
+            r=self.block_size,
+            p=self.parallelism,
+            maxmem=256 * self.cost * self.block_size * self.parallelism,
+            dklen=64,
+        )
+        hexdigest = binascii.hexlify(password_hash).decode("ascii")
+        return "%s$%d$%d$%d$%s$%s" % (
+            self.algorithm,
+            self.cost,
+            self.block_size,
+            self.parallelism,
+            salt,
+            hexdigest,
+        )
+
+    def verify(self, password: str, encoded: str) -> bool:
+        algorithm, cost, block_size, parallelism, salt, _ = encoded.split("$", 5)
+        assert algorithm == self.algorithm
+        hasher = self.__class__(cost=int(cost))
+        hasher.block_size = int(block_size)
+        hasher.parallelism = int(parallelism)
+        return constant_time_compare(hasher.encode(password, salt), encoded)
+
+    def must_update(self, encoded: str) -> bool:
+        _, cost, block_size, parallelism, _ = encoded.split("$", 4)
+        return (int(cost), int(block_size), int(parallelism)) != (
+            self.cost,
+            self.block_size,
+            self.parallelism,
+        )
+
+    def recommend_cost(self, seconds: float, target: float) -> int:
+        # the work factor must be a power of two, round down to the nearest
+        cost = super().recommend_cost(seconds, target)
+        return 1 << max(1, cost.bit_length() - 1)
+
+
+class Argon2PasswordHasher(BasePasswordHasher):
+    """
+    Argon2id, cost is the time cost. Requires the optional ``argon2-cffi``
+    package.
+    """
+
+    algorithm = "argon2"
+    cost = settings.PASSWORD_ARGON2_TIME_COST
+    memory_cost = settings.PASSWORD_ARGON2_MEMORY_COST
+    parallelism = 2
+
+    def _load_library(self):
+        try:
+            import argon2
+        except ImportError as err:
+            raise ValueError(
+                "Couldn't load the argon2 library, is argon2-cffi installed?"
+            ) from err
+        return argon2
+
+    def _hasher(self):
+        argon2 = self._load_library()
+        return argon2.PasswordHasher(
+            time_cost=self.cost,
+            memory_cost=self.memory_cost,
+            parallelism=self.parallelism,
+        )
+
+    def encode(self, password: str, salt: str) -> str:
+        # argon2 generates its own salt
+        return self.algorithm + self._hasher().hash(password)
+
+    def verify(self, password: str, encoded: str) -> bool:
+        argon2 = self._load_library()
+        try:
+            return self._hasher().verify(encoded[len(self.algorithm) :], password)
+        except argon2.exceptions.VerificationError:
+            return False
+        except argon2.exceptions.InvalidHash:
+            return False
+
+    def decode_cost(self, encoded: str) -> int:
+        params = dict(p.split("=") for p in encoded.split("$")[3].split(","))
+        return int(params["t"])
+
+    def must_update(self, encoded: str) -> bool:
+        return self._hasher().check_needs_rehash(encoded[len(self.algorithm) :])
+
+
+class LegacyPBKDF2PasswordHasher(BasePasswordHasher):
+    """
+    Verifies hashes stored before hashes carried their algorithm, a 64 char
+    salt followed by a PBKDF2-SHA512 hash at 100000 iterations. These are
+    always upgraded and can't be used to make new hashes.
+    """
+
+    algorithm = "pbkdf2_sha512_legacy"
+    cost = 100000
+
+    def encode(self, password: str, salt: str) -> str:
+        raise NotImplementedError("legacy hashes can only be verified")
+
+    def verify(self, password: str, encoded: str) -> bool:
+        salt = encoded[:64]
+        stored_password = encoded[64:]
+        password_hash = hashlib.pbkdf2_hmac(
+            "sha512", password.encode("utf-8"), salt.encode("ascii"), self.cost
+        )
+        hexdigest = binascii.hexlify(password_hash).decode("ascii")
+        return constant_time_compare(hexdigest, stored_password)
+
+    def decode_cost(self, encoded: str) -> int:
+        return self.cost
+
+    def must_update(self, encoded: str) -> bool:
+        return True
+
+
+@functools.lru_cache()
+def get_hashers() -> typing.List[BasePasswordHasher]:
+    """Load the hashers in ``settings.PASSWORD_HASHERS``, the first is default."""
+
+    hashers = [import_string(path)() for path in settings.PASSWORD_HASHERS]
+    if not hashers:
+        raise ValueError("You must specify at least one password hasher.")
+    return hashers
+
+
+def get_hasher(algorithm: str = "default") -> BasePasswordHasher:
+    """Return the hasher for ``algorithm``, or the default hasher."""
+
+    hashers = get_hashers()
+    if algorithm == "default":
+        return hashers[0]
+    for hasher in hashers:
+        if hasher.algorithm == algorithm:
+            return hasher
+    raise ValueError(
+        "Unknown password hashing algorithm '%s'. Did you specify it in "
+        "the PASSWORD_HASHERS setting?" % algorithm
+    )
+
+
+def identify_hasher(encoded: str) -> BasePasswordHasher:
+    """Return the hasher that produced ``encoded``."""
+
+    if "$" not in encoded:
+        return get_hasher(LegacyPBKDF2PasswordHasher.algorithm)
+    return get_hasher(encoded.split("$", 1)[0])
+
+
+def make_password(password: str) -> str:
+    """Return a hash of ``password`` for storage using the default hasher."""
+
+    hasher = get_hasher()
+    return hasher.encode(password, hasher.salt())
+
+
+def check_password(password: str, encoded: str) -> bool:
+    """Return whether ``password`` matches the stored hash ``encoded``."""
+
+    if not encoded:
+        return False
+    try:
+        hasher = identify_hasher(encoded)
+        return hasher.verify(password, encoded)
+    except ValueError:
+        return False
+
+
+def must_update(encoded: str) -> bool:
+    """
+    Return whether ``encoded`` should be rehashed, because it was made by
+    another algorithm or at another cost than the default hasher.
+    """
+
+    if not encoded:
+        return False
+    try:
+        hasher = identify_hasher(encoded)
+    except ValueError:
+        return False
+    return hasher.algorithm != get_hasher().algorithm or hasher.must_update(encoded)
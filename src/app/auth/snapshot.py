@@ -0,0 +1,155 @@
+import time
+import typing
+
+from starlette.authentication import BaseUser
+
+from app import settings
+from app.auth.cache import changed_since
+from app.utils.crypto import constant_time_compare, salted_hmac
+
+SESSION_KEY = "auth"
+
+
+class SnapshotUser(BaseUser):
+    """
+    The user as recorded in a session snapshot. Only the id, whether they are
+    active and their scope codes are known, load the ``User`` by id when more
+    is needed.
+    """
+
+    def __init__(self, id: int, is_active: bool, scopes: typing.List[str]) -> None:
+        self.id = id
+        self.is_active = is_active
+        self.scopes = scopes
+
+    @property
+    def is_authenticated(self) -> bool:
+        return self.is_active
+
+    @property
+    def display_name(self) -> str:
+        return ""
+
+    @property
+    def identity(self) -> str:
+        return str(self.id)
+
+    def __str__(self):
+        return self.identity
+
+
+class SessionSnapshot:
+    """
+    Strategy object to keep a compact, signed copy of the user in the session
+    so that most requests can be authenticated without loading the user.
+
+    The copy carries a credential version, a hash of the password in the way
+    ``PasswordResetTokenGenerator`` hashes user state, and the time it was
+    last checked against the database. It must be checked again once it is
+    ``max_age`` seconds old, or straight away if the user was changed in this
+    process. If the version has changed by then the session is logged out.
+    """
+
+    key_salt = "app.auth.snapshot.SessionSnapshot"
+
+    def __init__(self, max_age: typing.Optional[int] = None) -> None:
+        if max_age is None:
+            max_age = settings.AUTH_SESSION_SNAPSHOT_MAX_AGE
+        self.max_age = max_age
+
+    def version(self, user) -> str:
+        """Return a hash of the user state that changes with their credentials."""
+
+        # unlike password reset tokens last_login isn't included, it changes on
+        # every login which would end the user's other sessions
+        return self._hmac("version", str(user.id) + (user.password or ""))
+
+    def make(self, user) -> dict:
+        """Return a signed snapshot of ``user``, who must have scopes loaded."""
+
+        data = {
+            "id": user.id,
+            "active": bool(user.is_active),
+            "scopes": sorted(str(s) for s in user.scopes),
+            "version": self.version(user),
+            "checked": time.time(),
+        }
+        data["signature"] = self._sign(data)
+        return data
+
+    def load(self, session: dict) -> typing.Optional[dict]:
+        """
+        Return the snapshot in ``session`` if it is for the session's user,
+        correctly signed and still fresh, otherwise None.
+        """
+
+        data = session.get(SESSION_KEY)
+        if not isinstance(data, dict) or not self.is_valid(data):
+            return None
+        if str(data["id"]) != session.get("user"):
+            return None
+        if time.time() - data["checked"] > self.max_age:
+            return None
+        if changed_since(data["id"], data["checked"]):
+            return None
+        return data
+
+    def is_valid(self, data: dict) -> bool:
+        """Whether ``data`` is a snapshot with a correct signature."""
+
+        try:
+            return constant_time_compare(self._sign(data), data["signature"])
+        except (KeyError, TypeError, ValueError):
+            return False
+
+    def is_revoked(self, session: dict, user) -> bool:
+        """
+        Whether ``session`` has a snapshot of ``user`` whose credentials have
+        changed since, however old the snapshot is.
+        """
+
+        data = session.get(SESSION_KEY)
+        if not isinstance(data, dict) or not self.is_valid(data):
+            return False
+        if str(data["id"]) != str(user.id):
+            return False
+        return not constant_time_compare(data["version"], self.version(user))
+
+    def save(self, session: dict, user) -> None:
+        session[SESSION_KEY] = self.make(user)
+
+    def update_version(self, session: dict, user) -> None:
+        """
+        Keep the snapshot in ``session`` valid after ``user`` changed their
+        own credentials, such as their password, without loading their scopes.
+        """
+
+        data = session.get(SESSION_KEY)
+        if isinstance(data, dict) and str(data.get("id")) == str(user.id):
+            data = dict(data, version=self.version(user), checked=time.time())
+            data["signature"] = self._sign(data)
+            session[SESSION_KEY] = data
+
+    def user(self, data: dict) -> SnapshotUser:
+        return SnapshotUser(data["id"], data["active"], list(data["scopes"]))
+
+    def _sign(self, data: dict) -> str:
+        value = "%s:%s:%s:%s:%s" % (
+            data["id"],
+            int(data["active"]),
+            ",".join(data["scopes"]),
+            data["version"],
+            data["checked"],
+        )
+        return self._hmac("signature", value)
+
+    def _hmac(self, purpose: str, value: str) -> str:
+        return salted_hmac(
+            self.key_salt + "." + purpose, value, secret=str(settings.SECRET_KEY)
+        ).hexdigest()[::2]
+
+
+# the snapshot used by the app, None unless AUTH_SESSION_SNAPSHOT_MAX_AGE is set
+session_snapshot: typing.Optional[SessionSnapshot] = None
+if settings.AUTH_SESSION_SNAPSHOT_MAX_AGE:
+    session_snapshot = SessionSnapshot()
@@ -1,10 +1,7 @@
-import binascii
-import hashlib
-import os
-
 import sqlalchemy as sa
 from sqlalchemy import orm
 
+from app.auth import hashers
 from app.utils.database import ModelBase
 
 user_scopes = sa.Table(
@@ -38,18 +35,35 @@ class User(ModelBase):
         return f"{self.first_name} {self.last_name}"
 
     def set_password(self, password) -> None:
-        salt = hashlib.sha256(os.urandom(60)).hexdigest().encode("ascii")
-        password_hash = hashlib.pbkdf2_hmac(
-            "sha512", password.encode("utf-8"), salt, 100000
-        )
-        password_hash = binascii.hexlify(password_hash)
-        self.password = (salt + password_hash).decode("ascii")
+        self.password = hashers.make_password(password)
 
     def check_password(self, password) -> bool:
-        salt = self.password[:64]
-        stored_password = self.password[64:]
-        password_hash = hashlib.pbkdf2_hmac(
-            "sha512", password.encode("utf-8"), salt.encode("ascii"), 100000
+        return hashers.check_password(password, self.password)
+
+    def password_must_update(self) -> bool:
+        """Whether the password should be rehashed with the current hasher."""
+
+        return hashers.must_update(self.password)
+
+    @staticmethod
+    async def ahash_password(password) -> str:
+        """
+        Hash ``password`` on the hashing executor, for saving without loading
+        the user::
+
+            await User.update(user, password=await User.ahash_password(password))
+        """
+
+        return await hashers.executor.run(hashers.make_password, password)
+
+    async def aset_password(self, password) -> None:
+        """As ``set_password`` but hashes on the hashing executor."""
+
+        self.password = await self.ahash_password(password)
+
+    async def acheck_password(self, password) -> bool:
+        """As ``check_password`` but hashes on the hashing executor."""
+
+        return await hashers.executor.run(
+            hashers.check_password, password, self.password
         )
-        password_hash = binascii.hexlify(password_hash).decode("ascii")  # type: ignore
-        return password_hash == stored_password
@@ -0,0 +1,81 @@
+import argparse
+import json
+import sys
+import timeit
+from base64 import b64decode, b64encode
+
+import itsdangerous
+
+from app.utils.sessions.codecs import (
+    JSONSessionCodec,
+    MsgpackSessionCodec,
+    SessionSerializer,
+)
+
+SESSIONS = {
+    "small": {"user": 1, "csrf": "b" * 32},
+    "large": {
+        "user": 1,
+        "csrf": "b" * 32,
+        "messages": [{"level": "info", "text": "Your changes were saved."}] * 20,
+    },
+}
+
+
+class LegacySerializer:
+    """The encoding used before session codecs, for comparison."""
+
+    def dumps(self, data: dict) -> str:
+        return b64encode(json.dumps(data).encode("utf-8")).decode("utf-8")
+
+    def loads(self, value: str) -> dict:
+        return json.loads(b64decode(value))
+
+
+def serializers():
+    yield "legacy", LegacySerializer()
+    yield "json", SessionSerializer(JSONSessionCodec(), compress_min_size=0)
+    yield "json+zlib", SessionSerializer(JSONSessionCodec(), compress_min_size=1)
+    try:
+        MsgpackSessionCodec().dumps({})
+    except ValueError as e:
+        sys.stdout.write(f"msgpack: skipped ({e})\n")
+        return
+    yield "msgpack", SessionSerializer(MsgpackSessionCodec(), compress_min_size=0)
+    yield "msgpack+zlib", SessionSerializer(MsgpackSessionCodec(), compress_min_size=1)
+
+
+def measure(func, number: int) -> float:
+    """Return the best microseconds per call of ``func`` over a few repeats."""
+
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+def benchmark(number: int):
+    signer = itsdangerous.TimestampSigner("benchmark")
+
+    for size, data in SESSIONS.items():
+        sys.stdout.write(f"{size} session:\n")
+        for name, serializer in serializers():
+            cookie = signer.sign(serializer.dumps(data).encode("utf-8"))
+
+            def encode():
+                signer.sign(serializer.dumps(data).encode("utf-8"))
+
+            def verify():
+                serializer.loads(signer.unsign(cookie).decode("utf-8"))
+
+            sys.stdout.write(
+                f"  {name:<13} {len(cookie):>5} bytes, "
+                f"encode {measure(encode, number):6.1f}us, "
+                f"verify {measure(verify, number):6.1f}us\n"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the cost of encoding and verifying session cookies."
+    )
+    parser.add_argument("--number", type=int, default=10000)
+    args = parser.parse_args()
+    benchmark(args.number)
@@ -0,0 +1,48 @@
+import argparse
+import statistics
+import sys
+import time
+
+from app.auth.hashers import get_hasher, get_hashers
+
+
+def measure(hasher, rounds: int) -> float:
+    """Return the median seconds taken to hash a password at the current cost."""
+
+    timings = []
+    salt = hasher.salt()
+    for _ in range(rounds):
+        start = time.perf_counter()
+        hasher.encode("calibration-password", salt)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def calibrate(target_ms: float, rounds: int, algorithms=None):
+    sys.stdout.write(f"Target hashing time {target_ms:.0f}ms on this host...\n")
+
+    hashers = [get_hasher(a) for a in algorithms] if algorithms else get_hashers()
+    for hasher in hashers:
+        try:
+            # only hashers that can make new hashes can be calibrated
+            seconds = measure(hasher, rounds)
+        except (NotImplementedError, ValueError) as e:
+            sys.stdout.write(f"{hasher.algorithm}: skipped ({e})\n")
+            continue
+
+        recommended = hasher.recommend_cost(seconds, target_ms / 1000)
+        sys.stdout.write(
+            f"{hasher.algorithm}: cost {hasher.cost} took {seconds * 1000:.1f}ms, "
+            f"recommended cost {recommended}\n"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Recommend password hashing costs for a target latency."
+    )
+    parser.add_argument("--target-ms", type=float, default=250)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("algorithms", nargs="*", help="defaults to all hashers")
+    args = parser.parse_args()
+    calibrate(args.target_ms, args.rounds, args.algorithms)
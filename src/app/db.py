@@ -1,15 +1,52 @@
-from app.settings import DATABASE_URL
+from app.settings import (
+    DATABASE_AUTOCOMMIT_READS,
+    DATABASE_EXPLAIN,
+    DATABASE_MAX_OVERFLOW,
+    DATABASE_POOL_PRE_PING,
+    DATABASE_POOL_RECYCLE,
+    DATABASE_POOL_SIZE,
+    DATABASE_POOL_TIMEOUT,
+    DATABASE_POOLER,
+    DATABASE_READ_YOUR_WRITES,
+    DATABASE_REPLICA_STRATEGY,
+    DATABASE_REPLICA_URLS,
+    DATABASE_STATEMENT_CACHE_SIZE,
+    DATABASE_URL,
+)
+from app.utils import explain, queries
 from app.utils.database import Database, metadata
+from app.utils.pool import engine_options
 
-# set db config options
+# set db config options, which fails on startup if they aren't safe together
 if DATABASE_URL.drivername == "postgresql+asyncpg":
-    engine_kwargs = {"pool_size": 5, "max_overflow": 10}
+    engine_kwargs = engine_options(
+        pooler=DATABASE_POOLER,
+        pool_size=DATABASE_POOL_SIZE,
+        max_overflow=DATABASE_MAX_OVERFLOW,
+        pool_timeout=DATABASE_POOL_TIMEOUT,
+        pool_recycle=DATABASE_POOL_RECYCLE,
+        pool_pre_ping=DATABASE_POOL_PRE_PING,
+        statement_cache_size=DATABASE_STATEMENT_CACHE_SIZE,
+        autocommit_reads=DATABASE_AUTOCOMMIT_READS,
+    )
 else:
     engine_kwargs = {}
 
 # setup database url
-db = Database(DATABASE_URL, engine_kwargs=engine_kwargs)
+db = Database(
+    DATABASE_URL,
+    engine_kwargs=engine_kwargs,
+    replica_urls=DATABASE_REPLICA_URLS,
+    replica_strategy=DATABASE_REPLICA_STRATEGY,
+    read_your_writes=DATABASE_READ_YOUR_WRITES,
+    autocommit_reads=DATABASE_AUTOCOMMIT_READS,
+)
+
+# explain slow statements again, for the plans at /debug/plans
+if DATABASE_EXPLAIN:
+    queries.observers.append(explain.observe)
 
 # import project and external tables so that they all
 # live in one place for the migrations to find them
 from app.auth import tables  # noqa isort:skip
+from app.utils.sessions import tables as session_tables  # noqa isort:skip
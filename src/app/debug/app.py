@@ -0,0 +1,5 @@
+from starlette.routing import Router
+
+from app.debug.routes import routes
+
+app = Router(routes)
@@ -0,0 +1,95 @@
+import itertools
+from collections import OrderedDict
+
+from starlette.endpoints import HTTPEndpoint
+from starlette.responses import JSONResponse, PlainTextResponse
+
+from app.auth.decorators import requires
+from app.db import db
+from app.debug.metrics import pools, render_metrics
+from app.utils import statements
+from app.utils.explain import plans
+
+# snapshots of pg_stat_statements taken by this worker, see Statements
+snapshots: "OrderedDict[str, statements.Stats]" = OrderedDict()
+MAX_SNAPSHOTS = 10
+
+
+class Metrics(HTTPEndpoint):
+    @requires(["authenticated", "debug"])
+    async def get(self, request):
+        content = render_metrics(db)
+        return PlainTextResponse(content, media_type="text/plain; version=0.0.4")
+
+
+class Plans(HTTPEndpoint):
+    @requires(["authenticated", "debug"])
+    async def get(self, request):
+        routes = plans.by_route()
+        if "route" in request.query_params:
+            route = request.query_params["route"]
+            routes = {route: routes.get(route, [])}
+        if "flagged" in request.query_params:
+            # only plans that changed or scan large tables
+            routes = {
+                route: [p for p in found if p["changed"] or p["seq_scans"]]
+                for route, found in routes.items()
+            }
+        return JSONResponse(routes)
+
+
+class Pool(HTTPEndpoint):
+    @requires(["authenticated", "debug"])
+    async def get(self, request):
+        return JSONResponse(pools(db))
+
+
+class Statements(HTTPEndpoint):
+    """
+    The statements in pg_stat_statements that cost the most, ``?by=`` one of
+    ``statements.ORDERINGS`` and ``?limit=``. A POST takes a snapshot, and
+    ``?since=`` its id reports only what ran after it. Snapshots are kept by
+    the worker that took them, so with several use ``app.report_statements``.
+    """
+
+    ids = itertools.count(1)
+
+    @requires(["authenticated", "debug"])
+    async def get(self, request):
+        by = request.query_params.get("by", "total_time")
+        limit = request.query_params.get("limit", "20")
+        since = request.query_params.get("since")
+        if by not in statements.ORDERINGS or not limit.isdigit():
+            return JSONResponse({"error": "invalid by or limit"}, status_code=400)
+        if since is not None and since not in snapshots:
+            return JSONResponse({"error": "unknown snapshot"}, status_code=404)
+
+        stats = await self.snapshot()
+        if stats is None:
+            return self.unavailable()
+        if since is not None:
+            stats = statements.diff(snapshots[since], stats)
+        rows = statements.top(stats, by, int(limit))
+        return JSONResponse(statements.attribute(rows, statements.model_tables()))
+
+    @requires(["authenticated", "debug"])
+    async def post(self, request):
+        stats = await self.snapshot()
+        if stats is None:
+            return self.unavailable()
+        snapshot_id = str(next(self.ids))
+        snapshots[snapshot_id] = stats
+        while len(snapshots) > MAX_SNAPSHOTS:
+            snapshots.popitem(last=False)
+        return JSONResponse({"snapshot": snapshot_id, "statements": len(stats)})
+
+    async def snapshot(self):
+        # on the primary, replicas have their own stats
+        async with db.engine.connect() as conn:
+            if not await statements.available(conn):
+                return None
+            return await statements.snapshot(conn)
+
+    def unavailable(self):
+        error = "pg_stat_statements is not installed"
+        return JSONResponse({"error": error}, status_code=503)
@@ -0,0 +1,62 @@
+import typing
+
+from app.auth.cache import caches as user_caches
+from app.utils import queries, rowcache
+from app.utils.database import Database
+from app.utils.metrics import render
+from app.utils.pool import pool_stats
+from app.utils.singleflight import flights
+
+Sample = typing.Tuple[str, str, typing.Dict[str, typing.Any], typing.Any]
+
+
+def engines(database: Database) -> typing.List[typing.Tuple[str, typing.Any]]:
+    """The engines of ``database`` by name, named by index to keep urls private."""
+
+    named = [("primary", database.engine)]
+    for i, replica in enumerate(database.replicas):
+        named.append(("replica%d" % i, replica.engine))
+    return named
+
+
+def pools(database: Database) -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+    return {name: pool_stats(engine) for name, engine in engines(database)}
+
+
+def samples(database: Database) -> typing.Iterator[Sample]:
+    for name, engine in engines(database):
+        stats, labels = pool_stats(engine), {"database": name}
+        for key in ("size", "checked_out", "checked_in", "overflow"):
+            if key in stats:
+                yield "db_pool_" + key, "gauge", labels, stats[key]
+        metrics = getattr(engine.sync_engine.pool, "metrics", None)
+        if metrics is not None:
+            yield "db_pool_checkout_seconds", "histogram", labels, metrics.wait
+            yield "db_pool_timeouts_total", "counter", labels, metrics.timeouts
+
+    statements = queries.metrics
+    yield "db_query_seconds", "histogram", {}, statements.duration
+    yield "db_slow_queries_total", "counter", {}, statements.slow
+    yield "db_request_queries", "histogram", {}, statements.request_queries
+    yield "db_request_seconds", "histogram", {}, statements.request_duration
+
+    for table, stats in rowcache.stats().items():
+        yield from cache_samples("db_row_cache", {"table": table}, stats)
+    for i, cache in enumerate(user_caches):
+        yield from cache_samples("auth_user_cache", {"cache": i}, cache.stats)
+
+    yield "db_singleflight_in_flight", "gauge", {}, flights.stats["in_flight"]
+    yield "db_singleflight_leaders_total", "counter", {}, flights.stats["leaders"]
+    yield "db_singleflight_shared_total", "counter", {}, flights.stats["shared"]
+
+
+def cache_samples(
+    prefix: str, labels: typing.Dict[str, typing.Any], stats: typing.Dict[str, int]
+) -> typing.Iterator[Sample]:
+    yield prefix + "_entries", "gauge", labels, stats["entries"]
+    for key in ("hits", "misses", "evictions"):
+        yield "%s_%s_total" % (prefix, key), "counter", labels, stats[key]
+
+
+def render_metrics(database: Database) -> str:
+    return render(samples(database))
@@ -0,0 +1,15 @@
+from starlette.routing import Route
+
+from app.debug import endpoints
+
+routes = [
+    Route("/metrics", endpoint=endpoints.Metrics, methods=["GET"], name="metrics"),
+    Route("/plans", endpoint=endpoints.Plans, methods=["GET"], name="plans"),
+    Route("/pool", endpoint=endpoints.Pool, methods=["GET"], name="pool"),
+    Route(
+        "/statements",
+        endpoint=endpoints.Statements,
+        methods=["GET", "POST"],
+        name="statements",
+    ),
+]
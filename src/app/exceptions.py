@@ -1,3 +1,9 @@
+import sqlalchemy as sa
+from starlette.authentication import AuthCredentials, UnauthenticatedUser
+
+from app.auth.backends import LazyUser
+from app.db import db
+from app.utils import deadlines
 from app.utils.templating import templates
 
 
@@ -13,7 +19,45 @@ async def server_error(request, exc):
     return templates.TemplateResponse(template, context, status_code=500)
 
 
+async def abandon_database(request):
+    # the unit of work's transaction failed, or no connection was free, so
+    # roll it back and don't load the user for the page, as that would fail
+    # the same way
+    session = db.current_session
+    if session is not None:
+        # detached first, so a user already loaded isn't expired
+        session.expunge_all()
+        await session.rollback()
+    user = request.scope.get("user")
+    if isinstance(user, LazyUser) and not user.is_loaded:
+        request.scope["auth"] = AuthCredentials()
+        request.scope["user"] = UnauthenticatedUser()
+
+
+async def service_unavailable(request, exc):
+    # no database connection was free within DATABASE_POOL_TIMEOUT
+    await abandon_database(request)
+    template = "503.html"
+    context = {"request": request}
+    headers = {"Retry-After": "1"}
+    return templates.TemplateResponse(
+        template, context, status_code=503, headers=headers
+    )
+
+
+async def database_error(request, exc):
+    # a statement ran past the request's deadline, anything else is a 500
+    if not deadlines.is_timeout(exc):
+        raise exc
+    await abandon_database(request)
+    template = "504.html"
+    context = {"request": request}
+    return templates.TemplateResponse(template, context, status_code=504)
+
+
 error_handlers = {
     404: not_found,
     500: server_error,
+    sa.exc.TimeoutError: service_unavailable,
+    sa.exc.DBAPIError: database_error,
 }
@@ -1,12 +1,14 @@
 from starlette.applications import Starlette
 
 from app import db, exceptions, middleware, routes, settings
+from app.auth import hashers
 
 app = Starlette(
     debug=settings.DEBUG,
     routes=routes.routes,
     middleware=middleware.middleware,
     exception_handlers=exceptions.error_handlers,  # type: ignore
+    on_shutdown=[hashers.executor.shutdown],
 )
 
 if settings.SENTRY_DSN:
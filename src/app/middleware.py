@@ -1,21 +1,118 @@
-import json
+import asyncio
+import inspect
+import time
 import typing
-from base64 import b64decode, b64encode
 
 import itsdangerous
 from itsdangerous.exc import BadTimeSignature, SignatureExpired
-from starlette.datastructures import MutableHeaders, Secret
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.authentication import (
+    AuthCredentials,
+    AuthenticationBackend,
+    UnauthenticatedUser,
+)
+from starlette.datastructures import Headers, MutableHeaders, Secret
 from starlette.middleware import Middleware
 from starlette.middleware.authentication import AuthenticationMiddleware
 from starlette.middleware.cors import CORSMiddleware
-from starlette.requests import HTTPConnection
+from starlette.requests import ClientDisconnect, HTTPConnection
+from starlette.routing import BaseRoute, Host, Match, Mount
 from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from app import settings
-from app.auth.backends import AuthBackend
+from app.auth.backends import (
+    AuthBackend,
+    LazyAuthentication,
+    LazyCredentials,
+    LazyUser,
+)
+from app.auth.cache import user_cache
+from app.auth.snapshot import session_snapshot
+from app.db import db
+from app.utils import deadlines, queries, sessions
+from app.utils.database import Database
+from app.utils.sessions import BaseSessionBackend
+
+
+def is_excluded(scope: Scope, exclude_paths: typing.Sequence[str]) -> bool:
+    """Whether the request path is, or is below, one of ``exclude_paths``."""
+
+    path = scope["path"]
+    return any(
+        path == prefix or path.startswith(prefix.rstrip("/") + "/")
+        for prefix in exclude_paths
+    )
+
+
+def find_endpoint(routes: typing.Sequence[BaseRoute], scope: Scope) -> typing.Any:
+    """The endpoint among ``routes`` a request will be routed to, if any."""
+
+    for route in routes:
+        match, child_scope = route.matches(scope)
+        if match == Match.FULL:
+            if isinstance(route, (Mount, Host)):
+                return find_endpoint(route.routes, {**scope, **child_scope})
+            return child_scope.get("endpoint")
+    return None
+
+
+class Session(dict):
+    """
+    A dict that records whether it has been changed, so an unchanged session
+    doesn't have to be sent back to the client. Changing a value in place, ie
+    ``session["items"].append(...)``, isn't seen, set ``modified = True``.
+    """
+
+    def __init__(self, *args: typing.Any, **kwargs: typing.Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.modified = False
+
+    def __setitem__(self, key: typing.Any, value: typing.Any) -> None:
+        if key not in self or self[key] != value:
+            self.modified = True
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key: typing.Any) -> None:
+        super().__delitem__(key)
+        self.modified = True
+
+    def clear(self) -> None:
+        if self:
+            self.modified = True
+        super().clear()
+
+    def pop(self, key: typing.Any, *args: typing.Any) -> typing.Any:
+        if key in self:
+            self.modified = True
+        return super().pop(key, *args)
+
+    def popitem(self) -> typing.Tuple[typing.Any, typing.Any]:
+        item = super().popitem()
+        self.modified = True
+        return item
+
+    def setdefault(self, key: typing.Any, default: typing.Any = None) -> typing.Any:
+        if key not in self:
+            self.modified = True
+        return super().setdefault(key, default)
+
+    def update(self, *args: typing.Any, **kwargs: typing.Any) -> None:
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
 
 
 class SessionMiddleware:
+    """
+    Sessions keyed by a signed cookie. The ``backend`` decides whether the key
+    is the session data itself or an id for data stored on the server, and
+    defaults to storing it in the cookie. The session is loaded once per
+    request and saved once, only when it has been changed or when the cookie
+    is older than ``refresh_fraction`` of ``max_age`` so that active sessions
+    keep rolling forward. When the session's ``"user"`` changes, on login or
+    logout, it is saved under a new key and the old one is deleted, so a key
+    known before logging in can't be used to act as the user.
+    """
+
     def __init__(
         self,
         app: ASGIApp,
@@ -25,42 +122,72 @@ class SessionMiddleware:
         same_site: str = "lax",
         https_only: bool = False,
         cookie_path: str = "",
+        exclude_paths: typing.Sequence[str] = (),
+        refresh_fraction: float = 0.5,
+        backend: typing.Optional[BaseSessionBackend] = None,
     ) -> None:
         self.app = app
+        self.backend = backend or sessions.get_backend()
         self.signer = itsdangerous.TimestampSigner(str(secret_key))
         self.session_cookie = session_cookie
         self.max_age = max_age
+        self.refresh_age = max_age * refresh_fraction
         self.security_flags = "httponly; samesite=" + same_site
         if https_only:  # Secure flag can be used with HTTPS only
             self.security_flags += "; secure"
         self.cookie_path = cookie_path
+        self.exclude_paths = exclude_paths
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         if scope["type"] not in ("http", "websocket"):  # pragma: no cover
             await self.app(scope, receive, send)
             return
 
+        if is_excluded(scope, self.exclude_paths):
+            # no cookie is read or written
+            scope["session"] = Session()
+            await self.app(scope, receive, send)
+            return
+
         connection = HTTPConnection(scope)
         initial_session_was_empty = True
+        needs_refresh = False
+        key = None
+        scope["session"] = Session()
 
         if self.session_cookie in connection.cookies:
             data = connection.cookies[self.session_cookie].encode("utf-8")
             try:
-                data = self.signer.unsign(data, max_age=self.max_age)
-                scope["session"] = json.loads(b64decode(data))
-                initial_session_was_empty = False
+                data, signed_at = self.signer.unsign(
+                    data, max_age=self.max_age, return_timestamp=True
+                )
+                signed_key = data.decode("utf-8")
+                session_data = await self.backend.load(signed_key)
+                if session_data is not None:
+                    # an unknown key isn't reused, a new one is made on save
+                    key = signed_key
+                    scope["session"] = Session(session_data)
+                    initial_session_was_empty = False
+                    age = time.time() - signed_at.timestamp()
+                    needs_refresh = age > self.refresh_age
             except (BadTimeSignature, SignatureExpired):
-                scope["session"] = {}
-        else:
-            scope["session"] = {}
+                pass
+        initial_user = scope["session"].get("user")
 
         async def send_wrapper(message: Message) -> None:
+            nonlocal key
             if message["type"] == "http.response.start":
                 path = self.cookie_path or scope.get("root_path", "/")
-                if scope["session"]:
-                    # We have session data to persist.
-                    data = b64encode(json.dumps(scope["session"]).encode("utf-8"))
-                    data = self.signer.sign(data)
+                session = scope["session"]
+                modified = getattr(session, "modified", True)
+                if session and (modified or needs_refresh):
+                    if key is not None and session.get("user") != initial_user:
+                        # a new key for a new user, one planted before is useless
+                        await self.backend.delete(key)
+                        key = None
+                    # We have changed session data to persist.
+                    key = await self.backend.save(key, session, self.max_age)
+                    data = self.signer.sign(key.encode("utf-8"))
                     headers = MutableHeaders(scope=message)
                     header_value = "%s=%s; path=%s; Max-Age=%d; %s" % (
                         self.session_cookie,
@@ -70,8 +197,10 @@ class SessionMiddleware:
                         self.security_flags,
                     )
                     headers.append("Set-Cookie", header_value)
-                elif not initial_session_was_empty:
+                elif not session and not initial_session_was_empty:
                     # The session has been cleared.
+                    if key is not None:
+                        await self.backend.delete(key)
                     headers = MutableHeaders(scope=message)
                     header_value = "{}={}; {}".format(
                         self.session_cookie,
@@ -84,8 +213,278 @@ class SessionMiddleware:
         await self.app(scope, receive, send_wrapper)
 
 
+class QueryStatsMiddleware:
+    """
+    Record the statements each http request runs, see ``app.utils.queries``,
+    and with ``server_timing`` add a ``Server-Timing`` header with the time
+    spent in them. It goes outside the other middleware so that statements
+    they run, such as loading the user, count too.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        server_timing: bool = True,
+        exclude_paths: typing.Sequence[str] = (),
+    ) -> None:
+        self.app = app
+        self.server_timing = server_timing
+        self.exclude_paths = exclude_paths
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or is_excluded(scope, self.exclude_paths):
+            await self.app(scope, receive, send)
+            return
+
+        with queries.track(scope) as request_queries:
+
+            async def send_wrapper(message: Message) -> None:
+                if self.server_timing and message["type"] == "http.response.start":
+                    # after the commit, which is sent as the response starts
+                    headers = MutableHeaders(scope=message)
+                    headers.append("Server-Timing", request_queries.server_timing())
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
+
+
+class DatabaseSessionMiddleware:
+    """
+    Wrap each http request in a ``Database.unit_of_work`` so that the auth
+    backend, endpoints and ``ModelBase`` helpers share one session.
+    When the database has replicas, a request that writes sets ``pin_cookie``
+    so the client's requests read from the primary, and see their own writes,
+    for the database's ``read_your_writes`` seconds. It has the ``same_site``
+    and ``https_only`` flags of the session cookie.
+
+    Each request has ``deadline`` seconds for its statements, see
+    ``app.utils.deadlines``, and, with ``cancel_on_disconnect``, a request
+    whose client disconnects before the response starts is cancelled and its
+    unit of work rolled back, rather than left running queries nobody will see.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        database: Database,
+        exclude_paths: typing.Sequence[str] = (),
+        pin_cookie: str = "db_pin",
+        same_site: str = "lax",
+        https_only: bool = False,
+        deadline: typing.Optional[float] = None,
+        cancel_on_disconnect: bool = True,
+    ) -> None:
+        self.app = app
+        self.database = database
+        self.exclude_paths = exclude_paths
+        self.pin_cookie = pin_cookie
+        self.security_flags = "httponly; samesite=" + same_site
+        if https_only:
+            self.security_flags += "; secure"
+        self.deadline = deadline
+        self.cancel_on_disconnect = cancel_on_disconnect
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or is_excluded(scope, self.exclude_paths):
+            await self.app(scope, receive, send)
+            return
+
+        replicas = bool(self.database.replicas)
+        pinned = replicas and self.pin_cookie in HTTPConnection(scope).cookies
+
+        try:
+            with deadlines.within(self.deadline):
+                async with self.database.unit_of_work(pinned=pinned) as session:
+
+                    async def send_wrapper(message: Message) -> None:
+                        if message["type"] == "http.response.start":
+                            # Commit before the response goes out so a client
+                            # following a redirect will see the changes.
+                            # Anything done after this, such as background
+                            # tasks, is committed on exit.
+                            await session.commit()
+                            if replicas and session.info.get("wrote"):
+                                headers = MutableHeaders(scope=message)
+                                header_value = "%s=1; path=/; Max-Age=%d; %s" % (
+                                    self.pin_cookie,
+                                    self.database.read_your_writes,
+                                    self.security_flags,
+                                )
+                                headers.append("Set-Cookie", header_value)
+                        await send(message)
+
+                    if self.cancel_on_disconnect:
+                        await self.run_until_disconnect(
+                            scope, receive, send_wrapper, session
+                        )
+                    else:
+                        await self.app(scope, receive, send_wrapper)
+        except ClientDisconnect:
+            # rolled back, and there is nobody to send a response to
+            pass
+
+    async def run_until_disconnect(
+        self, scope: Scope, receive: Receive, send: Send, session: AsyncSession
+    ) -> None:
+        """
+        Run the app, cancelling it and the statement ``session`` is running,
+        and raising ``ClientDisconnect``, if the client disconnects before the
+        response starts. Disconnects are only seen once the app has read the
+        request body, which isn't buffered.
+        """
+
+        loop = asyncio.get_running_loop()
+        # messages received after the body, for the app once it asks for them
+        messages: asyncio.Queue = asyncio.Queue()
+        body_read = asyncio.Event()
+        response_started = False
+        disconnected = False
+
+        headers = Headers(scope=scope)
+        if headers.get("content-length", "0") == "0" and (
+            "transfer-encoding" not in headers
+        ):
+            body_read.set()
+
+        async def receive_wrapper() -> Message:
+            if not body_read.is_set():
+                message = await receive()
+                if message["type"] != "http.request" or not message.get(
+                    "more_body", False
+                ):
+                    body_read.set()
+                return message
+            message = await messages.get()
+            if message["type"] == "http.disconnect":
+                messages.put_nowait(message)  # for anything asking again
+            return message
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal response_started
+            if disconnected:
+                # ie the error response of the cancelled statement
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        async def watch() -> None:
+            nonlocal disconnected
+            await body_read.wait()
+            while True:
+                message = await receive()
+                messages.put_nowait(message)
+                if message["type"] == "http.disconnect":
+                    if not response_started:
+                        disconnected = True
+                        await deadlines.cancel(session)
+                        task.cancel()
+                    return
+
+        async def run() -> None:
+            await self.app(scope, receive_wrapper, send_wrapper)
+
+        task: asyncio.Task = loop.create_task(run())
+        watcher = loop.create_task(watch())
+        try:
+            await task
+        except BaseException:
+            if not disconnected:
+                raise
+        finally:
+            watcher.cancel()
+        if disconnected:
+            raise ClientDisconnect()
+
+
+class LazyAuthenticationMiddleware(AuthenticationMiddleware):
+    """
+    As ``AuthenticationMiddleware``, but ``request.user`` and ``request.auth``
+    are proxies and the backend only runs when one of them is first used by
+    an endpoint that allows it, see ``is_lazy``. Other endpoints, such as
+    those using ``starlette.authentication.requires``, have the user loaded
+    before they run. Requests to ``exclude_paths`` are always unauthenticated.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        backend: AuthenticationBackend,
+        exclude_paths: typing.Sequence[str] = (),
+        **kwargs: typing.Any,
+    ) -> None:
+        super().__init__(app, backend, **kwargs)
+        self.exclude_paths = exclude_paths
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        if is_excluded(scope, self.exclude_paths):
+            scope["auth"], scope["user"] = AuthCredentials(), UnauthenticatedUser()
+            await self.app(scope, receive, send)
+            return
+
+        auth = LazyAuthentication(self.backend, HTTPConnection(scope))
+        scope["auth"], scope["user"] = LazyCredentials(auth), LazyUser(auth)
+        if not self.is_lazy(scope):
+            await auth.resolve()
+        await self.app(scope, receive, send)
+
+    def is_lazy(self, scope: Scope) -> bool:
+        """
+        Whether the endpoint the request is routed to can load the user on
+        first use. Sync endpoints can, as they run in a thread that can wait
+        for it, and async ones marked with ``app.auth.decorators.lazy_user``,
+        as ``requires`` does, load it themselves. Async code can't wait for it
+        when it is first used, so any other endpoint can't.
+        """
+
+        if scope["type"] != "http":
+            return False
+        endpoint = find_endpoint(getattr(scope.get("app"), "routes", ()), scope)
+        if inspect.isclass(endpoint):
+            # a HTTPEndpoint, which handles HEAD with get unless it has head
+            method = scope["method"].lower()
+            if method == "head" and not hasattr(endpoint, "head"):
+                method = "get"
+            endpoint = getattr(endpoint, method, None)
+        if not (inspect.isfunction(endpoint) or inspect.ismethod(endpoint)):
+            return False
+        return getattr(endpoint, "lazy_user", False) or not (
+            asyncio.iscoroutinefunction(endpoint)
+        )
+
+
 middleware = [
+    Middleware(
+        QueryStatsMiddleware,
+        server_timing=settings.SERVER_TIMING,
+        exclude_paths=settings.MIDDLEWARE_EXCLUDED_PATHS,
+    ),
     Middleware(CORSMiddleware, allow_origins=settings.ALLOWED_HOSTS),
-    Middleware(SessionMiddleware, secret_key=settings.SECRET_KEY, cookie_path="/"),
-    Middleware(AuthenticationMiddleware, backend=AuthBackend()),
+    # outside the session middleware so a database session backend shares
+    # the request's unit of work
+    Middleware(
+        DatabaseSessionMiddleware,
+        database=db,
+        exclude_paths=settings.MIDDLEWARE_EXCLUDED_PATHS,
+        same_site=settings.SESSION_SAME_SITE,
+        https_only=settings.SESSION_HTTPS_ONLY,
+        deadline=settings.REQUEST_DEADLINE or None,
+    ),
+    Middleware(
+        SessionMiddleware,
+        secret_key=settings.SECRET_KEY,
+        cookie_path="/",
+        same_site=settings.SESSION_SAME_SITE,
+        https_only=settings.SESSION_HTTPS_ONLY,
+        exclude_paths=settings.MIDDLEWARE_EXCLUDED_PATHS,
+    ),
+    Middleware(
+        LazyAuthenticationMiddleware,
+        backend=AuthBackend(cache=user_cache, snapshot=session_snapshot),
+        exclude_paths=settings.MIDDLEWARE_EXCLUDED_PATHS,
+    ),
 ]
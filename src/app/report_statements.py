@@ -0,0 +1,70 @@
+import argparse
+import asyncio
+import json
+import sys
+import typing
+
+from app.db import db
+from app.utils import statements
+
+
+def write(rows) -> None:
+    for row in rows:
+        sys.stdout.write(
+            f"{row['total_time']:10.1f}ms {row['mean_time']:8.2f}ms/call "
+            f"{row['calls']:8d} calls {row['rows']:9d} rows {row['share']:6.1%}"
+            f"  {', '.join(row['models']) or '-'}\n"
+        )
+        sys.stdout.write(f"    {statements.key(row['query'])[:200]}\n")
+
+
+async def report(
+    by: str = "total_time",
+    limit: int = 20,
+    save: typing.Optional[str] = None,
+    since: typing.Optional[str] = None,
+    reset: bool = False,
+) -> int:
+    async with db.engine.connect() as conn:
+        if not await statements.available(conn):
+            sys.stderr.write(
+                "pg_stat_statements isn't installed, it must be in "
+                "shared_preload_libraries and CREATE EXTENSION pg_stat_statements "
+                "run in the database\n"
+            )
+            return 1
+        stats = await statements.snapshot(conn)
+        if reset:
+            await statements.reset(conn)
+            await conn.commit()
+    await db.engine.dispose()
+
+    if save:
+        with open(save, "w") as f:
+            json.dump(stats, f)
+        sys.stdout.write(f"Saved {len(stats)} statements to {save}\n")
+    if since:
+        with open(since) as f:
+            stats = statements.diff(json.load(f), stats)
+        sys.stdout.write(f"Statements run since {since}, by {by}:\n")
+    else:
+        sys.stdout.write(f"Statements by {by}:\n")
+
+    rows = statements.top(stats, by, limit)
+    write(statements.attribute(rows, statements.model_tables()))
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Report the statements in pg_stat_statements that cost the most."
+    )
+    parser.add_argument("--by", choices=statements.ORDERINGS, default="total_time")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--save", help="save a snapshot to this file to diff later")
+    parser.add_argument("--since", help="report the difference from this snapshot")
+    parser.add_argument("--reset", action="store_true", help="reset the stats")
+    args = parser.parse_args()
+    sys.exit(
+        asyncio.run(report(args.by, args.limit, args.save, args.since, args.reset))
+    )
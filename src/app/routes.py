@@ -2,9 +2,11 @@ from starlette.routing import Mount, Route
 
 from app import endpoints, static
 from app.auth.app import app as auth_app
+from app.debug.app import app as debug_app
 
 routes = [
     Route("/", endpoints.Home, methods=["GET"], name="home"),
     Mount("/auth", app=auth_app, name="auth"),
+    Mount("/debug", app=debug_app, name="debug"),
     Mount("/static", app=static.app, name="static"),
 ]
@@ -9,8 +9,87 @@ config = Config()
 # base
 ALLOWED_HOSTS = config("ALLOWED_HOSTS", cast=CommaSeparatedStrings)
 DATABASE_URL = config("DATABASE_URL", cast=make_url)
+# read only replicas of DATABASE_URL, see ModelBase.execute_read
+DATABASE_REPLICA_URLS = config(
+    "DATABASE_REPLICA_URLS", cast=CommaSeparatedStrings, default=""
+)
+# the connection pool of each worker, for the primary and each replica
+DATABASE_POOL_SIZE = config("DATABASE_POOL_SIZE", cast=int, default=5)
+DATABASE_MAX_OVERFLOW = config("DATABASE_MAX_OVERFLOW", cast=int, default=10)
+DATABASE_POOL_TIMEOUT = config("DATABASE_POOL_TIMEOUT", cast=float, default=30)
+DATABASE_POOL_RECYCLE = config("DATABASE_POOL_RECYCLE", cast=int, default=-1)
+DATABASE_POOL_PRE_PING = config("DATABASE_POOL_PRE_PING", cast=bool, default=False)
+# log statements slower than this many seconds, 0 to disable
+DATABASE_SLOW_QUERY_THRESHOLD = config(
+    "DATABASE_SLOW_QUERY_THRESHOLD", cast=float, default=0.5
+)
+# in debug or staging, run slow or sampled SELECTs again with EXPLAIN ANALYZE
+DATABASE_EXPLAIN = config("DATABASE_EXPLAIN", cast=bool, default=False)
+DATABASE_EXPLAIN_THRESHOLD = config(
+    "DATABASE_EXPLAIN_THRESHOLD", cast=float, default=DATABASE_SLOW_QUERY_THRESHOLD
+)
+DATABASE_EXPLAIN_SAMPLE_RATE = config(
+    "DATABASE_EXPLAIN_SAMPLE_RATE", cast=float, default=0
+)
+DATABASE_EXPLAIN_SEQ_SCAN_ROWS = config(
+    "DATABASE_EXPLAIN_SEQ_SCAN_ROWS", cast=int, default=10000
+)
+# an external pooler between the app and postgres, "" or "pgbouncer"
+DATABASE_POOLER = config("DATABASE_POOLER", default="")
+# prepared statements asyncpg keeps per connection, which pgbouncer can't
+DATABASE_STATEMENT_CACHE_SIZE = config(
+    "DATABASE_STATEMENT_CACHE_SIZE",
+    cast=int,
+    default=0 if DATABASE_POOLER == "pgbouncer" else 100,
+)
+# read outside a transaction, see ModelBase.fetch, which pgbouncer can't either
+DATABASE_AUTOCOMMIT_READS = config(
+    "DATABASE_AUTOCOMMIT_READS",
+    cast=bool,
+    default=DATABASE_POOLER != "pgbouncer",
+)
+# seconds a read shared between requests may take, see app.utils.singleflight
+DATABASE_SHARED_READ_TIMEOUT = config(
+    "DATABASE_SHARED_READ_TIMEOUT", cast=float, default=10
+)
+DATABASE_REPLICA_STRATEGY = config("DATABASE_REPLICA_STRATEGY", default="round_robin")
+DATABASE_READ_YOUR_WRITES = config("DATABASE_READ_YOUR_WRITES", cast=int, default=5)
+# where the rows of models that set __cache__ are cached, see app.utils.rowcache
+MODEL_CACHE_BACKEND = config(
+    "MODEL_CACHE_BACKEND", default="app.utils.cache.MemoryCacheBackend"
+)
 DEBUG = config("DEBUG", cast=bool, default=False)
 SECRET_KEY = config("SECRET_KEY", cast=Secret)
+SESSION_BACKEND = config(
+    "SESSION_BACKEND", default="app.utils.sessions.backends.CookieSessionBackend"
+)
+# how the cookie session backend encodes sessions
+SESSION_CODEC = config(
+    "SESSION_CODEC", default="app.utils.sessions.codecs.JSONSessionCodec"
+)
+SESSION_COMPRESS_MIN_SIZE = config("SESSION_COMPRESS_MIN_SIZE", cast=int, default=512)
+# flags of the session cookie, and of the cookie pinning reads to the primary
+SESSION_SAME_SITE = config("SESSION_SAME_SITE", default="lax")
+SESSION_HTTPS_ONLY = config("SESSION_HTTPS_ONLY", cast=bool, default=False)
+# seconds each request's database statements have to finish, 0 for no limit
+REQUEST_DEADLINE = config("REQUEST_DEADLINE", cast=float, default=0)
+# add a Server-Timing header with the time each request spent in the database
+SERVER_TIMING = config("SERVER_TIMING", cast=bool, default=True)
+# paths that skip the session, database session and authentication middleware
+MIDDLEWARE_EXCLUDED_PATHS = config(
+    "MIDDLEWARE_EXCLUDED_PATHS", cast=CommaSeparatedStrings, default="/static"
+)
+
+# auth, cache users in process for this many seconds, 0 to load them every request
+AUTH_USER_CACHE_TTL = config("AUTH_USER_CACHE_TTL", cast=float, default=0)
+AUTH_USER_CACHE_MAX_ENTRIES = config(
+    "AUTH_USER_CACHE_MAX_ENTRIES", cast=int, default=1000
+)
+# auth, trust a signed copy of the user in the session for this many seconds, 0
+# to disable
+AUTH_SESSION_SNAPSHOT_MAX_AGE = config(
+    "AUTH_SESSION_SNAPSHOT_MAX_AGE", cast=int, default=0
+)
 
 # email
 EMAIL_BACKEND = config(
@@ -29,6 +108,38 @@ EMAIL_TIMEOUT = config("EMAIL_TIMEOUT", cast=int, default=30)
 TESTING = config("TESTING", cast=bool, default=False)
 SENTRY_DSN = config("SENTRY_DSN", cast=URL, default=None)
 
+# passwords
+PASSWORD_HASHING_EXECUTOR = config("PASSWORD_HASHING_EXECUTOR", default="thread")
+PASSWORD_HASHING_WORKERS = config("PASSWORD_HASHING_WORKERS", cast=int, default=None)
+PASSWORD_HASHING_MAX_CONCURRENCY = config(
+    "PASSWORD_HASHING_MAX_CONCURRENCY", cast=int, default=None
+)
+PASSWORD_HASHERS = config(
+    "PASSWORD_HASHERS",
+    cast=CommaSeparatedStrings,
+    default=",".join(
+        [
+            "app.auth.hashers.PBKDF2PasswordHasher",
+            "app.auth.hashers.ScryptPasswordHasher",
+            "app.auth.hashers.Argon2PasswordHasher",
+            "app.auth.hashers.LegacyPBKDF2PasswordHasher",
+        ]
+    ),
+)
+# hashing cost, see `python -m app.calibrate_hashers`. Cheap when testing.
+PASSWORD_PBKDF2_ITERATIONS = config(
+    "PASSWORD_PBKDF2_ITERATIONS", cast=int, default=1000 if TESTING else 100000
+)
+PASSWORD_SCRYPT_WORK_FACTOR = config(
+    "PASSWORD_SCRYPT_WORK_FACTOR", cast=int, default=2**8 if TESTING else 2**14
+)
+PASSWORD_ARGON2_TIME_COST = config(
+    "PASSWORD_ARGON2_TIME_COST", cast=int, default=1 if TESTING else 3
+)
+PASSWORD_ARGON2_MEMORY_COST = config(
+    "PASSWORD_ARGON2_MEMORY_COST", cast=int, default=1024 if TESTING else 65536
+)
+
 # logging
 LOG_LEVEL = config("LOG_LEVEL", default="WARNING")
 LOG_CONFIG = {
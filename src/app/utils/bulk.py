@@ -0,0 +1,202 @@
+import itertools
+import logging
+import time
+import typing
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio.session import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+
+class BulkResult:
+    """
+    The outcome of a bulk insert or upsert, the ids of the rows written when
+    they were asked for, and how many rows each chunk had and how many seconds
+    it took.
+    """
+
+    def __init__(self) -> None:
+        self.ids: typing.List[typing.Any] = []
+        self.chunks: typing.List[typing.Dict[str, typing.Any]] = []
+
+    @property
+    def rowcount(self) -> int:
+        return sum(chunk["rows"] for chunk in self.chunks)
+
+    @property
+    def seconds(self) -> float:
+        return sum(chunk["seconds"] for chunk in self.chunks)
+
+    def add_chunk(self, rows: int, seconds: float) -> None:
+        self.chunks.append({"rows": rows, "seconds": seconds})
+        logger.debug("bulk wrote chunk of %d rows in %.3fs", rows, seconds)
+
+
+def prepare_rows(
+    table: sa.Table, rows: typing.Iterable[dict]
+) -> typing.Tuple[typing.List[sa.Column], typing.Iterator[tuple]]:
+    """
+    Return the columns written and an iterator of each row as a tuple of their
+    values, so that rows are only read as they are written. Every row must
+    have the same keys, the first row's. Columns left out that have a scalar
+    default, such as ``default=True``, are filled in with it.
+    """
+
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return [], iter(())
+
+    keys = list(first)
+    defaults = {
+        column.key: column.default.arg
+        for column in table.columns
+        if column.key not in keys
+        and column.default is not None
+        and column.default.is_scalar
+    }
+    columns = [table.c[key] for key in keys + list(defaults)]
+
+    def records() -> typing.Iterator[tuple]:
+        for row in itertools.chain([first], rows):
+            if len(row) != len(keys) or any(key not in row for key in keys):
+                raise ValueError("every row must have the same keys")
+            yield tuple(row[key] for key in keys) + tuple(defaults.values())
+
+    return columns, records()
+
+
+def chunked(
+    records: typing.Iterable[tuple], size: int
+) -> typing.Iterator[typing.List[tuple]]:
+    records = iter(records)
+    while True:
+        chunk = list(itertools.islice(records, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def insert_statement(
+    table: sa.Table,
+    conflict: typing.Optional[typing.Sequence[str]],
+    update: typing.Optional[typing.Sequence[str]],
+    columns: typing.List[sa.Column],
+    returning: bool,
+):
+    """
+    Return an insert into ``table``. When ``conflict`` names the columns of a
+    unique constraint, rows that clash update the ``update`` columns, all the
+    others by default, or are skipped if ``update`` is empty.
+    """
+
+    qs = postgresql.insert(table)
+    if conflict is not None:
+        if update is None:
+            update = [c.key for c in columns if c.key not in conflict]
+        if update:
+            qs = qs.on_conflict_do_update(
+                index_elements=list(conflict),
+                set_={key: qs.excluded[key] for key in update},
+            )
+        else:
+            qs = qs.on_conflict_do_nothing(index_elements=list(conflict))
+    if returning:
+        qs = qs.returning(table.c.id)
+    return qs
+
+
+def supports_copy(connection) -> bool:
+    return connection.dialect.driver == "asyncpg"
+
+
+async def copy_chunk(
+    session: AsyncSession,
+    table: sa.Table,
+    columns: typing.List[sa.Column],
+    records: typing.List[tuple],
+    qs,
+    returning: bool,
+) -> typing.List[typing.Any]:
+    """
+    COPY ``records`` into a temporary table with asyncpg, then insert them
+    from there with ``qs``. Runs in the session's transaction.
+    """
+
+    connection = await session.connection()
+    preparer = connection.dialect.identifier_preparer
+    # the same name each time keeps the statements cached, it is dropped
+    # before the next chunk and only ever seen by this transaction
+    name = "bulk_" + table.name
+    names = [c.name for c in columns]
+
+    # the same column types as the table, but none of its constraints
+    await session.execute(
+        sa.text(
+            "CREATE TEMPORARY TABLE %s ON COMMIT DROP "
+            "AS SELECT %s FROM %s WITH NO DATA"
+            % (
+                preparer.quote(name),
+                ", ".join(preparer.quote(n) for n in names),
+                preparer.format_table(table),
+            )
+        )
+    )
+    raw = await connection.get_raw_connection()
+    await raw.driver_connection.copy_records_to_table(
+        name, records=records, columns=names
+    )
+
+    temp = sa.table(name, *[sa.column(n) for n in names])
+    result = await session.execute(qs.from_select(names, sa.select(temp)))
+    ids = result.scalars().all() if returning else []
+    await session.execute(sa.text("DROP TABLE %s" % preparer.quote(name)))
+    return ids
+
+
+async def values_chunk(
+    session: AsyncSession,
+    columns: typing.List[sa.Column],
+    records: typing.List[tuple],
+    qs,
+    returning: bool,
+) -> typing.List[typing.Any]:
+    """Insert ``records`` with one multi-row statement, or executemany."""
+
+    rows = [dict(zip([c.key for c in columns], record)) for record in records]
+    if returning:
+        result = await session.execute(qs.values(rows))
+        return result.scalars().all()
+    await session.execute(qs, rows)
+    return []
+
+
+async def write(
+    session: AsyncSession,
+    table: sa.Table,
+    rows: typing.Iterable[dict],
+    conflict: typing.Optional[typing.Sequence[str]] = None,
+    update: typing.Optional[typing.Sequence[str]] = None,
+    chunk_size: int = 5000,
+    returning: bool = False,
+) -> BulkResult:
+    """Write ``rows`` to ``table`` in chunks of ``chunk_size``."""
+
+    result = BulkResult()
+    columns, records = prepare_rows(table, rows)
+    if not columns:
+        return result
+
+    qs = insert_statement(table, conflict, update, columns, returning)
+    use_copy = supports_copy(await session.connection())
+    for chunk in chunked(records, chunk_size):
+        start = time.perf_counter()
+        if use_copy:
+            ids = await copy_chunk(session, table, columns, chunk, qs, returning)
+        else:
+            ids = await values_chunk(session, columns, chunk, qs, returning)
+        result.ids.extend(ids)
+        result.add_chunk(len(chunk), time.perf_counter() - start)
+    return result
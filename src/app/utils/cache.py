@@ -0,0 +1,141 @@
+import time
+import typing
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    An in-process cache whose entries expire ``ttl`` seconds after being set.
+    Once there are ``max_entries`` the least recently used entry is evicted.
+    Hits, misses and evictions are counted in ``stats``.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 60) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: typing.MutableMapping[
+            typing.Hashable, typing.Tuple[float, typing.Any]
+        ]
+        self.entries = OrderedDict()
+        # metrics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def stats(self) -> typing.Dict[str, int]:
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def get(self, key: typing.Hashable, default: typing.Any = None) -> typing.Any:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        expires, value = entry
+        if expires < time.monotonic():
+            del self.entries[key]
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)  # type: ignore
+        self.hits += 1
+        return value
+
+    def set(self, key: typing.Hashable, value: typing.Any) -> None:
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)  # type: ignore
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)  # type: ignore
+            self.evictions += 1
+
+    def delete(self, key: typing.Hashable) -> None:
+        self.entries.pop(key, None)
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+
+class BaseCacheBackend:
+    """
+    Base class for the caches of ``ModelBase`` rows, see ``app.utils.rowcache``.
+    Each model has its own instance, ``namespace`` is its table name, which a
+    cache shared between workers should prefix its keys with. Values are dicts
+    of column values. Subclasses must override get_many(), set_many(),
+    delete_many() and clear(), and should count hits, misses and evictions.
+    """
+
+    def __init__(
+        self, namespace: str = "", ttl: float = 60, max_entries: int = 1000
+    ) -> None:
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    @property
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        return {}
+
+    async def get_many(
+        self, keys: typing.Iterable[typing.Hashable]
+    ) -> typing.Dict[typing.Hashable, typing.Any]:
+        """Return the values found for ``keys``, by key."""
+
+        msg = "subclasses of BaseCacheBackend must override get_many() method"
+        raise NotImplementedError(msg)
+
+    async def set_many(self, values: typing.Dict[typing.Hashable, typing.Any]) -> None:
+        msg = "subclasses of BaseCacheBackend must override set_many() method"
+        raise NotImplementedError(msg)
+
+    async def delete_many(self, keys: typing.Iterable[typing.Hashable]) -> None:
+        msg = "subclasses of BaseCacheBackend must override delete_many() method"
+        raise NotImplementedError(msg)
+
+    async def clear(self) -> None:
+        msg = "subclasses of BaseCacheBackend must override clear() method"
+        raise NotImplementedError(msg)
+
+
+class MemoryCacheBackend(BaseCacheBackend):
+    """
+    Caches in this process with a ``TTLCache``. Other workers won't see its
+    invalidations, so only suitable when running a single worker.
+    """
+
+    def __init__(
+        self, namespace: str = "", ttl: float = 60, max_entries: int = 1000
+    ) -> None:
+        super().__init__(namespace, ttl, max_entries)
+        self.cache = TTLCache(max_entries=max_entries, ttl=ttl)
+
+    @property
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        stats: typing.Dict[str, typing.Any] = dict(self.cache.stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    async def get_many(
+        self, keys: typing.Iterable[typing.Hashable]
+    ) -> typing.Dict[typing.Hashable, typing.Any]:
+        found = {}
+        for key in keys:
+            value = self.cache.get(key)
+            if value is not None:
+                found[key] = value
+        return found
+
+    async def set_many(self, values: typing.Dict[typing.Hashable, typing.Any]) -> None:
+        for key, value in values.items():
+            self.cache.set(key, value)
+
+    async def delete_many(self, keys: typing.Iterable[typing.Hashable]) -> None:
+        for key in keys:
+            self.cache.delete(key)
+
+    async def clear(self) -> None:
+        self.cache.clear()
@@ -1,17 +1,51 @@
+import asyncio
+import itertools
+import logging
+import time
+import typing
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
 import sqlalchemy as sa
 from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.ext.asyncio.engine import AsyncEngine
 from sqlalchemy.ext.asyncio.session import AsyncSession
 from sqlalchemy.ext.declarative import as_declarative, declared_attr
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import attributes, sessionmaker, util
 from starlette.exceptions import HTTPException
 
+from app.utils import (
+    bulk,
+    deadlines,
+    loader,
+    pagination,
+    queries,
+    rowcache,
+    singleflight,
+)
+
+logger = logging.getLogger(__name__)
+
 metadata = sa.MetaData()
 
+# errors that mean a replica can't be reached, rather than a problem with a query
+REPLICA_ERRORS = (
+    OSError,
+    asyncio.TimeoutError,
+    sa.exc.OperationalError,
+    sa.exc.InterfaceError,
+)
+
+# the session bound to the current request (or other unit of work), if any
+_current_session: ContextVar[typing.Optional[AsyncSession]] = ContextVar(
+    "current_session", default=None
+)
+
 
 @as_declarative(metadata=metadata)
 class ModelBase:
     metadata: sa.MetaData = metadata
+    registry: sa.orm.registry
     db: "Database"
 
     @declared_attr
@@ -20,15 +54,423 @@ class ModelBase:
 
     @classmethod
     async def execute(cls, qs):
+        session = cls.db.current_session
+        if session is not None:
+            if getattr(qs, "is_select", False):
+                return await session.execute(qs)
+            _mark_written(session)
+            result = await session.execute(qs)
+            await rowcache.invalidate(session)
+            return result
+
         async with cls.db.session() as session:
             async with session.begin():
-                return await session.execute(qs)
+                result = await session.execute(qs)
+            await rowcache.invalidate(session, committed=True)
+            return result
+
+    @classmethod
+    @asynccontextmanager
+    async def read_session(
+        cls, autocommit: bool = True
+    ) -> typing.AsyncIterator[AsyncSession]:
+        """
+        A session for read only queries. It is on a replica when there is one
+        to use, see ``Database.get_replica``, otherwise it is the current unit
+        of work or a new session on the primary. New sessions are in autocommit
+        mode, which saves the BEGIN and COMMIT around each query, unless
+        ``autocommit`` is False, as server side cursors need a transaction,
+        there is a deadline, as its ``statement_timeout`` is set per
+        transaction, or the database's ``autocommit_reads`` is off.
+        """
+
+        if deadlines.remaining() is not None or not cls.db.autocommit_reads:
+            autocommit = False
+        replica = cls.db.get_replica()
+        if replica is not None:
+            session = replica.read_session() if autocommit else replica.session()
+            try:
+                # connect now so an unhealthy replica can be skipped
+                await session.connection()
+            except REPLICA_ERRORS as e:
+                replica.mark_unhealthy(e)
+                await session.close()
+            else:
+                try:
+                    yield session
+                finally:
+                    await session.close()
+                return
+
+        session = cls.db.current_session
+        if session is not None:
+            yield session
+            return
+
+        if autocommit:
+            async with cls.db.read_session() as session:
+                yield session
+            return
+
+        async with cls.db.session() as session:
+            async with session.begin():
+                yield session
+
+    @classmethod
+    async def execute_read(cls, qs):
+        """
+        As ``execute`` but for a read only query, which runs on a replica when
+        there is one. Instances loaded from a replica are detached, they can
+        still be saved.
+        """
+
+        async with cls.read_session() as session:
+            return await session.execute(qs)
+
+    @classmethod
+    async def fetch(cls, qs) -> typing.List[typing.Any]:
+        """
+        Return the rows of the read only query ``qs``. Outside of a unit of
+        work it runs in autocommit mode, without a transaction, so costs one
+        round trip to the database rather than three, unless the database's
+        ``autocommit_reads`` is off. Use ``execute`` or ``transaction`` for
+        anything that writes.
+        """
+
+        return (await cls.execute_read(qs)).all()
+
+    @classmethod
+    async def scalars(cls, qs) -> typing.List[typing.Any]:
+        """As ``fetch`` but returns the first column of each row, or instances."""
+
+        return (await cls.execute_read(qs)).scalars().all()
+
+    @classmethod
+    async def first(cls, qs) -> typing.Any:
+        """As ``scalars`` but returns the first, or None when there are none."""
+
+        return (await cls.execute_read(qs)).scalars().first()
+
+    @classmethod
+    @asynccontextmanager
+    async def transaction(cls) -> typing.AsyncIterator[AsyncSession]:
+        """
+        Run the writes within it in one transaction, which is committed on
+        exit or rolled back on error. In a unit of work it is a savepoint, so
+        an error only undoes the writes made within it::
+
+            async with User.transaction():
+                await user.save()
+                await User.update_where(User.id.in_(ids), is_active=False)
+        """
+
+        session = cls.db.current_session
+        if session is not None:
+            async with session.begin_nested():
+                yield session
+            return
+
+        async with cls.db.unit_of_work() as session:
+            yield session
+
+    @classmethod
+    async def stream(
+        cls, qs, batch_size: int = 1000
+    ) -> typing.AsyncIterator[typing.List[typing.Any]]:
+        """
+        Run the read only query ``qs`` with a server side cursor and yield its
+        results in lists of up to ``batch_size``, so that only one batch is in
+        memory at a time. Selects of a single entity or column yield those,
+        others yield rows. The cursor is closed when the loop ends, early or
+        not, and the generator is closed::
+
+            async for users in User.stream(sa.select(User), batch_size=500):
+                ...
+        """
+
+        qs = qs.execution_options(yield_per=batch_size)
+        async with cls.read_session(autocommit=False) as session:
+            result = await session.stream(qs)
+            try:
+                if len(qs.column_descriptions) == 1:
+                    partitions = result.scalars().partitions(batch_size)
+                else:
+                    partitions = result.partitions(batch_size)
+                async for partition in partitions:
+                    yield partition
+            finally:
+                await result.close()
+
+    @classmethod
+    async def paginate(
+        cls,
+        qs,
+        order_by: typing.Sequence[typing.Any] = (),
+        after: typing.Optional[str] = None,
+        limit: int = 20,
+    ) -> pagination.Page:
+        """
+        Return a page of up to ``limit`` results of the read only query ``qs``
+        sorted by ``order_by``, columns or ``column.desc()``, starting after the
+        ``after`` cursor taken from the previous page's ``next_cursor``. Pages
+        are found by their sort keys rather than an offset, so every page costs
+        the same. ``id`` is added to the sort to break ties and the sort keys
+        mustn't be null. When selecting columns rather than an entity, any sort
+        keys not selected are added to the end of each row. Raises a 400
+        ``HTTPException`` for an invalid cursor::
+
+            page = await User.paginate(sa.select(User), [User.email])
+            page = await User.paginate(
+                sa.select(User), [User.email], after=page.next_cursor
+            )
+        """
+
+        keys = pagination.sort_keys(order_by, cls.id)
+        pagination.check_index(keys)
+
+        if after:
+            try:
+                values = pagination.decode_cursor(keys, after)
+            except ValueError:
+                raise HTTPException(status_code=400)
+            qs = qs.where(pagination.keyset_filter(keys, values))
+        qs = qs.order_by(*[key.order_by() for key in keys]).limit(limit + 1)
+
+        # a select of one column is still rows, only a model is an entity
+        descriptions = qs.column_descriptions
+        entity = (
+            len(descriptions) == 1
+            and descriptions[0]["expr"] is descriptions[0]["entity"]
+        )
+        if not entity:
+            selected = set(qs.selected_columns.keys())
+            missing = [key.column for key in keys if key.column_name not in selected]
+            qs = qs.add_columns(*missing)
+
+        result = await cls.execute_read(qs)
+        items = result.scalars().all() if entity else result.all()
+
+        next_cursor = None
+        if len(items) > limit:
+            items = items[:limit]
+            values = [key.value(items[-1]) for key in keys]
+            next_cursor = pagination.encode_cursor(keys, values)
+        return pagination.Page(items, next_cursor)
+
+    @classmethod
+    async def bulk_insert(
+        cls,
+        rows: typing.Iterable[dict],
+        chunk_size: int = 5000,
+        returning: bool = False,
+    ) -> bulk.BulkResult:
+        """
+        Insert ``rows``, dicts of column values with the same keys, in chunks
+        of ``chunk_size``. On asyncpg each chunk is copied into a temporary
+        table and inserted from there, other drivers use multi-row inserts.
+        All chunks are written in one transaction, or in a savepoint of the
+        unit of work. The result has the new ids when ``returning`` and the
+        timing of each chunk. No ORM events run for the rows.
+        """
+
+        return await cls._bulk_write(rows, chunk_size=chunk_size, returning=returning)
+
+    @classmethod
+    async def bulk_upsert(
+        cls,
+        rows: typing.Iterable[dict],
+        conflict: typing.Sequence[str] = ("id",),
+        update: typing.Optional[typing.Sequence[str]] = None,
+        chunk_size: int = 5000,
+        returning: bool = False,
+    ) -> bulk.BulkResult:
+        """
+        As ``bulk_insert``, but rows that clash on the ``conflict`` columns,
+        which must have a unique index, update the ``update`` columns instead.
+        By default every other column is updated, if ``update`` is empty those
+        rows are skipped.
+        """
+
+        return await cls._bulk_write(
+            rows,
+            conflict=conflict,
+            update=update,
+            chunk_size=chunk_size,
+            returning=returning,
+        )
+
+    @classmethod
+    async def _bulk_write(cls, rows, **kwargs) -> bulk.BulkResult:
+        table = cls.__table__  # type: ignore
+        session = cls.db.current_session
+        if session is not None:
+            _mark_written(session)
+            async with session.begin_nested():
+                result = await bulk.write(session, table, rows, **kwargs)
+            await rowcache.invalidate(session)
+            return result
+
+        async with cls.db.session() as session:
+            async with session.begin():
+                result = await bulk.write(session, table, rows, **kwargs)
+            await rowcache.invalidate(session, committed=True)
+            return result
+
+    @classmethod
+    async def update(cls, ident, **values) -> typing.List[typing.Any]:
+        """
+        Set ``values`` on the row ``ident``, an id, a list of ids or an
+        instance, with one ``UPDATE ... RETURNING`` and without loading it.
+        Returns the ids of the rows updated, see ``update_where``::
+
+            await User.update(user, last_login=datetime.utcnow())
+        """
+
+        instance = None
+        if isinstance(ident, ModelBase):
+            instance, ident = ident, ident.id
+        if isinstance(ident, (list, tuple, set)):
+            criteria = cls.id.in_(list(ident))
+        else:
+            criteria = cls.id == ident
+        return await cls._update(criteria, values, instance)
+
+    @classmethod
+    async def update_where(cls, *criteria, **values) -> typing.List[typing.Any]:
+        """
+        Set ``values`` on every row matching ``criteria`` with one ``UPDATE
+        ... RETURNING`` and return the ids of the rows updated. Instances of
+        those rows in the unit of work are given the new values, and caches
+        listening for statements on the table can invalidate them by id.
+        Values may be SQL expressions, ie ``count=Model.count + 1``.
+        """
+
+        return await cls._update(sa.and_(*criteria), values)
+
+    @classmethod
+    async def _update(cls, criteria, values, instance=None):
+        table = cls.__table__  # type: ignore
+        columns = [table.c[key] for key in values]
+        qs = (
+            sa.update(table)
+            .where(criteria)
+            .values(**values)
+            .returning(table.c.id, *columns)
+        )
+        rows = (await cls.execute(qs)).all()
+
+        session = cls.db.current_session
+        for row in rows:
+            instances = []
+            if session is not None:
+                key = util.identity_key(cls, row.id)
+                instances.append(session.identity_map.get(key))
+            if instance is not None and instance.id == row.id:
+                instances.append(instance)
+            for target in filter(None, instances):
+                # the stored values, so the instance isn't left dirty
+                for key, value in zip(values, row[1:]):
+                    attributes.set_committed_value(target, key, value)
+        return [row.id for row in rows]
+
+    @classmethod
+    def get_loader(cls) -> typing.Optional[loader.Loader]:
+        """
+        The ``Loader`` of this model for the current unit of work, None outside
+        of one. It is replaced once the unit of work writes anything.
+        """
+
+        session = cls.db.current_session
+        if session is None:
+            return None
+        loaders = session.info.setdefault("loaders", {})
+        if cls not in loaders:
+            loaders[cls] = loader.Loader(cls, session)
+        return loaders[cls]
+
+    @classmethod
+    async def fetch_many(cls, ids: typing.List[typing.Any]) -> typing.Dict:
+        """
+        Return the instances with ``ids`` by id, from the model's cache when it
+        has one, see ``app.utils.rowcache``, and otherwise with one query.
+        Cached instances join the unit of work, if there is one, and are
+        otherwise detached, like those read from a replica. The same
+        query made at the same time by other units of work is only run once,
+        see ``app.utils.singleflight``, in the unit of work of the first, and
+        the others are given copies of its rows.
+        """
+
+        cache = rowcache.get_cache(cls)
+        found = {}
+        if cache is not None:
+            cached = await cache.get_many(ids)
+            found = {i: await cls._restore(data) for i, data in cached.items()}
+            ids = [ident for ident in ids if ident not in found]
+        if not ids:
+            return found
+
+        loaded: typing.Dict[typing.Any, typing.Any] = {}
+
+        async def load() -> dict:
+            result = await cls.execute_read(loader.by_ids(cls, ids))
+            loaded.update((instance.id, instance) for instance in result.scalars())
+            rows = {i: rowcache.dump(instance) for i, instance in loaded.items()}
+            if cache is not None and rows:
+                await cache.set_many(rows)
+            return rows
+
+        if cls.db.is_sticky:
+            await load()
+        else:
+            key = ("ModelBase.fetch_many", cls.__tablename__, frozenset(ids))
+            rows, shared = await singleflight.flights.do(key, load)
+            if shared:
+                for ident, data in rows.items():
+                    loaded[ident] = await cls._restore(data)
+        found.update(loaded)
+        return found
+
+    @classmethod
+    async def _restore(cls, data: dict):
+        # rows loaded by another unit of work join this one, as if loaded here
+        instance = rowcache.restore(cls, data)
+        session = cls.db.current_session
+        if session is not None:
+            instance = await session.merge(instance, load=False)
+        return instance
 
     @classmethod
     async def get(cls, ident):
-        qs = sa.select(cls).where(cls.id == ident)
-        results = await cls.execute(qs)
-        return results.scalars().first()
+        """
+        Return the instance with the id ``ident``, or None. In a unit of work
+        gets made at the same time are batched into one query, and instances
+        are remembered, see ``get_many``.
+        """
+
+        model_loader = cls.get_loader()
+        if model_loader is not None:
+            return await model_loader.load(ident)
+        return (await cls.fetch_many([ident])).get(ident)
+
+    @classmethod
+    async def get_many(cls, ids: typing.Iterable[typing.Any]) -> typing.List:
+        """
+        Return the instance for each of ``ids`` in the same order, None where
+        there isn't one, with one ``id = ANY(:ids)`` query. In a unit of work
+        this, and any ``get`` or ``get_many`` in the same tick of the event
+        loop, share one query and the instances are remembered for the rest
+        of it, so loading the same rows again is free::
+
+            users = await User.get_many([1, 2, 3])
+            users = await asyncio.gather(*[User.get(i) for i in (1, 2, 3)])
+        """
+
+        ids = list(ids)
+        model_loader = cls.get_loader()
+        if model_loader is not None:
+            return await model_loader.load_many(ids)
+        instances = await cls.fetch_many(list(dict.fromkeys(ids)))
+        return [instances.get(ident) for ident in ids]
 
     @classmethod
     async def get_or_404(cls, ident):
@@ -48,6 +490,14 @@ class ModelBase:
     async def save(self) -> None:
         """save the current instance"""
 
+        session = self.db.current_session
+        if session is not None:
+            # flushed in a savepoint, committed with the unit of work
+            async with session.begin_nested():
+                session.add(self)
+            await rowcache.invalidate(session)
+            return
+
         async with self.db.session() as session:
             async with session.begin_nested():
                 session.add(self)
@@ -57,10 +507,19 @@ class ModelBase:
             except Exception as e:
                 await session.rollback()
                 raise e
+            await rowcache.invalidate(session, committed=True)
 
     async def delete(self) -> None:
         """delete the current instance"""
 
+        session = self.db.current_session
+        if session is not None:
+            # flushed in a savepoint, committed with the unit of work
+            async with session.begin_nested():
+                await session.delete(self)
+            await rowcache.invalidate(session)
+            return
+
         async with self.db.session() as session:
             async with session.begin_nested():
                 await session.delete(self)
@@ -70,25 +529,176 @@ class ModelBase:
             except Exception as e:
                 await session.rollback()
                 raise e
+            await rowcache.invalidate(session, committed=True)
+
+
+def _mark_written(session) -> None:
+    # reads after this should see it, so go to the primary
+    session.info["wrote"] = True
+    # and instances loaded before may be out of date
+    session.info.pop("loaders", None)
+
+
+@sa.event.listens_for(sa.orm.Session, "after_flush")
+def _mark_write(session, flush_context):
+    _mark_written(session)
+
+
+def autocommit_sessionmaker(engine: AsyncEngine) -> sessionmaker:
+    """
+    Return a session factory on ``engine`` in autocommit mode. Each statement
+    is its own transaction, so no BEGIN or COMMIT is sent. The connections
+    are shared with the engine and reset when returned to its pool.
+    """
+
+    return sessionmaker(
+        engine.execution_options(isolation_level="AUTOCOMMIT"),
+        expire_on_commit=False,
+        class_=AsyncSession,
+    )
+
+
+class Replica:
+    """
+    A read only copy of the database. After a connection error it is skipped
+    for ``retry_after`` seconds.
+    """
+
+    def __init__(self, url: str, engine_kwargs: dict = {}, retry_after: float = 30):
+        self.engine = create_async_engine(str(url), **engine_kwargs)
+        queries.instrument(self.engine)
+        self.session = sessionmaker(
+            self.engine,
+            expire_on_commit=False,
+            class_=AsyncSession,
+        )
+        self.read_session = autocommit_sessionmaker(self.engine)
+        self.retry_after = retry_after
+        self.unhealthy_until = 0.0
+
+    def __repr__(self):
+        return f"<Replica, url={self.engine.url!r}>"
+
+    @property
+    def is_healthy(self) -> bool:
+        return time.monotonic() >= self.unhealthy_until
+
+    @property
+    def load(self) -> int:
+        """The number of connections in use."""
+
+        pool = self.engine.sync_engine.pool
+        return pool.checkedout() if hasattr(pool, "checkedout") else 0
+
+    def mark_unhealthy(self, error: BaseException) -> None:
+        logger.warning("replica %s is unhealthy: %r", self.engine.url, error)
+        self.unhealthy_until = time.monotonic() + self.retry_after
 
 
 class Database:
     engine: AsyncEngine
+    session: sessionmaker
+    read_session: sessionmaker
 
-    def __init__(self, url: str, engine_kwargs: dict = {}) -> None:
-        # configure the engine
+    def __init__(
+        self,
+        url: str,
+        engine_kwargs: dict = {},
+        replica_urls: typing.Sequence[str] = (),
+        replica_strategy: str = "round_robin",
+        read_your_writes: float = 5,
+        replica_retry_after: float = 30,
+        autocommit_reads: bool = True,
+    ) -> None:
+        # configure the engine, timing its statements
         self.engine = create_async_engine(str(url), **engine_kwargs)
+        queries.instrument(self.engine)
+        # configure the session factory once, it is reused for every session
+        self.session = sessionmaker(
+            self.engine,
+            expire_on_commit=False,
+            class_=AsyncSession,
+        )
+        # and one for reads outside of a transaction, see ModelBase.fetch,
+        # which can't be used behind pgbouncer in transaction mode as it may
+        # prepare a statement on one server connection and run it on another
+        self.read_session = autocommit_sessionmaker(self.engine)
+        self.autocommit_reads = autocommit_reads
+        # read only replicas, used by ModelBase.execute_read
+        if replica_strategy not in ("round_robin", "least_loaded"):
+            raise ValueError("replica strategy must be round_robin or least_loaded")
+        self.replicas = [
+            Replica(replica_url, engine_kwargs, replica_retry_after)
+            for replica_url in replica_urls
+        ]
+        self.replica_strategy = replica_strategy
+        self.read_your_writes = read_your_writes
+        self._next_replica = itertools.count()
         # configue base attrs
         ModelBase.db = self
 
     @property
-    def session(self) -> sessionmaker:
-        return sessionmaker(
-            self.engine,
-            expire_on_commit=False,
-            class_=AsyncSession,
+    def current_session(self) -> typing.Optional[AsyncSession]:
+        """The session bound by ``unit_of_work``, or ``None`` outside of one."""
+
+        return _current_session.get()
+
+    @property
+    def is_sticky(self) -> bool:
+        """
+        Whether the current unit of work must read from the primary and see its
+        own writes, as it is pinned or has written. Its reads can't go to a
+        replica or be shared with other units of work.
+        """
+
+        session = self.current_session
+        return session is not None and bool(
+            session.info.get("pinned") or session.info.get("wrote")
         )
 
+    def get_replica(self) -> typing.Optional[Replica]:
+        """
+        Return a healthy replica to read from, picked by the replica strategy,
+        or None if reads should go to the primary. They do when there are no
+        healthy replicas, and in a unit of work that is pinned or has written.
+        """
+
+        if self.is_sticky:
+            return None
+
+        healthy = [replica for replica in self.replicas if replica.is_healthy]
+        if not healthy:
+            return None
+        if self.replica_strategy == "least_loaded":
+            return min(healthy, key=lambda replica: replica.load)
+        return healthy[next(self._next_replica) % len(healthy)]
+
+    @asynccontextmanager
+    async def unit_of_work(
+        self, pinned: bool = False
+    ) -> typing.AsyncIterator[AsyncSession]:
+        """
+        Bind a single session to the current context. Every ``ModelBase``
+        query, save and delete made within it share the one connection and
+        transaction, which is committed on exit or rolled back on error.
+        When ``pinned`` reads aren't sent to replicas, as they aren't once
+        anything is written.
+        """
+
+        session = self.session()
+        session.info["pinned"] = pinned
+        token = _current_session.set(session)
+        try:
+            yield session
+            await session.commit()
+            await rowcache.invalidate(session, committed=True)
+        except BaseException:
+            await session.rollback()
+            raise
+        finally:
+            _current_session.reset(token)
+            await session.close()
+
     async def create_all(self) -> None:
         # create all tables
         async with self.engine.begin() as conn:
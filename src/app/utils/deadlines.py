@@ -0,0 +1,129 @@
+import functools
+import time
+import typing
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import asyncpg
+import sqlalchemy as sa
+from sqlalchemy import orm
+
+from app.utils.pool import PgBouncerConnection
+
+# when the current request must be done by, on the time.monotonic() clock
+_deadline: ContextVar[typing.Optional[float]] = ContextVar("deadline", default=None)
+
+# the sqlstate postgres fails a statement with once statement_timeout passes
+QUERY_CANCELED = "57014"
+
+
+def remaining() -> typing.Optional[float]:
+    """Seconds left until the current deadline, or None if there isn't one."""
+
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+@contextmanager
+def within(seconds: typing.Optional[float]) -> typing.Iterator[None]:
+    """
+    Give the code within it a deadline ``seconds`` from now, or none if None.
+    Database transactions started, or already started and used, within it
+    have their ``statement_timeout`` set to the time left, so no statement
+    runs past the deadline.
+    """
+
+    deadline = None if seconds is None else time.monotonic() + seconds
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def deadline(seconds: typing.Optional[float]) -> typing.Callable:
+    """
+    Give an endpoint a deadline of ``seconds``, in place of the default one
+    set by ``DatabaseSessionMiddleware``, see ``within``. Statements still
+    running at the deadline are cancelled, and the request fails with a 504::
+
+        class Report(HTTPEndpoint):
+            @deadline(30)
+            async def get(self, request):
+                ...
+    """
+
+    def decorator(func: typing.Callable) -> typing.Callable:
+        @functools.wraps(func)
+        async def wrapper(*args: typing.Any, **kwargs: typing.Any) -> typing.Any:
+            with within(seconds):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def is_timeout(exc: BaseException) -> bool:
+    """Whether ``exc`` is a statement cancelled by ``statement_timeout``."""
+
+    orig = getattr(exc, "orig", None)
+    return getattr(orig, "sqlstate", getattr(orig, "pgcode", None)) == QUERY_CANCELED
+
+
+async def cancel(session: typing.Any) -> None:
+    """
+    Ask the server to cancel the statement ``session`` is running, if any.
+    Cancelling the task waiting for a statement closes its connection without
+    telling the server, which runs the statement on to its end, so do this
+    first. It is cancelled with ``pg_cancel_backend`` on a connection of its
+    own. Behind PgBouncer the server process isn't known, and the statement
+    runs on until its ``statement_timeout``, see ``within``.
+    """
+
+    if not session.in_transaction():
+        return
+    connection = await session.connection()
+    driver_connection = (await connection.get_raw_connection()).driver_connection
+    # asyncpg's isinstance() is true of every connection class, check the type
+    if not isinstance(driver_connection, asyncpg.Connection) or issubclass(
+        type(driver_connection), PgBouncerConnection
+    ):
+        return
+    args, kwargs = connection.dialect.create_connect_args(connection.engine.url)
+    canceller = await asyncpg.connect(*args, **kwargs)
+    try:
+        await canceller.execute(
+            "SELECT pg_cancel_backend($1)", driver_connection.get_server_pid()
+        )
+    finally:
+        await canceller.close()
+
+
+def _apply(session: orm.Session, connection: typing.Any) -> None:
+    deadline = _deadline.get()
+    if session.info.get("deadline") == deadline:
+        return
+    session.info["deadline"] = deadline
+    if deadline is None:
+        connection.exec_driver_sql("SET LOCAL statement_timeout = DEFAULT")
+        return
+    # at least 1ms, as 0 would turn the timeout off
+    milliseconds = max(int((deadline - time.monotonic()) * 1000), 1)
+    connection.exec_driver_sql("SET LOCAL statement_timeout = %d" % milliseconds)
+
+
+@sa.event.listens_for(orm.Session, "after_begin")
+def _apply_on_begin(session, transaction, connection):
+    session.info.pop("deadline", None)
+    if _deadline.get() is not None and not connection.in_nested_transaction():
+        _apply(session, connection)
+
+
+@sa.event.listens_for(orm.Session, "do_orm_execute")
+def _apply_on_execute(state):
+    # the transaction may have begun before the deadline was set or changed
+    if "deadline" in state.session.info or _deadline.get() is not None:
+        _apply(state.session, state.session.connection())
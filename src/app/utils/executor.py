@@ -0,0 +1,93 @@
+import asyncio
+import functools
+import os
+import typing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+EXECUTOR_CLASSES: typing.Dict[str, typing.Callable[..., Executor]] = {
+    "thread": ThreadPoolExecutor,
+    "process": ProcessPoolExecutor,
+}
+
+
+class BoundedExecutor:
+    """
+    Run blocking callables on a thread or process pool so they don't stall the
+    event loop. At most ``max_concurrency`` calls are handed to the pool at
+    once, any more wait their turn and are counted in ``waiting``.
+    The pool is created on first use and released by ``shutdown()``.
+    """
+
+    def __init__(
+        self,
+        kind: str = "thread",
+        max_workers: typing.Optional[int] = None,
+        max_concurrency: typing.Optional[int] = None,
+    ) -> None:
+        if kind not in EXECUTOR_CLASSES:
+            raise ValueError(
+                "executor kind must be one of %s" % ", ".join(EXECUTOR_CLASSES)
+            )
+        self.kind = kind
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_concurrency = max_concurrency or self.max_workers
+        self._executor: typing.Optional[Executor] = None
+        self._semaphore: typing.Optional[asyncio.Semaphore] = None
+        # metrics
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.max_waiting = 0
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            klass = EXECUTOR_CLASSES[self.kind]
+            self._executor = klass(max_workers=self.max_workers)
+        return self._executor
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    @property
+    def stats(self) -> typing.Dict[str, int]:
+        return {
+            "waiting": self.waiting,
+            "running": self.running,
+            "completed": self.completed,
+            "max_waiting": self.max_waiting,
+        }
+
+    async def run(self, func: typing.Callable, *args: typing.Any) -> typing.Any:
+        """Call ``func(*args)`` on the pool and return its result."""
+
+        semaphore = self.semaphore
+        if semaphore.locked():
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+            try:
+                await semaphore.acquire()
+            finally:
+                self.waiting -= 1
+        else:
+            await semaphore.acquire()
+
+        self.running += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.executor, functools.partial(func, *args)
+            )
+        finally:
+            self.running -= 1
+            self.completed += 1
+            semaphore.release()
+
+    def shutdown(self, wait: bool = True) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+        self._semaphore = None
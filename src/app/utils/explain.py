@@ -0,0 +1,279 @@
+import asyncio
+import contextvars
+import hashlib
+import json
+import logging
+import random
+import time
+import typing
+from collections import OrderedDict
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app import settings
+from app.utils import queries
+
+logger = logging.getLogger(__name__)
+
+EXPLAIN = "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) "
+
+
+def fingerprint(statement: str) -> str:
+    """A short hash of ``statement`` that is the same whatever its values."""
+
+    normalized = queries.normalize(statement).encode("utf-8")
+    return hashlib.sha1(normalized).hexdigest()[:16]
+
+
+def nodes(plan: dict) -> typing.Iterator[dict]:
+    """Each node of ``plan``, depth first."""
+
+    yield plan
+    for child in plan.get("Plans", ()):
+        yield from nodes(child)
+
+
+def shape(plan: dict) -> str:
+    """
+    A hash of how ``plan`` gets its rows, its node types and the tables and
+    indexes they use, but not its costs or timings, so it only changes when
+    postgres picks a different plan.
+    """
+
+    parts = [
+        "%s:%s:%s"
+        % (node["Node Type"], node.get("Relation Name", ""), node.get("Index Name", ""))
+        for node in nodes(plan)
+    ]
+    return hashlib.sha1("/".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def seq_scans(plan: dict, min_rows: int) -> typing.List[typing.Dict[str, typing.Any]]:
+    """The sequential scans in ``plan`` reading at least ``min_rows`` rows."""
+
+    found = []
+    for node in nodes(plan):
+        if node["Node Type"] != "Seq Scan":
+            continue
+        rows = node.get("Actual Rows", 0) + node.get("Rows Removed by Filter", 0)
+        rows *= node.get("Actual Loops", 1)
+        if rows >= min_rows:
+            found.append({"table": node.get("Relation Name"), "rows": rows})
+    return found
+
+
+class Plan:
+    """The plan of a statement, as run with ``EXPLAIN ANALYZE``."""
+
+    def __init__(
+        self,
+        statement: str,
+        route: str,
+        duration: float,
+        explained: typing.List[dict],
+    ) -> None:
+        self.fingerprint = fingerprint(statement)
+        self.statement = queries.normalize(statement)
+        self.route = route
+        self.duration = duration
+        self.plan = explained[0]["Plan"]
+        self.execution_time = explained[0].get("Execution Time")
+        self.shape = shape(self.plan)
+        self.seq_scans = seq_scans(self.plan, settings.DATABASE_EXPLAIN_SEQ_SCAN_ROWS)
+        self.captured_at = time.time()
+        # set when it differs from the plan last captured for the statement
+        self.changed = False
+
+    def as_dict(self) -> typing.Dict[str, typing.Any]:
+        return {
+            "fingerprint": self.fingerprint,
+            "statement": self.statement,
+            "route": self.route,
+            "duration": self.duration,
+            "execution_time": self.execution_time,
+            "shape": self.shape,
+            "changed": self.changed,
+            "seq_scans": self.seq_scans,
+            "captured_at": self.captured_at,
+            "plan": self.plan,
+        }
+
+
+class PlanStore:
+    """
+    The latest plan of up to ``max_plans`` statements, by fingerprint. A
+    statement is explained again at most every ``interval`` seconds, and no
+    more than ``max_running`` are explained at once.
+    """
+
+    def __init__(
+        self, max_plans: int = 500, interval: float = 60, max_running: int = 2
+    ) -> None:
+        self.max_plans = max_plans
+        self.interval = interval
+        self.max_running = max_running
+        self.plans: "OrderedDict[str, Plan]" = OrderedDict()
+        self.running: typing.Set[str] = set()
+        self.tasks: typing.Set[asyncio.Task] = set()
+
+    def due(self, key: str) -> bool:
+        """Whether the statement with fingerprint ``key`` should be explained."""
+
+        if key in self.running or len(self.running) >= self.max_running:
+            return False
+        plan = self.plans.get(key)
+        return plan is None or time.time() - plan.captured_at >= self.interval
+
+    def add(self, plan: Plan) -> None:
+        previous = self.plans.pop(plan.fingerprint, None)
+        plan.changed = previous is not None and previous.shape != plan.shape
+        self.plans[plan.fingerprint] = plan
+        while len(self.plans) > self.max_plans:
+            self.plans.popitem(last=False)
+
+    def by_route(self) -> typing.Dict[str, typing.List[typing.Dict[str, typing.Any]]]:
+        """The plans of each route, slowest first."""
+
+        routes: typing.Dict[str, typing.List[Plan]] = {}
+        for plan in self.plans.values():
+            routes.setdefault(plan.route, []).append(plan)
+        return {
+            route: [p.as_dict() for p in sorted(found, key=lambda p: -p.duration)]
+            for route, found in sorted(routes.items())
+        }
+
+    def clear(self) -> None:
+        self.plans.clear()
+
+
+plans = PlanStore()
+
+
+def should_explain(statement: str, duration: float) -> bool:
+    """
+    Whether a statement that took ``duration`` seconds should be explained,
+    only SELECTs that don't lock rows, as it is run again.
+    """
+
+    words = statement.lstrip()[:6].upper()
+    if words != "SELECT" or " FOR UPDATE" in statement or " FOR SHARE" in statement:
+        return False
+    threshold = settings.DATABASE_EXPLAIN_THRESHOLD
+    if threshold and duration >= threshold:
+        return True
+    return random.random() < settings.DATABASE_EXPLAIN_SAMPLE_RATE
+
+
+def cast(type_: typing.Any, dialect: typing.Any) -> typing.Optional[str]:
+    """
+    The type to cast a parameter of ``type_`` to, without its length, which a
+    cast would cut values to, or None if it has no database type.
+    """
+
+    try:
+        return type(type_)().compile(dialect=dialect)
+    except Exception:
+        return None
+
+
+def placeholders(context: typing.Any, count: int) -> typing.Tuple[str, ...]:
+    """
+    The ``$n`` placeholders asyncpg takes for ``count`` parameters, cast to
+    the types of the statement's bind parameters when they are known, as
+    postgres can't always tell them from the statement alone.
+    """
+
+    types: typing.List[typing.Optional[str]] = [None] * count
+    compiled = context.compiled
+    names = getattr(compiled, "positiontup", None)
+    if names is not None and len(names) == count:
+        types = [cast(compiled.binds[name].type, context.dialect) for name in names]
+    return tuple(
+        "$%d::%s" % (i, typ) if typ else "$%d" % i for i, typ in enumerate(types, 1)
+    )
+
+
+def observe(
+    conn: typing.Any,
+    cursor: typing.Any,
+    statement: str,
+    parameters: typing.Any,
+    context: typing.Any,
+    duration: float,
+) -> None:
+    """
+    Explain the statement just run, if it is slow or sampled, in the
+    background and on a connection of its own. Set as one of the
+    ``app.utils.queries.observers`` when ``DATABASE_EXPLAIN`` is on.
+    """
+
+    if not should_explain(statement, duration):
+        return
+    if not isinstance(parameters, tuple):
+        return
+    key = fingerprint(statement)
+    if not plans.due(key):
+        return
+
+    # the statement as sent to asyncpg, with its parameter types
+    sent = statement % placeholders(context, len(parameters))
+    route = getattr(queries.current(), "route", "-")
+    engine = AsyncEngine(conn.engine)
+    coro = capture(engine, statement, sent, parameters, route, duration)
+    # a new context, so the request's deadline and statements don't apply
+    plans.running.add(key)
+    loop = asyncio.get_running_loop()
+    task = contextvars.Context().run(loop.create_task, coro)
+    plans.tasks.add(task)
+    task.add_done_callback(plans.tasks.discard)
+
+
+async def capture(
+    engine: AsyncEngine,
+    statement: str,
+    sent: str,
+    parameters: typing.Sequence[typing.Any],
+    route: str,
+    duration: float,
+) -> typing.Optional[Plan]:
+    """
+    Run ``statement`` again under ``EXPLAIN ANALYZE``, as it was ``sent`` to
+    asyncpg, in a read only transaction, and store its plan.
+    """
+
+    key = fingerprint(statement)
+    try:
+        async with engine.connect() as conn:
+            raw = await conn.get_raw_connection()
+            driver_connection = raw.driver_connection
+            async with driver_connection.transaction(readonly=True):
+                # it runs the statement again, so give up if it is much slower
+                timeout = max(int(duration * 10000), 1000)
+                await driver_connection.execute(
+                    "SET LOCAL statement_timeout = %d" % timeout
+                )
+                explained = await driver_connection.fetchval(
+                    EXPLAIN + sent, *parameters
+                )
+    except Exception as e:
+        logger.warning("could not explain %s: %r", key, e)
+        return None
+    finally:
+        plans.running.discard(key)
+
+    if isinstance(explained, str):
+        # sqlalchemy sets a json codec on its connections, so it is usually parsed
+        explained = json.loads(explained)
+    plan = Plan(statement, route, duration, explained)
+    plans.add(plan)
+    if plan.changed:
+        logger.warning("plan changed in %s: %s", route, plan.statement)
+    for scan in plan.seq_scans:
+        logger.warning(
+            "sequential scan of %s, %d rows, in %s: %s",
+            scan["table"],
+            scan["rows"],
+            route,
+            plan.statement,
+        )
+    return plan
@@ -0,0 +1,89 @@
+import asyncio
+import typing
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import util
+
+
+def by_ids(model: typing.Any, ids: typing.List[typing.Any]):
+    """Return a select of the ``model`` rows with ``ids``, ``id = ANY(:ids)``."""
+
+    column = model.__table__.c.id
+    ids_param = sa.bindparam("ids", ids, type_=postgresql.ARRAY(column.type))
+    return sa.select(model).where(column == sa.any_(ids_param))
+
+
+class Loader:
+    """
+    Loads instances of ``model`` by id for one unit of work. Ids asked for in
+    the same tick of the event loop are fetched together with one query, and
+    every instance loaded, or id not found, is remembered until the unit of
+    work writes something. Instances already in the session are used as is.
+    """
+
+    def __init__(self, model: typing.Any, session: typing.Any) -> None:
+        self.model = model
+        self.session = session
+        self.loaded: typing.Dict[typing.Any, typing.Any] = {}
+        self.pending: typing.Dict[typing.Any, asyncio.Future] = {}
+        self.task: typing.Optional[asyncio.Task] = None
+        # metrics
+        self.queries = 0
+
+    async def load(self, ident: typing.Any) -> typing.Any:
+        return (await self.load_many([ident]))[0]
+
+    async def load_many(self, ids: typing.Iterable[typing.Any]) -> typing.List:
+        """Return the instance for each of ``ids``, or None if there isn't one."""
+
+        ids = list(ids)
+        found: typing.Dict[typing.Any, typing.Any] = {}
+        waiting: typing.Dict[typing.Any, asyncio.Future] = {}
+        loop = asyncio.get_running_loop()
+
+        for ident in dict.fromkeys(ids):
+            if ident in self.loaded:
+                found[ident] = self.loaded[ident]
+                continue
+            key = util.identity_key(self.model, ident)
+            instance = self.session.identity_map.get(key)
+            if instance is not None:
+                found[ident] = instance
+                continue
+            if ident not in self.pending:
+                self.pending[ident] = loop.create_future()
+            waiting[ident] = self.pending[ident]
+
+        if self.pending and self.task is None:
+            self.task = loop.create_task(self.dispatch())
+        if waiting:
+            # shielded, others may be waiting on the same ids
+            results = await asyncio.gather(*map(asyncio.shield, waiting.values()))
+            found.update(zip(waiting, results))
+        return [found[ident] for ident in ids]
+
+    async def dispatch(self) -> None:
+        # let everything else running this tick ask for its ids first
+        await asyncio.sleep(0)
+        pending, self.pending = self.pending, {}
+        self.task = None
+
+        try:
+            self.queries += 1
+            instances = await self.model.fetch_many(list(pending))
+        except asyncio.CancelledError:
+            for future in pending.values():
+                future.cancel()
+            raise
+        except Exception as e:
+            # raised to everyone waiting, rather than by the task
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for ident, future in pending.items():
+            self.loaded[ident] = instances.get(ident)
+            if not future.done():
+                future.set_result(self.loaded[ident])
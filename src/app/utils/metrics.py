@@ -0,0 +1,84 @@
+import math
+import typing
+
+# seconds, the upper bound of each bucket of a histogram
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    """Counts observed values, such as seconds waited, in ``buckets``."""
+
+    def __init__(self, buckets: typing.Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(buckets) + (math.inf,)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> typing.List[typing.Tuple[float, int]]:
+        """Each bucket's upper bound and the count of values up to it."""
+
+        total, result = 0, []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def as_dict(self) -> typing.Dict[str, typing.Any]:
+        return {
+            "buckets": {_format(bound): n for bound, n in self.cumulative()},
+            "count": self.count,
+            "sum": self.sum,
+        }
+
+
+def _format(value: float) -> str:
+    return "+Inf" if value == math.inf else repr(value)
+
+
+def _labels(labels: typing.Dict[str, typing.Any]) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+        for k, v in labels.items()
+    )
+    return "{%s}" % pairs
+
+
+def render(
+    samples: typing.Iterable[
+        typing.Tuple[str, str, typing.Dict[str, typing.Any], typing.Any]
+    ],
+) -> str:
+    """
+    Return ``samples``, tuples of name, type, labels and a number or
+    ``Histogram``, in the Prometheus text format. The format needs all the
+    samples of a metric together under its type, so they are grouped by name,
+    in the order each name first appears.
+    """
+
+    families: typing.Dict[str, typing.List[typing.Tuple]] = {}
+    for sample in samples:
+        families.setdefault(sample[0], []).append(sample)
+
+    lines = []
+    for name, family in families.items():
+        lines.append("# TYPE %s %s" % (name, family[0][1]))
+        for _, _, labels, value in family:
+            if isinstance(value, Histogram):
+                for bound, count in value.cumulative():
+                    bucket = dict(labels, le=_format(bound))
+                    lines.append("%s_bucket%s %d" % (name, _labels(bucket), count))
+                lines.append("%s_count%s %d" % (name, _labels(labels), value.count))
+                lines.append("%s_sum%s %s" % (name, _labels(labels), value.sum))
+            else:
+                lines.append("%s%s %s" % (name, _labels(labels), value))
+    return "\n".join(lines) + "\n"
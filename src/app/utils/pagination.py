@@ -0,0 +1,196 @@
+import datetime
+import json
+import logging
+import typing
+
+import sqlalchemy as sa
+from sqlalchemy.sql import operators
+
+from app import settings
+from app.utils.base64 import urlsafe_base64_decode, urlsafe_base64_encode
+from app.utils.crypto import constant_time_compare, salted_hmac
+
+logger = logging.getLogger(__name__)
+
+KEY_SALT = "app.utils.pagination"
+
+
+class Page:
+    """A page of results and the cursor for the page after it, if any."""
+
+    def __init__(
+        self, items: typing.List[typing.Any], next_cursor: typing.Optional[str] = None
+    ) -> None:
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+class SortKey:
+    """A column to sort on, and whether it is descending."""
+
+    def __init__(self, expression: typing.Any) -> None:
+        self.descending = False
+        if isinstance(expression, sa.sql.elements.UnaryExpression):
+            self.descending = expression.modifier is operators.desc_op
+            expression = expression.element
+        self.column = expression
+        # the table column, when sorting on an ORM attribute
+        if hasattr(expression, "__clause_element__"):
+            expression = expression.__clause_element__()
+        self.table = getattr(expression, "table", None)
+        self.column_name = getattr(expression, "name", None)
+
+    def is_for(self, table: typing.Any, column_name: typing.Optional[str]) -> bool:
+        return self.table is table and self.column_name == column_name
+
+    @property
+    def name(self) -> str:
+        return self.column.key + (" desc" if self.descending else "")
+
+    def order_by(self):
+        return self.column.desc() if self.descending else self.column.asc()
+
+    def after(self, value: typing.Any):
+        return self.column < value if self.descending else self.column > value
+
+    def value(self, item: typing.Any) -> typing.Any:
+        if hasattr(item, "_mapping"):
+            return item._mapping[self.column_name]
+        return getattr(item, self.column.key)
+
+
+def sort_keys(
+    order_by: typing.Sequence[typing.Any], tiebreaker: typing.Any
+) -> typing.List[SortKey]:
+    """
+    Return the sort keys for ``order_by`` with ``tiebreaker``, a unique column,
+    added when it isn't already there so that every row has a distinct key.
+    """
+
+    keys = [SortKey(expression) for expression in order_by]
+    last = SortKey(tiebreaker)
+    if not any(key.is_for(last.table, last.column_name) for key in keys):
+        keys.append(last)
+    return keys
+
+
+def keyset_filter(keys: typing.List[SortKey], values: typing.List[typing.Any]):
+    """Return the where clause for rows sorted after ``values``."""
+
+    if len({key.descending for key in keys}) == 1:
+        # a row comparison, which postgres can answer from a single index scan
+        columns = sa.tuple_(*[key.column for key in keys])
+        if keys[0].descending:
+            return columns < sa.tuple_(*values)
+        return columns > sa.tuple_(*values)
+
+    # mixed directions, (a > x) or (a = x and b < y) or ...
+    clauses = []
+    for i, key in enumerate(keys):
+        equal = [keys[j].column == values[j] for j in range(i)]
+        clauses.append(sa.and_(*equal, key.after(values[i])))
+    return sa.or_(*clauses)
+
+
+def _encode_value(value: typing.Any) -> typing.Any:
+    if isinstance(value, datetime.datetime):
+        return {"dt": value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {"d": value.isoformat()}
+    return value
+
+
+def _decode_value(value: typing.Any) -> typing.Any:
+    if isinstance(value, dict):
+        if "dt" in value:
+            return datetime.datetime.fromisoformat(value["dt"])
+        if "d" in value:
+            return datetime.date.fromisoformat(value["d"])
+    return value
+
+
+def _signature(payload: str) -> str:
+    return salted_hmac(KEY_SALT, payload, secret=str(settings.SECRET_KEY)).hexdigest()
+
+
+def encode_cursor(keys: typing.List[SortKey], values: typing.List[typing.Any]) -> str:
+    """Return an opaque, signed cursor for the row with sort key ``values``."""
+
+    payload = json.dumps(
+        {"k": [key.name for key in keys], "v": [_encode_value(v) for v in values]},
+        separators=(",", ":"),
+    )
+    cursor = payload + ":" + _signature(payload)
+    return urlsafe_base64_encode(cursor.encode("utf-8"))
+
+
+def decode_cursor(keys: typing.List[SortKey], cursor: str) -> typing.List[typing.Any]:
+    """
+    Return the sort key values in ``cursor``. Raise ValueError if it has been
+    tampered with or was made for a different sort order.
+    """
+
+    try:
+        payload, signature = (
+            urlsafe_base64_decode(cursor).decode("utf-8").rsplit(":", 1)
+        )
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+    if not constant_time_compare(_signature(payload), signature):
+        raise ValueError("Invalid cursor")
+    data = json.loads(payload)
+    if data["k"] != [key.name for key in keys]:
+        raise ValueError("Cursor is for a different sort order")
+    return [_decode_value(v) for v in data["v"]]
+
+
+_checked: typing.Set[typing.Tuple[str, ...]] = set()
+
+
+def check_index(keys: typing.List[SortKey]) -> bool:
+    """
+    Warn, once per sort order, when the sort keys aren't the leading columns
+    of an index, as postgres would have to sort the whole table for a page.
+    """
+
+    table = keys[0].table
+    if table is None or any(key.table is not table for key in keys):
+        return False
+
+    indexed = [list(index.columns) for index in table.indexes]
+    indexed.append(list(table.primary_key.columns))
+    indexed.extend(
+        list(constraint.columns)
+        for constraint in table.constraints
+        if isinstance(constraint, sa.UniqueConstraint)
+    )
+    indexed.extend([column] for column in table.columns if column.unique)
+
+    # the tiebreaker may be left off the index, it only orders equal rows
+    names = [key.column_name for key in keys]
+    wanted = [names, names[:-1]] if len(names) > 1 else [names]
+    covered = any(
+        [column.name for column in index[: len(want)]] == want
+        for index in indexed
+        for want in wanted
+    )
+
+    name = (table.name, *[key.name for key in keys])
+    if not covered and name not in _checked:
+        _checked.add(name)
+        logger.warning(
+            "paginating %s by %s, which isn't covered by an index",
+            table.name,
+            ", ".join(key.name for key in keys),
+        )
+    return covered
@@ -0,0 +1,141 @@
+import time
+import typing
+import uuid
+
+import asyncpg
+import sqlalchemy as sa
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
+
+from app.utils.metrics import Histogram
+
+
+class PoolMetrics:
+    """How long checkouts of a pool waited, and how many timed out."""
+
+    def __init__(self) -> None:
+        self.wait = Histogram()
+        self.timeouts = 0
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """
+    The asyncio queue pool, timing every checkout in ``metrics``. A checkout
+    waits for a free connection, or to open a new one within the overflow.
+    """
+
+    def __init__(self, *args: typing.Any, **kwargs: typing.Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except sa.exc.TimeoutError:
+            self.metrics.timeouts += 1
+            raise
+        finally:
+            self.metrics.wait.observe(time.perf_counter() - start)
+
+    def recreate(self):
+        # the engine replaces its pool on dispose, keep counting in the new one
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+def pool_stats(engine: typing.Any) -> typing.Dict[str, typing.Any]:
+    """
+    Return the connections of ``engine``'s pool, in use, idle and opened past
+    its size, with the checkout wait times and timeouts when it is an
+    ``InstrumentedPool``.
+    """
+
+    pool = engine.sync_engine.pool
+    stats: typing.Dict[str, typing.Any] = {"class": type(pool).__name__}
+    if hasattr(pool, "checkedout"):
+        stats.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            # negative until the pool is full
+            overflow=max(pool.overflow(), 0),
+            max_overflow=pool._max_overflow,
+            timeout=pool.timeout(),
+        )
+    metrics = getattr(pool, "metrics", None)
+    if metrics is not None:
+        stats.update(wait=metrics.wait.as_dict(), timeouts=metrics.timeouts)
+    return stats
+
+
+# external connection poolers the engine can be configured for
+POOLERS = ("", "pgbouncer")
+
+
+class PgBouncerConnection(asyncpg.Connection):
+    """
+    An asyncpg connection that gives its prepared statements unique names.
+    Behind PgBouncer in transaction mode each transaction may run on another
+    server connection, where asyncpg's numbered names could already be taken.
+    """
+
+    def _get_unique_id(self, prefix: str) -> str:
+        return "__asyncpg_%s_%s__" % (prefix, uuid.uuid4().hex)
+
+
+def engine_options(
+    pooler: str = "",
+    pool_size: int = 5,
+    max_overflow: int = 10,
+    pool_timeout: float = 30,
+    pool_recycle: int = -1,
+    pool_pre_ping: bool = False,
+    statement_cache_size: int = 100,
+    autocommit_reads: bool = True,
+) -> typing.Dict[str, typing.Any]:
+    """
+    Return the keyword arguments of an asyncpg engine. Behind a ``pooler`` a
+    ``pool_size`` of 0 uses a ``NullPool``, leaving pooling to it. Raises
+    ValueError for a combination that isn't safe, such as caching prepared
+    statements, or reading outside of a transaction with ``autocommit_reads``,
+    see ``Database``, behind PgBouncer in transaction mode.
+    """
+
+    if pooler not in POOLERS:
+        raise ValueError("pooler must be one of %s" % ", ".join(map(repr, POOLERS)))
+
+    connect_args: typing.Dict[str, typing.Any] = {
+        "statement_cache_size": statement_cache_size,
+        "prepared_statement_cache_size": statement_cache_size,
+    }
+    if pooler == "pgbouncer":
+        if statement_cache_size:
+            raise ValueError(
+                "prepared statements can't be cached behind pgbouncer in "
+                "transaction mode, set DATABASE_STATEMENT_CACHE_SIZE to 0"
+            )
+        if autocommit_reads:
+            raise ValueError(
+                "reads can't be run outside a transaction behind pgbouncer in "
+                "transaction mode, set DATABASE_AUTOCOMMIT_READS to false"
+            )
+        connect_args["connection_class"] = PgBouncerConnection
+    elif not pool_size:
+        raise ValueError("a pool size of 0 needs an external pooler")
+
+    if not pool_size:
+        return {
+            "poolclass": NullPool,
+            "pool_pre_ping": pool_pre_ping,
+            "connect_args": connect_args,
+        }
+    return {
+        "poolclass": InstrumentedPool,
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": pool_timeout,
+        "pool_recycle": pool_recycle,
+        "pool_pre_ping": pool_pre_ping,
+        "connect_args": connect_args,
+    }
@@ -0,0 +1,188 @@
+import heapq
+import logging
+import re
+import time
+import typing
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio.engine import AsyncEngine
+from starlette.types import Scope
+
+from app import settings
+from app.utils.metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+# the statements run for the current request, see ``track``
+_current: ContextVar[typing.Optional["RequestQueries"]] = ContextVar(
+    "request_queries", default=None
+)
+
+_PARAMS = re.compile(r"\$\d+|%s|%\(\w+\)s|'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_LISTS = re.compile(r"\(\?(?:, \?)+\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize(statement: str) -> str:
+    """
+    Return ``statement`` on one line with its parameters and literals replaced
+    by ``?``, so the same query with different values reads the same.
+    """
+
+    statement = _WHITESPACE.sub(" ", statement).strip()
+    statement = _PARAMS.sub("?", statement).replace("%%", "%")
+    return _LISTS.sub("(?, ...)", statement)
+
+
+def route_name(scope: Scope) -> str:
+    """The endpoint a request was routed to, or its path before it is routed."""
+
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return scope.get("path", "")
+    return "%s.%s" % (endpoint.__module__, endpoint.__qualname__)
+
+
+class RequestQueries:
+    """
+    The number of statements run for a request, the time spent in them and
+    the ``keep`` slowest of them, as they were sent.
+    """
+
+    def __init__(self, scope: Scope, keep: int = 5) -> None:
+        self.scope = scope
+        self.keep = keep
+        self.count = 0
+        self.duration = 0.0
+        self._slowest: typing.List[typing.Tuple[float, int, str]] = []
+
+    @property
+    def route(self) -> str:
+        return route_name(self.scope)
+
+    @property
+    def slowest(self) -> typing.List[typing.Tuple[float, str]]:
+        """The slowest statements and their seconds, slowest first."""
+
+        ranked = sorted(self._slowest, reverse=True)
+        return [(duration, statement) for duration, _, statement in ranked]
+
+    def record(self, statement: str, duration: float) -> None:
+        self.count += 1
+        self.duration += duration
+        # the count breaks ties, so statements are never compared
+        item = (duration, self.count, statement)
+        if len(self._slowest) < self.keep:
+            heapq.heappush(self._slowest, item)
+        elif duration > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, item)
+
+    def server_timing(self) -> str:
+        """The ``Server-Timing`` header value for the time spent in the database."""
+
+        return 'db;dur=%.1f;desc="%d queries"' % (self.duration * 1000, self.count)
+
+
+class QueryMetrics:
+    """The statements run by the app, and per request, since it started."""
+
+    def __init__(self) -> None:
+        self.duration = Histogram()
+        self.slow = 0
+        self.request_queries = Histogram((1, 2, 5, 10, 20, 50, 100, 200))
+        self.request_duration = Histogram()
+
+    def observe_request(self, queries: RequestQueries) -> None:
+        self.request_queries.observe(queries.count)
+        self.request_duration.observe(queries.duration)
+
+
+metrics = QueryMetrics()
+
+# the endpoints that ran each statement, by the statement as sent, for
+# attributing the statements in pg_stat_statements, see ``app.utils.statements``
+seen: typing.Dict[str, typing.Set[typing.Any]] = {}
+MAX_SEEN = 2000
+
+# called with the connection, cursor, statement, parameters, execution context
+# and seconds of each statement that succeeds, ie ``app.utils.explain.observe``
+observers: typing.List[typing.Callable[..., None]] = []
+
+
+def current() -> typing.Optional[RequestQueries]:
+    """The statements run so far for the current request, if tracked."""
+
+    return _current.get()
+
+
+@contextmanager
+def track(scope: Scope) -> typing.Iterator[RequestQueries]:
+    """Record the statements run within it against a request to ``scope``."""
+
+    queries = RequestQueries(scope)
+    token = _current.set(queries)
+    try:
+        yield queries
+    finally:
+        _current.reset(token)
+        metrics.observe_request(queries)
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_started = time.perf_counter()
+
+
+def _record(statement: str, context: typing.Any) -> float:
+    duration = time.perf_counter() - context._query_started
+    metrics.duration.observe(duration)
+    queries = _current.get()
+    if queries is not None:
+        queries.record(statement, duration)
+
+    endpoints = seen.get(statement)
+    if endpoints is None and len(seen) < MAX_SEEN:
+        endpoints = seen[statement] = set()
+    if endpoints is not None and len(endpoints) < 20:
+        endpoints.add(queries.scope.get("endpoint") if queries is not None else None)
+
+    threshold = settings.DATABASE_SLOW_QUERY_THRESHOLD
+    if threshold and duration >= threshold:
+        metrics.slow += 1
+        route = queries.route if queries is not None else "-"
+        logger.warning(
+            "slow query, %.1fms in %s: %s",
+            duration * 1000,
+            route,
+            normalize(statement),
+        )
+    return duration
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = _record(statement, context)
+    for observer in observers:
+        observer(conn, cursor, statement, parameters, context, duration)
+
+
+def _on_error(exception_context):
+    # ie statements cancelled by their deadline, which are the slowest of all
+    context = exception_context.execution_context
+    if context is not None and hasattr(context, "_query_started"):
+        _record(exception_context.statement, context)
+
+
+def instrument(engine: AsyncEngine) -> None:
+    """
+    Time every statement ``engine`` runs, for the request running it and the
+    app's metrics, and log those slower than ``DATABASE_SLOW_QUERY_THRESHOLD``.
+    It costs two clock reads and a histogram update a statement, so is cheap
+    enough to leave on.
+    """
+
+    sync_engine = engine.sync_engine
+    if not sa.event.contains(sync_engine, "before_cursor_execute", _before_execute):
+        sa.event.listen(sync_engine, "before_cursor_execute", _before_execute)
+        sa.event.listen(sync_engine, "after_cursor_execute", _after_execute)
+        sa.event.listen(sync_engine, "handle_error", _on_error)
@@ -0,0 +1,128 @@
+import typing
+
+import sqlalchemy as sa
+from sqlalchemy import orm
+
+from app import settings
+from app.utils.cache import BaseCacheBackend
+from app.utils.klass import import_string
+
+# the cache of each model with ``__cache__`` set, made when first used
+caches: typing.Dict[typing.Any, BaseCacheBackend] = {}
+
+
+def get_cache(model: typing.Any) -> typing.Optional[BaseCacheBackend]:
+    """
+    Return the cache of ``model``, or None unless it opts in by setting
+    ``__cache__`` to the keyword arguments of its backend, which defaults to
+    ``settings.MODEL_CACHE_BACKEND``::
+
+        class Scope(ModelBase):
+            __cache__ = {"ttl": 300, "max_entries": 10000}
+    """
+
+    options = getattr(model, "__cache__", None)
+    if not options:
+        return None
+    if model not in caches:
+        options = dict(options)
+        klass = import_string(options.pop("backend", settings.MODEL_CACHE_BACKEND))
+        caches[model] = klass(namespace=model.__tablename__, **options)
+    return caches[model]
+
+
+def stats() -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+    """The stats of every model's cache, by table name."""
+
+    return {model.__tablename__: cache.stats for model, cache in caches.items()}
+
+
+def dump(instance: typing.Any) -> dict:
+    """Return the column values of ``instance``."""
+
+    return {c.key: getattr(instance, c.key) for c in instance.__table__.columns}
+
+
+def restore(model: typing.Any, data: dict) -> typing.Any:
+    """
+    Build a detached instance of ``model`` from its ``dump``, a new object every
+    time so changing it can't affect the cached copy.
+    """
+
+    instance = model(**data)
+    orm.make_transient_to_detached(instance)
+    return instance
+
+
+def changed(session: typing.Any) -> typing.Dict[typing.Any, set]:
+    """
+    The ids of the rows of each cached model written in ``session``. A None
+    id means rows it can't tell, so the whole model's cache must go.
+    """
+
+    return session.info.setdefault("row_cache", {})
+
+
+async def invalidate(session: typing.Any, committed: bool = False) -> None:
+    """
+    Remove the rows written in ``session`` from their caches. This is done
+    once they are written, so the unit of work doesn't read its own stale
+    rows, and again once ``committed``, in case another request cached the
+    old row in the meantime.
+    """
+
+    if committed:
+        written = session.info.pop("row_cache", {})
+    else:
+        written = session.info.get("row_cache", {})
+    for model, ids in written.items():
+        cache = caches[model]
+        if None in ids:
+            await cache.clear()
+        else:
+            await cache.delete_many(ids)
+
+
+def statement_table(state: orm.ORMExecuteState) -> typing.Any:
+    """The table written by the statement being executed, if any."""
+
+    # statements on a model have a copy of its table, find the real one
+    mapper = state.bind_mapper
+    if mapper is not None:
+        return mapper.local_table
+    return getattr(state.statement, "table", None)
+
+
+@sa.event.listens_for(orm.Session, "after_flush")
+def _changed_on_flush(session, flush_context):
+    # only models that have cached something need to be told
+    for instance in (*session.dirty, *session.deleted):
+        if type(instance) in caches:
+            changed(session).setdefault(type(instance), set()).add(instance.id)
+
+
+@sa.event.listens_for(orm.Session, "do_orm_execute")
+def _changed_on_write(state):
+    # statements such as ModelBase.update and bulk upserts don't flush
+    table = statement_table(state)
+    if not (state.is_update or state.is_delete or state.is_insert):
+        return None
+    models = [model for model in caches if model.__table__ is table]
+    if not models:
+        return None
+    if (
+        state.is_insert
+        and getattr(state.statement, "_post_values_clause", None) is None
+    ):
+        # new rows can't be cached yet, but upserted ones may have been
+        return None
+
+    result = state.invoke_statement()
+    ids: typing.Set[typing.Any] = {None}
+    if result.returns_rows and "id" in result.keys():
+        frozen = result.freeze()
+        ids = {row.id for row in frozen()}
+        result = frozen()
+    for model in models:
+        changed(state.session).setdefault(model, set()).update(ids)
+    return result
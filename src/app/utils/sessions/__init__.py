@@ -0,0 +1,17 @@
+import typing
+
+from app import settings
+from app.utils.klass import import_string
+from app.utils.sessions.backends import BaseSessionBackend
+
+
+def get_backend(backend: typing.Optional[str] = None, **kwds: typing.Any):
+    """Load a session backend and return an instance of it.
+    If backend is None (default), use settings.SESSION_BACKEND.
+    Keyword arguments are used in the constructor of the backend.
+    """
+    klass = import_string(backend or settings.SESSION_BACKEND)
+    return klass(**kwds)
+
+
+__all__ = ["BaseSessionBackend", "get_backend"]
@@ -0,0 +1,167 @@
+import copy
+import secrets
+import typing
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from app.utils.database import ModelBase
+from app.utils.sessions.codecs import BaseSessionCodec, SessionSerializer
+from app.utils.sessions.tables import sessions, unlogged_sessions
+
+
+class BaseSessionBackend:
+    """
+    Base class for session backend implementations.
+    The session cookie carries a signed key, subclasses must overwrite
+    load() to return the session data for a key and save() to store the data
+    and return the key to put in the cookie. Keys are only ever given to a
+    backend once their signature has been checked.
+    """
+
+    async def load(self, key: str) -> typing.Optional[dict]:
+        """Return the session data for ``key``, or None if there is none."""
+
+        msg = "subclasses of BaseSessionBackend must override load() method"
+        raise NotImplementedError(msg)
+
+    async def save(self, key: typing.Optional[str], data: dict, max_age: int) -> str:
+        """
+        Store ``data`` for ``max_age`` seconds and return the key for it. ``key``
+        is None for a new session.
+        """
+
+        msg = "subclasses of BaseSessionBackend must override save() method"
+        raise NotImplementedError(msg)
+
+    async def delete(self, key: str) -> None:
+        """Delete the session for ``key``, revoking it."""
+
+    def generate_key(self) -> str:
+        return secrets.token_urlsafe(32)
+
+
+class CookieSessionBackend(BaseSessionBackend):
+    """
+    Stores the whole session in the cookie itself, the key is the data
+    encoded by ``codec``, see ``SessionSerializer``. The codec and
+    compression threshold default to ``settings.SESSION_CODEC`` and
+    ``settings.SESSION_COMPRESS_MIN_SIZE``.
+    """
+
+    def __init__(
+        self,
+        codec: typing.Optional[BaseSessionCodec] = None,
+        compress_min_size: typing.Optional[int] = None,
+    ) -> None:
+        self.serializer = SessionSerializer(codec, compress_min_size)
+
+    async def load(self, key: str) -> typing.Optional[dict]:
+        try:
+            return self.serializer.loads(key)
+        except ValueError:
+            return None
+
+    async def save(self, key: typing.Optional[str], data: dict, max_age: int) -> str:
+        return self.serializer.dumps(data)
+
+
+class MemorySessionBackend(BaseSessionBackend):
+    """
+    Stores sessions in this process, evicting the least recently used once
+    there are ``max_entries``. Only suitable when running a single worker.
+    """
+
+    def __init__(self, max_entries: int = 10000) -> None:
+        self.max_entries = max_entries
+        self.entries: typing.MutableMapping[str, typing.Tuple[datetime, dict]]
+        self.entries = OrderedDict()
+
+    async def load(self, key: str) -> typing.Optional[dict]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires, data = entry
+        if expires < datetime.utcnow():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)  # type: ignore
+        return copy.deepcopy(data)
+
+    async def save(self, key: typing.Optional[str], data: dict, max_age: int) -> str:
+        key = key or self.generate_key()
+        expires = datetime.utcnow() + timedelta(seconds=max_age)
+        self.entries[key] = (expires, copy.deepcopy(data))
+        self.entries.move_to_end(key)  # type: ignore
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)  # type: ignore
+        return key
+
+    async def delete(self, key: str) -> None:
+        self.entries.pop(key, None)
+
+
+class DatabaseSessionBackend(BaseSessionBackend):
+    """
+    Stores sessions in a Postgres table. Queries go through
+    ``ModelBase.execute`` so share the request's unit of work. Every
+    ``cleanup_every`` saves, up to ``cleanup_batch_size`` expired sessions
+    are deleted.
+    """
+
+    table = sessions
+
+    def __init__(self, cleanup_every: int = 100, cleanup_batch_size: int = 1000):
+        self.cleanup_every = cleanup_every
+        self.cleanup_batch_size = cleanup_batch_size
+        self.saves = 0
+
+    async def load(self, key: str) -> typing.Optional[dict]:
+        qs = sa.select(self.table.c.data).where(
+            self.table.c.key == key, self.table.c.expires > datetime.utcnow()
+        )
+        result = await ModelBase.execute(qs)
+        return result.scalar()
+
+    async def save(self, key: typing.Optional[str], data: dict, max_age: int) -> str:
+        key = key or self.generate_key()
+        expires = datetime.utcnow() + timedelta(seconds=max_age)
+        qs = postgresql.insert(self.table).values(key=key, data=data, expires=expires)
+        qs = qs.on_conflict_do_update(
+            index_elements=[self.table.c.key],
+            set_={"data": qs.excluded.data, "expires": qs.excluded.expires},
+        )
+        await ModelBase.execute(qs)
+
+        self.saves += 1
+        if self.cleanup_every and self.saves % self.cleanup_every == 0:
+            await self.cleanup()
+        return key
+
+    async def delete(self, key: str) -> None:
+        await ModelBase.execute(sa.delete(self.table).where(self.table.c.key == key))
+
+    async def cleanup(self) -> int:
+        """Delete a batch of expired sessions and return how many were deleted."""
+
+        expired = (
+            sa.select(self.table.c.key)
+            .where(self.table.c.expires <= datetime.utcnow())
+            .limit(self.cleanup_batch_size)
+            .scalar_subquery()
+        )
+        qs = sa.delete(self.table).where(self.table.c.key.in_(expired))
+        result = await ModelBase.execute(qs)
+        return result.rowcount
+
+
+class UnloggedDatabaseSessionBackend(DatabaseSessionBackend):
+    """
+    As ``DatabaseSessionBackend`` but uses an UNLOGGED table. Writes are
+    cheaper, but sessions are lost after a database crash and aren't
+    available on replicas.
+    """
+
+    table = unlogged_sessions
@@ -0,0 +1,124 @@
+import json
+import typing
+import zlib
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from app import settings
+from app.utils.klass import import_string
+
+# set on the format byte when the payload is zlib compressed
+COMPRESSED = 0x80
+
+
+class BaseSessionCodec:
+    """
+    Base class for session codecs.
+    Subclasses must set a unique ``format`` below 0x80, which is written as
+    the first byte of every encoded session so it can be decoded after the
+    codec setting changes, and overwrite dumps() and loads().
+    """
+
+    format: int
+
+    def dumps(self, data: dict) -> bytes:
+        msg = "subclasses of BaseSessionCodec must override dumps() method"
+        raise NotImplementedError(msg)
+
+    def loads(self, data: bytes) -> dict:
+        msg = "subclasses of BaseSessionCodec must override loads() method"
+        raise NotImplementedError(msg)
+
+
+class JSONSessionCodec(BaseSessionCodec):
+    """Compact JSON, without the whitespace ``json.dumps`` adds by default."""
+
+    format = 0x01
+
+    def dumps(self, data: dict) -> bytes:
+        return json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+    def loads(self, data: bytes) -> dict:
+        return json.loads(data)
+
+
+class MsgpackSessionCodec(BaseSessionCodec):
+    """MessagePack. Requires the optional ``msgpack`` package."""
+
+    format = 0x02
+
+    def _load_library(self):
+        try:
+            import msgpack
+        except ImportError as err:
+            raise ValueError(
+                "Couldn't load the msgpack library, is msgpack installed?"
+            ) from err
+        return msgpack
+
+    def dumps(self, data: dict) -> bytes:
+        return self._load_library().packb(data)
+
+    def loads(self, data: bytes) -> dict:
+        return self._load_library().unpackb(data)
+
+
+CODECS: typing.Dict[int, typing.Type[BaseSessionCodec]] = {
+    codec.format: codec for codec in (JSONSessionCodec, MsgpackSessionCodec)
+}
+
+
+class SessionSerializer:
+    """
+    Turns session data into a cookie safe string and back.
+    The string is url safe base64 of a format byte followed by the encoded
+    data, which is zlib compressed when it's at least ``compress_min_size``
+    bytes and compressing makes it smaller. Sessions written before the
+    format byte existed, base64 encoded JSON, can still be decoded.
+    """
+
+    def __init__(
+        self,
+        codec: typing.Optional[BaseSessionCodec] = None,
+        compress_min_size: typing.Optional[int] = None,
+    ) -> None:
+        self.codec = codec or import_string(settings.SESSION_CODEC)()
+        if compress_min_size is None:
+            compress_min_size = settings.SESSION_COMPRESS_MIN_SIZE
+        self.compress_min_size = compress_min_size
+        self.codecs = {key: klass() for key, klass in CODECS.items()}
+        self.codecs[self.codec.format] = self.codec
+
+    def dumps(self, data: dict) -> str:
+        format_byte = self.codec.format
+        payload = self.codec.dumps(data)
+        if self.compress_min_size and len(payload) >= self.compress_min_size:
+            compressed = zlib.compress(payload)
+            if len(compressed) < len(payload):
+                format_byte |= COMPRESSED
+                payload = compressed
+        value = urlsafe_b64encode(bytes([format_byte]) + payload)
+        return value.rstrip(b"=").decode("ascii")
+
+    def loads(self, value: str) -> dict:
+        """Decode ``value``, raising ``ValueError`` if it can't be."""
+
+        try:
+            raw = urlsafe_b64decode(value + "=" * (-len(value) % 4))
+        except ValueError as err:
+            raise ValueError("session isn't valid base64") from err
+        if not raw:
+            raise ValueError("session is empty")
+        if raw[:1] == b"{":
+            # written before the format byte, always plain JSON
+            return json.loads(raw)
+
+        format_byte, payload = raw[0], raw[1:]
+        codec = self.codecs.get(format_byte & ~COMPRESSED)
+        if codec is None:
+            raise ValueError("unknown session format %#x" % format_byte)
+        if format_byte & COMPRESSED:
+            try:
+                payload = zlib.decompress(payload)
+            except zlib.error as err:
+                raise ValueError("session couldn't be decompressed") from err
+        return codec.loads(payload)
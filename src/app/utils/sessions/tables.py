@@ -0,0 +1,21 @@
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from app.utils.database import ModelBase
+
+
+def session_table(name: str, **kwargs) -> sa.Table:
+    return sa.Table(
+        name,
+        ModelBase.metadata,
+        sa.Column("key", sa.String(64), primary_key=True),
+        sa.Column("data", postgresql.JSONB, nullable=False),
+        sa.Column("expires", sa.DateTime, nullable=False, index=True),
+        **kwargs,
+    )
+
+
+sessions = session_table("session")
+
+# not written to the WAL, so faster but emptied after a crash and not replicated
+unlogged_sessions = session_table("session_unlogged", prefixes=["UNLOGGED"])
@@ -0,0 +1,97 @@
+import asyncio
+import typing
+
+from app import settings
+
+
+class SingleFlight:
+    """
+    Runs one call at a time for each key. While a call is in flight, calls for
+    the same key wait for it and share its result, or its error, rather than
+    making their own, so a burst of identical cache misses or queries makes one
+    trip to the database. The result is shared so should be plain data, that
+    each caller builds its own objects from.
+
+    Waiting callers give up with ``asyncio.TimeoutError`` after ``timeout``
+    seconds, which the call itself is held to too. If the caller making the
+    call is cancelled, or times out, one of the others makes it again rather
+    than failing with it. Without ``share_errors`` they do so whatever the
+    call fails with, for calls whose errors may be the caller's own, such as
+    queries in its failed transaction.
+    """
+
+    def __init__(
+        self, timeout: typing.Optional[float] = None, share_errors: bool = True
+    ) -> None:
+        self.timeout = timeout
+        self.share_errors = share_errors
+        self.calls: typing.Dict[typing.Hashable, asyncio.Future] = {}
+        # metrics
+        self.leaders = 0
+        self.shared = 0
+
+    @property
+    def stats(self) -> typing.Dict[str, int]:
+        return {
+            "in_flight": len(self.calls),
+            "leaders": self.leaders,
+            "shared": self.shared,
+        }
+
+    async def do(
+        self,
+        key: typing.Hashable,
+        fn: typing.Callable[[], typing.Awaitable[typing.Any]],
+        timeout: typing.Optional[float] = None,
+    ) -> typing.Tuple[typing.Any, bool]:
+        """
+        Return the result of ``fn()``, or of the call for ``key`` already in
+        flight, and whether it was shared from another caller's call.
+        """
+
+        if timeout is None:
+            timeout = self.timeout
+
+        while key in self.calls:
+            future = self.calls[key]
+            try:
+                # shielded, so timing out here doesn't cancel it for the others
+                result = await asyncio.wait_for(asyncio.shield(future), timeout)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                continue  # the caller making it gave up, so try again
+            self.shared += 1
+            return result, True
+
+        future = asyncio.get_running_loop().create_future()
+        self.calls[key] = future
+        self.leaders += 1
+        try:
+            if timeout is None:
+                result = await fn()
+            else:
+                result = await asyncio.wait_for(fn(), timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            # the others make it themselves, with a timeout of their own
+            future.cancel()
+            raise
+        except BaseException as e:
+            if not self.share_errors:
+                future.cancel()
+                raise
+            future.set_exception(e)
+            future.exception()  # retrieved, even if nobody was waiting for it
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            del self.calls[key]
+
+
+# shared by ModelBase.get, get_many and the auth backend, whose calls run in
+# the unit of work of the caller making them
+flights = SingleFlight(
+    timeout=settings.DATABASE_SHARED_READ_TIMEOUT, share_errors=False
+)
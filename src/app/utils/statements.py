@@ -0,0 +1,137 @@
+import re
+import typing
+
+import sqlalchemy as sa
+
+from app.utils import queries
+from app.utils.database import ModelBase
+
+# what a statement can be ordered by, see ``top``
+ORDERINGS = ("total_time", "mean_time", "calls", "rows")
+
+# the totals that are summed, so two snapshots can be subtracted
+COUNTERS = ("calls", "total_time", "rows", "shared_blks_hit", "shared_blks_read")
+
+_CASTS = re.compile(
+    r"\?::(?:timestamp with time zone|time with time zone|\w+)(?:\[\])?", re.I
+)
+_TABLES = re.compile(r'\b(?:FROM|JOIN|UPDATE|INTO)\s+"?(\w+)"?', re.I)
+
+Stats = typing.Dict[str, typing.Dict[str, typing.Any]]
+
+
+def key(statement: str) -> str:
+    """
+    The ``normalize``d ``statement`` without the casts asyncpg adds to its
+    parameters, so a statement as SQLAlchemy runs it and as pg_stat_statements
+    records it have the same key.
+    """
+
+    return _CASTS.sub("?", queries.normalize(statement))
+
+
+async def available(connection: typing.Any) -> bool:
+    """Whether pg_stat_statements is installed in the database."""
+
+    qs = sa.text("SELECT 1 FROM pg_extension WHERE extname = 'pg_stat_statements'")
+    return (await connection.execute(qs)).scalar() is not None
+
+
+async def snapshot(connection: typing.Any) -> Stats:
+    """
+    The totals of each statement run on the current database since the stats
+    were last reset, by the id pg_stat_statements gives it. ``connection``
+    is a session or connection.
+    """
+
+    version = (await connection.execute(sa.text("SHOW server_version_num"))).scalar()
+    # renamed in postgres 13, when planning times were added
+    total_time = "total_exec_time" if int(version) >= 130000 else "total_time"
+    qs = sa.text(
+        "SELECT queryid, query, calls, %s AS total_time, rows, "
+        "shared_blks_hit, shared_blks_read "
+        "FROM pg_stat_statements "
+        "WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database()) "
+        "AND queryid IS NOT NULL" % total_time
+    )
+    result = await connection.execute(qs)
+    return {str(row.queryid): dict(row._mapping) for row in result}
+
+
+async def reset(connection: typing.Any) -> None:
+    await connection.execute(sa.text("SELECT pg_stat_statements_reset()"))
+
+
+def diff(before: Stats, after: Stats) -> Stats:
+    """
+    The statements run between two snapshots, and the totals of what they
+    did in between. A statement with fewer calls after than before had its
+    stats reset, so all of it is counted.
+    """
+
+    changed = {}
+    for queryid, stats in after.items():
+        previous = before.get(queryid)
+        if previous is not None and previous["calls"] <= stats["calls"]:
+            stats = dict(
+                stats, **{name: stats[name] - previous[name] for name in COUNTERS}
+            )
+        if stats["calls"]:
+            changed[queryid] = stats
+    return changed
+
+
+def top(stats: Stats, by: str = "total_time", limit: int = 20) -> typing.List[dict]:
+    """
+    The ``limit`` statements with the most ``by``, one of ``ORDERINGS``, each
+    with its ``mean_time`` and its share of the total time. Times are in
+    milliseconds, as pg_stat_statements has them.
+    """
+
+    if by not in ORDERINGS:
+        raise ValueError("order by one of %s" % ", ".join(ORDERINGS))
+
+    total = sum(s["total_time"] for s in stats.values()) or 1
+    statements = [
+        dict(
+            s,
+            mean_time=s["total_time"] / s["calls"],
+            share=s["total_time"] / total,
+        )
+        for s in stats.values()
+        if s["calls"]
+    ]
+    statements.sort(key=lambda s: s[by], reverse=True)
+    return statements[:limit]
+
+
+def attribute(
+    statements: typing.List[dict], models: typing.Dict[str, typing.Any]
+) -> typing.List[dict]:
+    """
+    Add to each of ``statements`` the models of the tables it uses, from
+    ``models`` by table name, and the endpoints this process has run it from,
+    known once it has run here, see ``app.utils.queries.seen``.
+    """
+
+    endpoints: typing.Dict[str, typing.Set[str]] = {}
+    for statement, seen_in in list(queries.seen.items()):
+        names = endpoints.setdefault(key(statement), set())
+        for endpoint in seen_in:
+            names.add(queries.route_name({"endpoint": endpoint, "path": "-"}))
+
+    for stats in statements:
+        tables = dict.fromkeys(_TABLES.findall(stats["query"]))
+        stats["models"] = [
+            models[table].__name__ for table in tables if table in models
+        ]
+        stats["endpoints"] = sorted(endpoints.get(key(stats["query"]), ()))
+    return statements
+
+
+def model_tables() -> typing.Dict[str, typing.Any]:
+    """The ``ModelBase`` models, by table name."""
+
+    return {
+        mapper.local_table.name: mapper.class_ for mapper in ModelBase.registry.mappers
+    }
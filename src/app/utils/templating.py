@@ -2,10 +2,45 @@ import typing
 
 import jinja2
 from starlette import templating
+from starlette.background import BackgroundTask
 from starlette.datastructures import QueryParams
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
 from wtforms import fields, form
 
 
+class _TemplateResponse(templating._TemplateResponse):
+    """
+    Renders when the response is sent rather than when it is created. A lazily
+    loaded ``request.user`` (anything in the scope with an async ``resolve()``)
+    is awaited first so that templates can use it.
+    """
+
+    def __init__(
+        self,
+        template: typing.Any,
+        context: dict,
+        status_code: int = 200,
+        headers: typing.Optional[dict] = None,
+        media_type: typing.Optional[str] = None,
+        background: typing.Optional[BackgroundTask] = None,
+    ):
+        self.template = template
+        self.context = context
+        Response.__init__(
+            self, None, status_code, headers, media_type, background  # type: ignore
+        )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        resolve = getattr(self.context["request"].scope.get("user"), "resolve", None)
+        if resolve is not None:
+            await resolve()
+
+        self.body = self.render(self.template.render(self.context))
+        self.headers["content-length"] = str(len(self.body))
+        await super().__call__(scope, receive, send)
+
+
 class Jinja2Templates(templating.Jinja2Templates):
     def __init__(self, loader: "jinja2.BaseLoader") -> None:
         self.env = self.get_environment(loader)
@@ -32,5 +67,26 @@ class Jinja2Templates(templating.Jinja2Templates):
 
         return env
 
+    def TemplateResponse(
+        self,
+        name: str,
+        context: dict,
+        status_code: int = 200,
+        headers: typing.Optional[dict] = None,
+        media_type: typing.Optional[str] = None,
+        background: typing.Optional[BackgroundTask] = None,
+    ) -> _TemplateResponse:
+        if "request" not in context:
+            raise ValueError('context must include a "request" key')
+        template = self.get_template(name)
+        return _TemplateResponse(
+            template,
+            context,
+            status_code=status_code,
+            headers=headers,
+            media_type=media_type,
+            background=background,
+        )
+
 
 templates = Jinja2Templates(loader=jinja2.FileSystemLoader("templates"))
@@ -1,3 +1,5 @@
+import binascii
+import hashlib
 import typing
 
 from app.auth.tables import User
@@ -57,6 +59,16 @@ async def create_user(email, password, first_name, last_name):
     return user
 
 
+def make_legacy_password(password):
+    """Hash a password in the format stored before hashers carried a prefix."""
+
+    salt = hashlib.sha256(password.encode("utf-8")).hexdigest().encode("ascii")
+    password_hash = hashlib.pbkdf2_hmac(
+        "sha512", password.encode("utf-8"), salt, 100000
+    )
+    return (salt + binascii.hexlify(password_hash)).decode("ascii")
+
+
 class DummyPostData(dict):
     def getlist(self, key):
         v = self[key]
@@ -0,0 +1,120 @@
+from unittest import mock
+
+import pytest
+
+from app.auth.tables import Scope
+from app.main import app
+from app.utils import explain, statements
+
+
+@pytest.fixture()
+async def debug_user(user):
+    scope = Scope(code="debug")
+    await scope.save()
+    user.scopes.append(scope)
+    await user.save()
+    return user
+
+
+@pytest.mark.asyncio
+async def test_requires_debug_scope(client, user, login):
+    for name in ("debug:metrics", "debug:plans", "debug:pool", "debug:statements"):
+        response = await client.get(app.url_path_for(name))
+        assert response.status_code == 403
+
+
+@pytest.mark.asyncio
+async def test_pool(client, debug_user, login):
+    response = await client.get(app.url_path_for("debug:pool"))
+    assert response.status_code == 200
+
+    primary = response.json()["primary"]
+    assert primary["class"] == "InstrumentedPool"
+    assert primary["checked_out"] >= 1
+    assert primary["wait"]["count"] >= 1
+    assert primary["timeouts"] == 0
+
+
+@pytest.mark.asyncio
+async def test_metrics(client, debug_user, login):
+    response = await client.get(app.url_path_for("debug:metrics"))
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "# TYPE db_pool_checked_out gauge" in response.text
+    assert 'db_pool_checkout_seconds_bucket{database="primary",le="+Inf"}' in (
+        response.text
+    )
+    assert "# TYPE db_query_seconds histogram" in response.text
+    assert "db_request_queries_count" in response.text
+
+
+@pytest.mark.asyncio
+async def test_plans(client, debug_user, login):
+    url = app.url_path_for("debug:plans")
+    explain.plans.clear()
+    fine = explain.Plan("SELECT 1", "/a", 0.1, [{"Plan": {"Node Type": "Result"}}])
+    explain.plans.add(fine)
+    scan = {"Node Type": "Seq Scan", "Relation Name": "user", "Actual Rows": 10**6}
+    slow = explain.Plan("SELECT a", "/b", 2, [{"Plan": scan}])
+    explain.plans.add(slow)
+
+    try:
+        response = await client.get(url)
+        assert response.status_code == 200
+        assert list(response.json()) == ["/a", "/b"]
+
+        response = await client.get(url, params={"route": "/a"})
+        assert [p["statement"] for p in response.json()["/a"]] == ["SELECT ?"]
+
+        response = await client.get(url, params={"flagged": ""})
+        assert response.json()["/a"] == []
+        [flagged] = response.json()["/b"]
+        assert flagged["seq_scans"] == [{"table": "user", "rows": 10**6}]
+    finally:
+        explain.plans.clear()
+
+
+@pytest.mark.asyncio
+async def test_statements(client, debug_user, login):
+    url = app.url_path_for("debug:statements")
+
+    def stat(query, calls, total_time):
+        counters = dict.fromkeys(statements.COUNTERS, 0)
+        return dict(counters, query=query, calls=calls, total_time=total_time)
+
+    before = {"1": stat('SELECT * FROM "user"', 1, 10), "2": stat("SELECT 1", 1, 1)}
+    after = {"1": stat('SELECT * FROM "user"', 1, 10), "2": stat("SELECT 1", 3, 4)}
+    available = mock.AsyncMock(return_value=True)
+    snapshot = mock.AsyncMock(return_value=before)
+
+    with mock.patch.object(statements, "available", available), mock.patch.object(
+        statements, "snapshot", snapshot
+    ):
+        response = await client.get(url)
+        assert response.status_code == 200
+        [first, second] = response.json()
+        assert first["models"] == ["User"]
+        assert second["query"] == "SELECT 1"
+
+        response = await client.get(url, params={"by": "calls", "limit": "1"})
+        assert [s["query"] for s in response.json()] == ['SELECT * FROM "user"']
+
+        response = await client.post(url)
+        assert response.json()["statements"] == 2
+        since = response.json()["snapshot"]
+
+        snapshot.return_value = after
+        response = await client.get(url, params={"since": since})
+        [changed] = response.json()
+        assert changed["query"] == "SELECT 1"
+        assert changed["calls"] == 2
+
+        response = await client.get(url, params={"since": "missing"})
+        assert response.status_code == 404
+        response = await client.get(url, params={"by": "queryid"})
+        assert response.status_code == 400
+
+    available.return_value = False
+    with mock.patch.object(statements, "available", available):
+        response = await client.get(url)
+        assert response.status_code == 503
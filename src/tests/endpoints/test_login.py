@@ -1,7 +1,10 @@
 import pytest
+import sqlalchemy as sa
 
 from app.auth.tables import User
+from app.db import db
 from app.main import app
+from app.utils.testing import make_legacy_password
 
 
 @pytest.mark.asyncio
@@ -30,6 +33,59 @@ async def test_user_last_login_set(client, user):
     assert user.last_login is not None
 
 
+@pytest.mark.asyncio
+async def test_legacy_password_upgraded_on_login(client, user):
+    user.password = make_legacy_password("pass")
+    await user.save()
+
+    url = app.url_path_for("auth:login")
+    response = await client.post(url, data={"email": user.email, "password": "pass"})
+    assert response.status_code == 302
+
+    user = await User.get(user.id)
+    assert user.password.startswith("pbkdf2_sha512$")
+    assert not user.password_must_update()
+    assert user.check_password("pass")
+
+
+@pytest.mark.asyncio
+async def test_login_checks_out_one_connection(client, user):
+    checkouts = []
+
+    def on_checkout(*args):
+        checkouts.append(args)
+
+    # the request's unit of work is on the app's database, and anything run
+    # outside it on the models' database
+    pools = {db.engine.sync_engine.pool, User.db.engine.sync_engine.pool}
+    for pool in pools:
+        sa.event.listen(pool, "checkout", on_checkout)
+    try:
+        url = app.url_path_for("auth:login")
+        response = await client.post(
+            url, data={"email": user.email, "password": "pass"}
+        )
+        assert response.status_code == 302
+        assert len(checkouts) == 1
+
+        # as does a password change, which loads the user too
+        checkouts.clear()
+        url = app.url_path_for("auth:password_change")
+        response = await client.post(
+            url,
+            data={
+                "current_password": "pass",
+                "new_password": "p@ss",
+                "confirm_new_password": "p@ss",
+            },
+        )
+        assert response.status_code == 302
+        assert len(checkouts) == 1
+    finally:
+        for pool in pools:
+            sa.event.remove(pool, "checkout", on_checkout)
+
+
 @pytest.mark.parametrize(
     "test_data",
     [
@@ -1,3 +1,4 @@
+import pytest
 import sqlalchemy as sa
 
 from app.auth.tables import User
@@ -51,3 +52,16 @@ def test_password():
 
     user.set_password("password")
     assert user.check_password("password")
+
+
+@pytest.mark.asyncio
+async def test_password_async():
+    user = User(**data)
+
+    await user.aset_password("password")
+    assert await user.acheck_password("password")
+    assert not await user.acheck_password("wrong")
+    assert user.check_password("password")
+
+    user.password = await User.ahash_password("other")
+    assert user.check_password("other")
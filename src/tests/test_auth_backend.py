@@ -1,3 +1,7 @@
+import asyncio
+
+import pytest
+import sqlalchemy as sa
 from starlette.applications import Starlette
 from starlette.authentication import requires
 from starlette.middleware.authentication import AuthenticationMiddleware
@@ -5,8 +9,12 @@ from starlette.middleware.sessions import SessionMiddleware
 from starlette.responses import JSONResponse
 from starlette.testclient import TestClient
 
+from app.auth import decorators
 from app.auth.backends import AuthBackend
-from app.auth.tables import User
+from app.auth.tables import Scope, User
+from app.middleware import LazyAuthenticationMiddleware
+from app.utils.cache import TTLCache
+from app.utils.testing import create_user
 
 
 class AuthenticatedBackend(AuthBackend):
@@ -142,3 +150,233 @@ def test_no_user():
         response = client.get("/unauthenticated")
         assert response.status_code == 200
         assert response.json() == {"authenticated": False, "user": ""}
+
+
+class CountingBackend(AuthenticatedBackend):
+    calls = 0
+
+    async def get_user(self, conn):
+        CountingBackend.calls += 1
+        return await super().get_user(conn)
+
+
+def untouched(request):
+    return JSONResponse({"status": "ok"})
+
+
+@decorators.lazy_user
+async def lazy_untouched(request):
+    return JSONResponse({"status": "ok"})
+
+
+async def async_untouched(request):
+    return JSONResponse({"status": "ok"})
+
+
+async def touched_twice(request):
+    await request.user.resolve()
+    return JSONResponse(
+        {
+            "authenticated": request.user.is_authenticated,
+            "user": request.user.display_name,
+            "scopes": request.auth.scopes,
+        }
+    )
+
+
+@decorators.requires("authenticated")
+async def lazy_dashboard(request):
+    return JSONResponse({"user": request.user.display_name})
+
+
+@decorators.requires("unauthenticated")
+async def lazy_unauthenticated(request):
+    return JSONResponse({"user": request.user.display_name})
+
+
+def lazy_app():
+    app = Starlette()
+    app.add_middleware(SessionMiddleware, secret_key="example")
+    app.add_middleware(LazyAuthenticationMiddleware, backend=CountingBackend())
+
+    app.add_route("/", homepage)
+    app.add_route("/untouched", untouched)
+    app.add_route("/lazy-untouched", lazy_untouched)
+    app.add_route("/async-untouched", async_untouched)
+    app.add_route("/touched-twice", touched_twice)
+    app.add_route("/dashboard", dashboard)
+    app.add_route("/lazy-dashboard", lazy_dashboard)
+    app.add_route("/lazy-unauthenticated", lazy_unauthenticated)
+    return app
+
+
+def test_lazy_user_not_loaded_unless_used():
+    CountingBackend.calls = 0
+
+    with TestClient(lazy_app()) as client:
+        response = client.get("/untouched")
+        assert response.status_code == 200
+        assert CountingBackend.calls == 0
+
+        response = client.get("/lazy-untouched")
+        assert response.status_code == 200
+        assert CountingBackend.calls == 0
+
+        # async endpoints not marked lazy could use it without awaiting it
+        response = client.get("/async-untouched")
+        assert response.status_code == 200
+        assert CountingBackend.calls == 1
+
+        response = client.get("/touched-twice")
+        assert response.status_code == 200
+        assert response.json() == {
+            "authenticated": True,
+            "user": "tom jones",
+            "scopes": ["authenticated"],
+        }
+        assert CountingBackend.calls == 2
+
+
+def test_lazy_user_loaded_in_sync_endpoint():
+    with TestClient(lazy_app()) as client:
+        response = client.get("/")
+        assert response.status_code == 200
+        assert response.json() == {"authenticated": True, "user": "tom jones"}
+
+
+def test_lazy_user_requires():
+    with TestClient(lazy_app()) as client:
+        response = client.get("/lazy-dashboard")
+        assert response.status_code == 200
+        assert response.json() == {"user": "tom jones"}
+
+        response = client.get("/lazy-unauthenticated")
+        assert response.status_code == 403
+
+
+def test_lazy_user_starlette_requires():
+    with TestClient(lazy_app()) as client:
+        response = client.get("/dashboard")
+        assert response.status_code == 200
+        assert response.json() == {"authenticated": True, "user": "tom jones"}
+
+
+@decorators.lazy_user
+async def unresolved(request):
+    return JSONResponse({"user": request.user.display_name})
+
+
+def test_lazy_user_must_be_resolved_in_lazy_endpoint():
+    app = lazy_app()
+    app.add_route("/unresolved", unresolved)
+
+    with TestClient(app) as client:
+        with pytest.raises(RuntimeError):
+            client.get("/unresolved")
+
+
+class Connection:
+    def __init__(self, user_id):
+        self.session = {"user": str(user_id)}
+
+
+def count_queries(engine):
+    queries = []
+
+    def before_execute(conn, cursor, statement, *args):
+        queries.append(statement)
+
+    sa.event.listen(engine.sync_engine, "before_cursor_execute", before_execute)
+    return queries
+
+
+@pytest.mark.asyncio
+async def test_cached_user(database, user):
+    cache = TTLCache()
+    backend = AuthBackend(cache=cache)
+    queries = count_queries(database.engine)
+
+    first = await backend.get_user(Connection(user.id))
+    assert len(queries) == 2  # the user, then their scopes
+    second = await backend.get_user(Connection(user.id))
+    assert len(queries) == 2
+    assert cache.stats["hits"] == 1 and cache.stats["misses"] == 1
+
+    assert second is not first
+    assert second.email == user.email
+    assert second.scopes == []
+    assert sa.inspect(second).detached
+
+    # unchanged, so saving the cached copy doesn't write anything
+    await second.save()
+    assert len(queries) == 2
+
+
+@pytest.mark.asyncio
+async def test_cached_user_invalidated_on_save(database, user):
+    cache = TTLCache()
+    backend = AuthBackend(cache=cache)
+
+    cached = await backend.get_user(Connection(user.id))
+    cached.first_name = "Changed"
+    await cached.save()
+    assert cache.get(user.id) is None
+
+    refreshed = await backend.get_user(Connection(user.id))
+    assert refreshed.first_name == "Changed"
+
+    scope = Scope(code="admin")
+    await scope.save()
+    assert cache.get(user.id) is None
+
+    refreshed.scopes.append(scope)
+    await refreshed.save()
+    refreshed = await backend.get_user(Connection(user.id))
+    assert [s.code for s in refreshed.scopes] == ["admin"]
+
+    refreshed.scopes.clear()
+    await refreshed.save()
+    await refreshed.delete()
+    assert cache.get(user.id) is None
+    assert await backend.get_user(Connection(user.id)) is None
+
+
+@pytest.mark.asyncio
+async def test_cached_user_invalidated_on_update(database, user):
+    cache = TTLCache()
+    backend = AuthBackend(cache=cache)
+    other = await create_user("other@example.com", "pass", "Other", "User")
+
+    await backend.get_user(Connection(user.id))
+    await backend.get_user(Connection(other.id))
+
+    # only the users updated are removed
+    await User.update(user.id, first_name="Changed")
+    assert cache.get(user.id) is None
+    assert cache.get(other.id) is not None
+
+    refreshed = await backend.get_user(Connection(user.id))
+    assert refreshed.first_name == "Changed"
+
+    await User.update_where(User.email.like("%@example.com"), is_active=False)
+    assert cache.get(user.id) is None
+    assert cache.get(other.id) is None
+
+    # statements on the model rather than its table
+    await backend.get_user(Connection(user.id))
+    await User.execute(sa.update(User).values(is_active=True))
+    assert cache.get(user.id) is None
+
+
+@pytest.mark.asyncio
+async def test_concurrent_loads_share_query(database, user):
+    backend = AuthBackend()
+    queries = count_queries(database.engine)
+
+    users = await asyncio.gather(
+        *[backend.get_user(Connection(user.id)) for _ in range(3)]
+    )
+    assert len(queries) == 2  # the user, then their scopes
+    assert [u.email for u in users] == [user.email] * 3
+    assert users[0] is not users[1]
+    assert sa.inspect(users[1]).detached
@@ -0,0 +1,100 @@
+import pytest
+
+from app.auth import hashers
+from app.auth.hashers import (
+    Argon2PasswordHasher,
+    LegacyPBKDF2PasswordHasher,
+    PBKDF2PasswordHasher,
+    ScryptPasswordHasher,
+    check_password,
+    get_hasher,
+    identify_hasher,
+    make_password,
+    must_update,
+)
+from app.calibrate_hashers import calibrate
+from app.utils.testing import make_legacy_password
+
+
+def test_make_password_uses_default_hasher():
+    encoded = make_password("password")
+    assert encoded.startswith("pbkdf2_sha512$%d$" % PBKDF2PasswordHasher.cost)
+    assert check_password("password", encoded)
+    assert not check_password("wrong", encoded)
+    assert not must_update(encoded)
+
+
+@pytest.mark.parametrize("hasher", [PBKDF2PasswordHasher(), ScryptPasswordHasher()])
+def test_encode_verify(hasher):
+    encoded = hasher.encode("password", hasher.salt())
+    assert identify_hasher(encoded).algorithm == hasher.algorithm
+    assert hasher.verify("password", encoded)
+    assert not hasher.verify("wrong", encoded)
+    assert hasher.decode_cost(encoded) == hasher.cost
+    assert not hasher.must_update(encoded)
+
+
+@pytest.mark.parametrize("hasher", [PBKDF2PasswordHasher(), ScryptPasswordHasher()])
+def test_verify_at_another_cost_must_update(hasher):
+    cheaper = hasher.__class__(cost=hasher.cost // 2)
+    encoded = cheaper.encode("password", cheaper.salt())
+    assert check_password("password", encoded)
+    assert hasher.must_update(encoded)
+    assert must_update(encoded)
+
+
+def test_other_algorithm_must_update():
+    hasher = ScryptPasswordHasher()
+    encoded = hasher.encode("password", hasher.salt())
+    assert must_update(encoded)
+
+
+def test_legacy():
+    encoded = make_legacy_password("password")
+    assert identify_hasher(encoded).algorithm == LegacyPBKDF2PasswordHasher.algorithm
+    assert check_password("password", encoded)
+    assert not check_password("wrong", encoded)
+    assert must_update(encoded)
+    with pytest.raises(NotImplementedError):
+        LegacyPBKDF2PasswordHasher().encode("password", "salt")
+
+
+def test_argon2_requires_library():
+    pytest.importorskip("argon2")
+    hasher = Argon2PasswordHasher()
+    encoded = hasher.encode("password", hasher.salt())
+    assert check_password("password", encoded)
+    assert hasher.decode_cost(encoded) == hasher.cost
+
+
+def test_unknown_or_empty():
+    assert not check_password("password", "")
+    assert not check_password("password", None)
+    assert not check_password("password", "md5$abc")
+    assert not must_update("")
+    with pytest.raises(ValueError):
+        get_hasher("md5")
+
+
+def test_recommend_cost():
+    assert PBKDF2PasswordHasher(cost=1000).recommend_cost(0.01, 0.1) == 10000
+    assert ScryptPasswordHasher(cost=1024).recommend_cost(0.01, 0.05) == 4096
+
+
+def test_testing_profile_is_cheap():
+    assert PBKDF2PasswordHasher.cost < 100000
+
+
+@pytest.mark.asyncio
+async def test_runs_on_executor():
+    completed = hashers.executor.completed
+    encoded = await hashers.executor.run(make_password, "password")
+    assert await hashers.executor.run(check_password, "password", encoded)
+    assert hashers.executor.completed == completed + 2
+
+
+def test_calibrate(capsys):
+    calibrate(1, 1, ["pbkdf2_sha512", "pbkdf2_sha512_legacy"])
+    out = capsys.readouterr().out
+    assert "pbkdf2_sha512: cost" in out
+    assert "pbkdf2_sha512_legacy: skipped" in out
@@ -0,0 +1,109 @@
+import time
+from unittest import mock
+
+import pytest
+import sqlalchemy as sa
+
+from app.auth import cache
+from app.auth.backends import AuthBackend
+from app.auth.snapshot import SESSION_KEY, SessionSnapshot, SnapshotUser
+from app.auth.tables import User
+
+
+class Connection:
+    def __init__(self, user_id):
+        self.session = {"user": str(user_id)}
+
+
+def test_make_and_load(user):
+    snapshot = SessionSnapshot(max_age=60)
+    session = {"user": str(user.id), SESSION_KEY: snapshot.make(user)}
+
+    data = snapshot.load(session)
+    assert data["id"] == user.id
+    assert data["scopes"] == []
+
+    snapshot_user = snapshot.user(data)
+    assert isinstance(snapshot_user, SnapshotUser)
+    assert snapshot_user.is_authenticated
+    assert snapshot_user.identity == str(user.id)
+
+
+def test_load_rejects(user):
+    snapshot = SessionSnapshot(max_age=60)
+
+    # tampered with
+    data = dict(snapshot.make(user), scopes=["admin"])
+    assert snapshot.load({"user": str(user.id), SESSION_KEY: data}) is None
+    assert snapshot.load({"user": str(user.id), SESSION_KEY: {"id": 1}}) is None
+    assert snapshot.load({"user": str(user.id), SESSION_KEY: "junk"}) is None
+
+    # for another user
+    data = snapshot.make(user)
+    assert snapshot.load({"user": "other", SESSION_KEY: data}) is None
+
+    # too old
+    with mock.patch("time.time", return_value=time.time() - 61):
+        data = snapshot.make(user)
+    assert snapshot.load({"user": str(user.id), SESSION_KEY: data}) is None
+
+    # changed in this process since
+    with mock.patch("time.time", return_value=time.time() - 10):
+        data = snapshot.make(user)
+    cache.invalidate(user.id)
+    assert snapshot.load({"user": str(user.id), SESSION_KEY: data}) is None
+
+
+def test_version(user):
+    snapshot = SessionSnapshot(max_age=60)
+    session = {"user": str(user.id), SESSION_KEY: snapshot.make(user)}
+    assert not snapshot.is_revoked(session, user)
+
+    user.set_password("new")
+    assert snapshot.is_revoked(session, user)
+
+    snapshot.update_version(session, user)
+    assert not snapshot.is_revoked(session, user)
+    assert snapshot.load(session) is not None
+
+
+@pytest.mark.asyncio
+async def test_backend_uses_snapshot(database, user):
+    backend = AuthBackend(snapshot=SessionSnapshot(max_age=60))
+    conn = Connection(user.id)
+
+    credentials, loaded = await backend.authenticate(conn)
+    assert isinstance(loaded, User)
+    assert SESSION_KEY in conn.session
+
+    queries = []
+    sa.event.listen(
+        database.engine.sync_engine,
+        "before_cursor_execute",
+        lambda *args: queries.append(args),
+    )
+    credentials, loaded = await backend.authenticate(conn)
+    assert isinstance(loaded, SnapshotUser)
+    assert loaded.id == user.id
+    assert credentials.scopes == ["authenticated"]
+    assert queries == []
+
+
+@pytest.mark.asyncio
+async def test_backend_revokes_on_password_change(user):
+    snapshot = SessionSnapshot(max_age=60)
+    backend = AuthBackend(snapshot=snapshot)
+    conn = Connection(user.id)
+    await backend.authenticate(conn)
+
+    # changed by another process, so only seen once the snapshot is old
+    stored = await User.get(user.id)
+    stored.set_password("new")
+    with mock.patch.object(cache, "changed_since", return_value=False):
+        await stored.save()
+    conn.session[SESSION_KEY]["checked"] -= 61
+    conn.session[SESSION_KEY]["signature"] = snapshot._sign(conn.session[SESSION_KEY])
+
+    credentials, loaded = await backend.authenticate(conn)
+    assert not loaded.is_authenticated
+    assert conn.session == {}
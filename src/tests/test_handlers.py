@@ -1,9 +1,13 @@
 from copy import copy
 
 import pytest
+import sqlalchemy as sa
 from httpx import ASGITransport, AsyncClient
 
+from app.auth.decorators import lazy_user
 from app.main import app
+from app.utils.database import ModelBase
+from app.utils.deadlines import deadline
 
 
 @pytest.mark.asyncio
@@ -32,3 +36,62 @@ async def test_500():
         response = await client.get("/force-error")
         assert response.status_code == 500
         assert "500" in str(response.content)
+
+
+@pytest.mark.asyncio
+async def test_503():
+    async def no_connection(request):
+        raise sa.exc.TimeoutError()
+
+    copy_app = copy(app)
+    copy_app.add_route("/no-connection", no_connection)
+
+    async with AsyncClient(app=copy_app, base_url="http://test") as client:
+        response = await client.get("/no-connection")
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "1"
+        assert "503" in str(response.content)
+
+
+@pytest.mark.asyncio
+async def test_504():
+    @deadline(0.1)
+    async def slow(request):
+        await ModelBase.execute(sa.text("SELECT pg_sleep(5)"))
+
+    copy_app = copy(app)
+    copy_app.add_route("/slow", slow)
+
+    async with AsyncClient(app=copy_app, base_url="http://test") as client:
+        response = await client.get("/slow")
+        assert response.status_code == 504
+        assert "504" in str(response.content)
+
+
+@pytest.mark.asyncio
+async def test_504_keeps_user_logged_in(user):
+    async def slow(request):
+        await ModelBase.execute(sa.text("SELECT pg_sleep(5)"))
+
+    copy_app = copy(app)
+    copy_app.add_route("/slow", deadline(0.1)(slow))
+    copy_app.add_route("/slow-lazy", lazy_user(deadline(0.1)(slow)))
+
+    async with AsyncClient(app=copy_app, base_url="http://test") as client:
+        url = app.url_path_for("auth:login")
+        await client.post(url, data={"email": user.email, "password": "pass"})
+
+        # the user was loaded before the endpoint ran
+        response = await client.get("/slow")
+        assert response.status_code == 504
+        assert "Logout" in response.text
+        assert "set-cookie" not in response.headers
+
+        # the page is rendered without loading the user, who isn't logged out
+        response = await client.get("/slow-lazy")
+        assert response.status_code == 504
+        assert "Logout" not in response.text
+        assert "set-cookie" not in response.headers
+
+        response = await client.get(app.url_path_for("auth:password_change"))
+        assert response.status_code == 200
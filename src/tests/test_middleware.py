@@ -0,0 +1,268 @@
+import asyncio
+import time
+
+import itsdangerous
+import pytest
+import sqlalchemy as sa
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.testclient import TestClient
+
+from app.auth.tables import User
+from app.db import db
+from app.middleware import (
+    DatabaseSessionMiddleware,
+    Session,
+    SessionMiddleware,
+    is_excluded,
+)
+from app.utils.database import ModelBase
+from app.utils.sessions.backends import MemorySessionBackend
+from app.utils.testing import create_user
+
+
+def test_session_modified():
+    session = Session({"user": "1"})
+    assert not session.modified
+
+    session["user"] = "1"
+    session.get("user")
+    session.pop("missing", None)
+    session.setdefault("user", "2")
+    assert not session.modified
+
+    session["user"] = "2"
+    assert session.modified
+
+
+@pytest.mark.parametrize(
+    "change",
+    [
+        lambda s: s.__setitem__("other", 1),
+        lambda s: s.__delitem__("user"),
+        lambda s: s.clear(),
+        lambda s: s.pop("user"),
+        lambda s: s.popitem(),
+        lambda s: s.setdefault("other", 1),
+        lambda s: s.update(user="2"),
+    ],
+)
+def test_session_changes(change):
+    session = Session({"user": "1"})
+    change(session)
+    assert session.modified
+
+
+def session_app(**kwargs):
+    async def view(request):
+        if "set" in request.query_params:
+            request.session["value"] = request.query_params["set"]
+        if "clear" in request.query_params:
+            request.session.clear()
+        if "user" in request.query_params:
+            request.session["user"] = request.query_params["user"]
+        return JSONResponse(dict(request.session))
+
+    app = Starlette()
+    app.add_middleware(SessionMiddleware, secret_key="example", **kwargs)
+    app.add_route("/", view)
+    return app
+
+
+def test_cookie_only_sent_when_changed():
+    with TestClient(session_app()) as client:
+        response = client.get("/", params={"set": "a"})
+        assert response.json() == {"value": "a"}
+        assert "set-cookie" in response.headers
+
+        response = client.get("/")
+        assert response.json() == {"value": "a"}
+        assert "set-cookie" not in response.headers
+
+        response = client.get("/", params={"set": "a"})
+        assert "set-cookie" not in response.headers
+
+        response = client.get("/", params={"set": "b"})
+        assert "set-cookie" in response.headers
+
+        response = client.get("/", params={"clear": "1"})
+        assert response.json() == {}
+        assert "null" in response.headers["set-cookie"]
+
+
+def test_cookie_reissued_when_old():
+    class OldSigner(itsdangerous.TimestampSigner):
+        def get_timestamp(self):
+            return int(time.time()) - 60
+
+    with TestClient(session_app(max_age=100, refresh_fraction=0.5)) as client:
+        response = client.get("/", params={"set": "a"})
+        cookie = response.cookies["session"]
+
+        # re-sign the same data as if it were a minute old
+        data = itsdangerous.TimestampSigner("example").unsign(cookie)
+        old = OldSigner("example").sign(data).decode("utf-8")
+        client.cookies.set("session", old)
+
+        response = client.get("/")
+        assert response.json() == {"value": "a"}
+        assert "set-cookie" in response.headers
+
+
+@pytest.mark.parametrize(
+    "path,excluded",
+    [
+        ("/static", True),
+        ("/static/css/karma.css", True),
+        ("/staticfiles/karma.css", False),
+        ("/", False),
+        ("/auth/login", False),
+    ],
+)
+def test_is_excluded(path, excluded):
+    assert is_excluded({"path": path}, ["/static"]) is excluded
+
+
+@pytest.mark.asyncio
+async def test_static_skips_session_and_database(client, login):
+    checkouts = []
+
+    def on_checkout(*args):
+        checkouts.append(args)
+
+    pool = db.engine.sync_engine.pool
+    sa.event.listen(pool, "checkout", on_checkout)
+    try:
+        response = await client.get("/static/css/karma.min.css")
+        assert response.status_code == 200
+        assert "set-cookie" not in response.headers
+
+        response = await client.get("/static/missing.css")
+        assert response.status_code == 404
+        assert "set-cookie" not in response.headers
+    finally:
+        sa.event.remove(pool, "checkout", on_checkout)
+
+    assert checkouts == []
+
+    # the session is untouched for other paths
+    response = await client.get("/")
+    assert response.status_code == 200
+    assert "Logout" in response.text
+
+
+def test_server_side_session():
+    backend = MemorySessionBackend()
+
+    with TestClient(session_app(backend=backend)) as client:
+        response = client.get("/", params={"set": "a" * 100})
+        cookie = response.cookies["session"]
+        key = itsdangerous.TimestampSigner("example").unsign(cookie).decode()
+        assert list(backend.entries) == [key]
+
+        # the cookie stays the same size as the session grows
+        response = client.get("/", params={"set": "a" * 1000})
+        assert len(response.cookies["session"]) == len(cookie)
+        assert response.json() == {"value": "a" * 1000}
+
+        response = client.get("/")
+        assert response.json() == {"value": "a" * 1000}
+
+        # clearing the session deletes it from the backend
+        response = client.get("/", params={"clear": "1"})
+        assert "null" in response.headers["set-cookie"]
+        assert list(backend.entries) == []
+
+
+def test_server_side_session_revoked():
+    backend = MemorySessionBackend()
+
+    with TestClient(session_app(backend=backend)) as client:
+        response = client.get("/", params={"set": "a"})
+        key = itsdangerous.TimestampSigner("example").unsign(
+            response.cookies["session"]
+        )
+        backend.entries.clear()
+
+        response = client.get("/")
+        assert response.json() == {}
+
+        # a new key is used rather than the revoked one
+        response = client.get("/", params={"set": "b"})
+        new_key = itsdangerous.TimestampSigner("example").unsign(
+            response.cookies["session"]
+        )
+        assert new_key != key
+
+
+def test_server_side_session_rotated_on_login():
+    backend = MemorySessionBackend()
+    signer = itsdangerous.TimestampSigner("example")
+
+    with TestClient(session_app(backend=backend)) as client:
+        response = client.get("/", params={"set": "a"})
+        key = signer.unsign(response.cookies["session"]).decode()
+
+        # the key known before logging in isn't the user's session
+        response = client.get("/", params={"user": "1"})
+        user_key = signer.unsign(response.cookies["session"]).decode()
+        assert user_key != key
+        assert list(backend.entries) == [user_key]
+        assert response.json() == {"value": "a", "user": "1"}
+
+        # the new key is kept while the user stays logged in
+        response = client.get("/", params={"set": "b"})
+        assert signer.unsign(response.cookies["session"]).decode() == user_key
+
+        response = client.get("/", params={"user": "2"})
+        assert signer.unsign(response.cookies["session"]).decode() != user_key
+        assert len(backend.entries) == 1
+
+
+@pytest.mark.asyncio
+async def test_database_session_cancelled_on_disconnect(database):
+    async def view(request):
+        await create_user("test@example.com", "pass", "Test", "User")
+        await ModelBase.execute(sa.text("SELECT pg_sleep(5)"))
+        return JSONResponse({})
+
+    app = Starlette()
+    app.add_middleware(DatabaseSessionMiddleware, database=database)
+    app.add_route("/", view)
+
+    async def receive():
+        await asyncio.sleep(0.2)
+        return {"type": "http.disconnect"}
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/",
+        "query_string": b"",
+        "headers": [],
+    }
+    started = time.monotonic()
+    await app(scope, receive, send)
+
+    # the query was cancelled and the user rolled back
+    assert time.monotonic() - started < 2
+    assert sent == []
+    assert await User.first(sa.select(User)) is None
+
+
+@pytest.mark.asyncio
+async def test_server_timing(client, login):
+    response = await client.get("/")
+    assert response.status_code == 200
+    # at least the user and the commit
+    timing = response.headers["server-timing"]
+    assert timing.startswith("db;dur=")
+    assert int(timing.split('desc="')[1].split()[0]) >= 2
+
+    response = await client.get("/static/css/karma.min.css")
+    assert "server-timing" not in response.headers
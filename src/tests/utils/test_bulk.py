@@ -0,0 +1,111 @@
+from unittest import mock
+
+import pytest
+import sqlalchemy as sa
+
+from app.auth.cache import register
+from app.auth.tables import Scope, User
+from app.utils import bulk
+from app.utils.cache import TTLCache
+
+
+async def emails():
+    result = await User.execute(
+        sa.select(User.email, User.first_name).order_by(User.email)
+    )
+    return [tuple(row) for row in result]
+
+
+@pytest.fixture(params=[True, False], ids=["copy", "values"])
+def copy(request):
+    with mock.patch("app.utils.bulk.supports_copy", return_value=request.param):
+        yield request.param
+
+
+@pytest.mark.asyncio
+async def test_bulk_insert(database, copy):
+    rows = [{"code": f"scope-{i}", "description": ""} for i in range(5)]
+    result = await Scope.bulk_insert(rows, chunk_size=2, returning=True)
+
+    assert len(result.ids) == 5
+    assert [chunk["rows"] for chunk in result.chunks] == [2, 2, 1]
+    assert result.rowcount == 5
+    assert result.seconds > 0
+
+    scopes = (await Scope.execute(sa.select(Scope).order_by(Scope.id))).scalars()
+    assert [(s.id, s.code) for s in scopes] == [
+        (id, f"scope-{i}") for i, id in enumerate(result.ids)
+    ]
+
+    # rows are read as they are written, a chunk at a time
+    read = []
+
+    def generate():
+        for i in range(5, 10):
+            read.append(i)
+            yield {"code": f"scope-{i}", "description": ""}
+
+    columns, records = bulk.prepare_rows(Scope.__table__, generate())
+    chunks = bulk.chunked(records, 2)
+    assert len(next(chunks)) == 2 and read == [5, 6]
+    result = await Scope.bulk_insert(generate(), chunk_size=2)
+    assert [chunk["rows"] for chunk in result.chunks] == [2, 2, 1]
+
+    # defaults are filled in
+    await User.bulk_insert([{"email": "a@example.com"}])
+    assert (await User.execute(sa.select(User.is_active))).scalar() is True
+
+    with pytest.raises(ValueError):
+        await Scope.bulk_insert([{"code": "a"}, {"description": "b"}])
+
+
+@pytest.mark.asyncio
+async def test_bulk_upsert(database, copy):
+    await User.bulk_insert(
+        [
+            {"email": "a@example.com", "first_name": "a"},
+            {"email": "b@example.com", "first_name": "b"},
+        ]
+    )
+
+    rows = [
+        {"email": "b@example.com", "first_name": "bob"},
+        {"email": "c@example.com", "first_name": "c"},
+    ]
+    await User.bulk_upsert(rows, conflict=["email"])
+    assert await emails() == [
+        ("a@example.com", "a"),
+        ("b@example.com", "bob"),
+        ("c@example.com", "c"),
+    ]
+
+    rows = [
+        {"email": "a@example.com", "first_name": "ann"},
+        {"email": "d@example.com", "first_name": "d"},
+    ]
+    result = await User.bulk_upsert(rows, conflict=["email"], update=[], returning=True)
+    assert len(result.ids) == 1
+    assert (await emails())[0] == ("a@example.com", "a")
+
+
+@pytest.mark.asyncio
+async def test_bulk_in_unit_of_work(database):
+    async with database.unit_of_work():
+        await Scope.bulk_insert([{"code": "a"}])
+        with pytest.raises(sa.exc.IntegrityError):
+            await Scope.bulk_insert([{"code": "b"}, {"code": "a"}])
+        await Scope.bulk_insert([{"code": "c"}])
+
+    codes = await Scope.execute(sa.select(Scope.code).order_by(Scope.code))
+    assert codes.scalars().all() == ["a", "c"]
+
+
+@pytest.mark.asyncio
+async def test_bulk_invalidates_user_cache(database, user):
+    cache = register(TTLCache())
+    cache.set(user.id, {})
+
+    await User.bulk_upsert(
+        [{"email": user.email, "first_name": "changed"}], conflict=["email"]
+    )
+    assert cache.get(user.id) is None
@@ -0,0 +1,42 @@
+from unittest import mock
+
+from app.utils.cache import TTLCache
+
+
+def test_get_and_set():
+    cache = TTLCache()
+    assert cache.get("a") is None
+    assert cache.get("a", 1) == 1
+
+    cache.set("a", 2)
+    assert cache.get("a") == 2
+    assert cache.stats == {"entries": 1, "hits": 1, "misses": 2, "evictions": 0}
+
+    cache.delete("a")
+    assert cache.get("a") is None
+
+
+def test_expires():
+    cache = TTLCache(ttl=10)
+    with mock.patch("time.monotonic", return_value=100):
+        cache.set("a", 1)
+    with mock.patch("time.monotonic", return_value=109):
+        assert cache.get("a") == 1
+    with mock.patch("time.monotonic", return_value=111):
+        assert cache.get("a") is None
+    assert cache.stats["entries"] == 0
+
+
+def test_evicts_least_recently_used():
+    cache = TTLCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.stats["evictions"] == 1
+
+    cache.clear()
+    assert cache.get("a") is None
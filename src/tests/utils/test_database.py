@@ -1,9 +1,19 @@
+import asyncio
+from unittest import mock
+
 import pytest
 import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import asyncpg as asyncpg_dialect
 from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.applications import Starlette
 from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse
+from starlette.testclient import TestClient
 
-from app.utils.database import ModelBase
+from app.middleware import DatabaseSessionMiddleware
+from app.settings import DATABASE_URL
+from app.utils import singleflight
+from app.utils.database import Database, ModelBase
 
 
 class SomeModel(ModelBase):
@@ -93,3 +103,467 @@ async def test_declarative_base__get_or_404(database):
     with pytest.raises(HTTPException) as e:
         await SomeModel.get_or_404(1000)
     assert e.value.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_unit_of_work__shares_session(database):
+    await database.create_all()
+
+    assert database.current_session is None
+
+    async with database.unit_of_work() as session:
+        assert database.current_session is session
+
+        user = SomeModel(name="ted")
+        await user.save()
+        assert user.id is not None
+
+        # the query runs on the same session, so sees the uncommitted row
+        assert await SomeModel.get(user.id) is user
+
+    assert database.current_session is None
+    assert (await SomeModel.get(user.id)).name == "ted"
+
+
+@pytest.mark.asyncio
+async def test_unit_of_work__rolls_back_on_error(database):
+    await database.create_all()
+
+    with pytest.raises(RuntimeError):
+        async with database.unit_of_work():
+            await SomeModel(name="ted").save()
+            raise RuntimeError()
+
+    qs = sa.select(SomeModel).where(SomeModel.name == "ted")
+    result = await SomeModel.execute(qs)
+    assert result.scalars().first() is None
+
+
+@pytest.mark.asyncio
+async def test_unit_of_work__failed_save_keeps_session_usable(database):
+    await database.create_all()
+
+    async with database.unit_of_work():
+        await SomeModel(name="ted").save()
+
+        with pytest.raises(sa.exc.IntegrityError):
+            await SomeModel(name="ted").save()
+
+        await SomeModel(name="bob").save()
+
+    qs = sa.select(SomeModel).order_by(SomeModel.name)
+    result = await SomeModel.execute(qs)
+    assert [m.name for m in result.scalars()] == ["bob", "ted"]
+
+
+def count_queries(engine):
+    queries = []
+
+    def before_execute(conn, cursor, statement, *args):
+        queries.append(statement)
+
+    sa.event.listen(engine.sync_engine, "before_cursor_execute", before_execute)
+    return queries
+
+
+@pytest.mark.asyncio
+async def test_replicas__reads(database):
+    await database.create_all()
+    await SomeModel(name="ted").save()
+
+    db = Database(DATABASE_URL, replica_urls=[DATABASE_URL, DATABASE_URL])
+    primary = count_queries(db.engine)
+    replicas = [count_queries(replica.engine) for replica in db.replicas]
+
+    # round robin
+    ted = await SomeModel.get(1)
+    assert await SomeModel.get(1)
+    assert (len(primary), len(replicas[0]), len(replicas[1])) == (0, 1, 1)
+
+    # read from a replica, but can still be changed
+    assert sa.inspect(ted).detached
+    ted.name = "bob"
+    await ted.save()
+    assert (await SomeModel.execute(sa.select(SomeModel.name))).scalar() == "bob"
+
+
+@pytest.mark.asyncio
+async def test_replicas__least_loaded(database):
+    db = Database(
+        DATABASE_URL,
+        replica_urls=[DATABASE_URL, DATABASE_URL],
+        replica_strategy="least_loaded",
+    )
+    async with db.replicas[0].engine.connect():
+        assert db.get_replica() is db.replicas[1]
+    await db.replicas[0].engine.dispose()
+
+    with pytest.raises(ValueError):
+        Database(DATABASE_URL, replica_strategy="random")
+
+
+@pytest.mark.asyncio
+async def test_replicas__primary_after_write(database):
+    await database.create_all()
+    db = Database(DATABASE_URL, replica_urls=[DATABASE_URL])
+    replica = count_queries(db.replicas[0].engine)
+
+    async with db.unit_of_work():
+        assert db.get_replica() is db.replicas[0]
+        ted = SomeModel(name="ted")
+        await ted.save()
+        assert db.get_replica() is None
+        assert await SomeModel.get(ted.id) is ted
+
+    async with db.unit_of_work(pinned=True):
+        assert db.get_replica() is None
+        assert await SomeModel.get(ted.id)
+
+    assert replica == []
+
+
+@pytest.mark.asyncio
+async def test_replicas__unhealthy(database):
+    await database.create_all()
+    await SomeModel(name="ted").save()
+
+    down = DATABASE_URL.set(host="127.0.0.1", port=1)
+    db = Database(DATABASE_URL, replica_urls=[down])
+
+    # falls back to the primary
+    assert (await SomeModel.get(1)).name == "ted"
+    assert not db.replicas[0].is_healthy
+    assert db.get_replica() is None
+
+
+def test_replicas__pin_cookie(database):
+    db = Database(DATABASE_URL, replica_urls=[DATABASE_URL], read_your_writes=7)
+
+    async def view(request):
+        if request.method == "POST":
+            await ModelBase.execute(sa.text("select 1"))
+        return JSONResponse({"pinned": db.current_session.info["pinned"]})
+
+    app = Starlette()
+    app.add_middleware(DatabaseSessionMiddleware, database=db)
+    app.add_route("/", view, methods=["GET", "POST"])
+
+    with TestClient(app) as client:
+        response = client.get("/")
+        assert response.json() == {"pinned": False}
+        assert "set-cookie" not in response.headers
+
+        response = client.post("/")
+        assert "db_pin=1" in response.headers["set-cookie"]
+        assert "Max-Age=7" in response.headers["set-cookie"]
+        assert "secure" not in response.headers["set-cookie"]
+
+        response = client.get("/")
+        assert response.json() == {"pinned": True}
+
+    # with the flags of the session cookie, on a new loop so a new database
+    db = Database(DATABASE_URL, replica_urls=[DATABASE_URL])
+    app = Starlette()
+    app.add_middleware(
+        DatabaseSessionMiddleware, database=db, same_site="strict", https_only=True
+    )
+    app.add_route("/", view, methods=["POST"])
+
+    with TestClient(app) as client:
+        response = client.post("/")
+        assert "samesite=strict; secure" in response.headers["set-cookie"]
+
+
+@pytest.mark.asyncio
+async def test_stream(database):
+    await database.create_all()
+    async with database.unit_of_work():
+        for i in range(5):
+            await SomeModel(name=f"name {i}").save()
+
+    qs = sa.select(SomeModel).order_by(SomeModel.id)
+    batches = [batch async for batch in SomeModel.stream(qs, batch_size=2)]
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert batches[0][0].name == "name 0"
+
+    qs = sa.select(SomeModel.name).order_by(SomeModel.id)
+    batches = [batch async for batch in SomeModel.stream(qs, batch_size=3)]
+    assert batches == [["name 0", "name 1", "name 2"], ["name 3", "name 4"]]
+
+    qs = sa.select(SomeModel.id, SomeModel.name).order_by(SomeModel.id)
+    batches = [batch async for batch in SomeModel.stream(qs, batch_size=5)]
+    assert [tuple(row) for row in batches[0]][:2] == [(1, "name 0"), (2, "name 1")]
+
+    # in a unit of work it shares the session
+    async with database.unit_of_work():
+        batches = [batch async for batch in SomeModel.stream(qs)]
+        assert len(batches[0]) == 5
+
+
+@pytest.mark.asyncio
+async def test_stream__closed_early(database):
+    await database.create_all()
+    async with database.unit_of_work():
+        for i in range(5):
+            await SomeModel(name=f"name {i}").save()
+
+    pool = database.engine.sync_engine.pool
+    stream = SomeModel.stream(sa.select(SomeModel), batch_size=2)
+    async for batch in stream:
+        assert pool.checkedout() == 1
+        break
+    await stream.aclose()
+    assert pool.checkedout() == 0
+
+
+@pytest.mark.asyncio
+async def test_update(database):
+    await database.create_all()
+    async with database.unit_of_work():
+        for name in ("ted", "bob", "sue"):
+            await SomeModel(name=name).save()
+    ted, bob, sue = (await SomeModel.execute(sa.select(SomeModel.id))).scalars()
+
+    queries = []
+    sa.event.listen(
+        database.engine.sync_engine,
+        "before_cursor_execute",
+        lambda conn, cursor, statement, *args: queries.append(statement),
+    )
+    assert await SomeModel.update(ted, name="ted 2") == [ted]
+    assert len(queries) == 1 and queries[0].startswith("UPDATE")
+    assert await SomeModel.update([bob, sue, 99], name=SomeModel.name + "!") in (
+        [bob, sue],
+        [sue, bob],
+    )
+    assert await SomeModel.update(99, name="nobody") == []
+
+    qs = sa.select(SomeModel.name).order_by(SomeModel.id)
+    names = (await SomeModel.execute(qs)).scalars().all()
+    assert names == ["ted 2", "bob!", "sue!"]
+
+
+@pytest.mark.asyncio
+async def test_update__instances(database):
+    await database.create_all()
+    instance = SomeModel(name="ted")
+    await instance.save()
+
+    # the instance passed is given the new value, without being dirty
+    await SomeModel.update(instance, name="ted 2")
+    assert instance.name == "ted 2"
+    assert not sa.inspect(instance).modified
+
+    # as are instances of the rows in the unit of work
+    async with database.unit_of_work() as session:
+        loaded = await SomeModel.get(instance.id)
+        assert await SomeModel.update_where(SomeModel.name == "ted 2", name="ed")
+        assert loaded.name == "ed"
+        assert not session.dirty
+        assert session.info["wrote"]
+    assert (await SomeModel.get(instance.id)).name == "ed"
+
+
+def count_queries(engine):
+    queries = []
+
+    def before_execute(conn, cursor, statement, *args):
+        queries.append(statement)
+
+    sa.event.listen(engine.sync_engine, "before_cursor_execute", before_execute)
+    return queries
+
+
+@pytest.mark.asyncio
+async def test_get_many(database):
+    await database.create_all()
+    async with database.unit_of_work():
+        for name in ("ted", "bob"):
+            await SomeModel(name=name).save()
+
+    queries = count_queries(database.engine)
+    instances = await SomeModel.get_many([2, 99, 1])
+    assert [i and i.name for i in instances] == ["bob", None, "ted"]
+    assert len(queries) == 1 and "ANY" in queries[0]
+    assert await SomeModel.get_many([]) == []
+
+
+@pytest.mark.asyncio
+async def test_get__batched_in_unit_of_work(database):
+    await database.create_all()
+    async with database.unit_of_work():
+        for name in ("ted", "bob", "sue"):
+            await SomeModel(name=name).save()
+
+    queries = count_queries(database.engine)
+    async with database.unit_of_work():
+        # gets at the same time share a query
+        ted, bob, nobody = await asyncio.gather(
+            SomeModel.get(1), SomeModel.get(2), SomeModel.get(99)
+        )
+        assert (ted.name, bob.name, nobody) == ("ted", "bob", None)
+        assert len(queries) == 1
+
+        # and are remembered, along with ids that weren't found
+        assert await SomeModel.get(1) is ted
+        assert await SomeModel.get_or_404(2) is bob
+        assert await SomeModel.get(99) is None
+        instances = await SomeModel.get_many([3, 1])
+        assert instances[1] is ted and instances[0].name == "sue"
+        assert len(queries) == 2
+
+        # until something is written
+        await SomeModel.update(1, name="ted 2")
+        await bob.delete()
+        queries.clear()
+        assert (await SomeModel.get(1)).name == "ted 2"
+        assert await SomeModel.get(2) is None
+        assert len(queries) == 1
+
+
+@pytest.mark.asyncio
+async def test_get__batched_error(database):
+    await database.create_all()
+
+    async with database.unit_of_work():
+        results = await asyncio.gather(
+            SomeModel.get("a"), SomeModel.get("b"), return_exceptions=True
+        )
+        assert len(results) == 2
+        assert results[0] is results[1]
+        assert isinstance(results[0], Exception)
+
+
+@pytest.mark.asyncio
+async def test_get__shared_between_units_of_work(database):
+    await database.create_all()
+    await SomeModel(name="ted").save()
+
+    async def request():
+        async with database.unit_of_work() as session:
+            instance = await SomeModel.get(1)
+            assert instance in session
+            return instance
+
+    queries = count_queries(database.engine)
+    first, second, third = await asyncio.gather(request(), request(), request())
+    assert len(queries) == 1
+    assert first.name == second.name == third.name == "ted"
+    assert first is not second
+
+    # but not once a unit of work has to see its own writes
+    async def write():
+        async with database.unit_of_work():
+            await SomeModel.update(1, name="ted 2")
+            return await SomeModel.get(1)
+
+    queries.clear()
+    _, written = await asyncio.gather(request(), write())
+    assert written.name == "ted 2"
+    assert len(queries) == 3
+
+
+@pytest.mark.asyncio
+async def test_get__shared_leader_failed(database):
+    await database.create_all()
+    await SomeModel(name="ted").save()
+
+    # the shared query is run in the first unit of work, so when its
+    # transaction has failed the others run it again in their own
+    async def failed():
+        async with database.unit_of_work() as session:
+            with pytest.raises(sa.exc.DBAPIError):
+                await session.execute(sa.text("SELECT 1 / 0"))
+            try:
+                return await SomeModel.get(1)
+            finally:
+                await session.rollback()
+
+    async def follower():
+        async with database.unit_of_work() as session:
+            while not singleflight.flights.calls:
+                await asyncio.sleep(0)
+            instance = await SomeModel.get(1)
+            assert instance in session
+            return instance
+
+    results = await asyncio.gather(failed(), follower(), return_exceptions=True)
+    assert isinstance(results[0], sa.exc.DBAPIError)
+    assert results[1].name == "ted"
+
+
+@pytest.mark.asyncio
+async def test_get__one_connection(database):
+    await database.create_all()
+    await SomeModel(name="ted").save()
+
+    # a unit of work only ever needs its own connection
+    db = Database(
+        DATABASE_URL,
+        engine_kwargs={"pool_size": 1, "max_overflow": 0, "pool_timeout": 1},
+    )
+    async with db.unit_of_work():
+        await SomeModel.execute(sa.select(SomeModel))
+        assert (await SomeModel.get(1)).name == "ted"
+    await db.engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_fetch(database):
+    await database.create_all()
+    async with database.unit_of_work():
+        for name in ("ted", "bob"):
+            await SomeModel(name=name).save()
+
+    qs = sa.select(SomeModel).order_by(SomeModel.id)
+    assert [row.SomeModel.name for row in await SomeModel.fetch(qs)] == ["ted", "bob"]
+    assert [i.name for i in await SomeModel.scalars(qs)] == ["ted", "bob"]
+    assert (await SomeModel.first(qs)).name == "ted"
+    assert await SomeModel.first(qs.where(SomeModel.id == 99)) is None
+
+    # without a transaction, so there is no BEGIN
+    adapter = asyncpg_dialect.AsyncAdapt_asyncpg_connection
+    start_transaction = adapter._start_transaction
+    isolation_levels = []
+
+    async def begin(self):
+        isolation_levels.append(self.isolation_level)
+        await start_transaction(self)
+
+    with mock.patch.object(adapter, "_start_transaction", begin):
+        await SomeModel.fetch(qs)
+        assert isolation_levels == ["autocommit"]
+        await SomeModel.execute(qs)
+        assert isolation_levels == ["autocommit", "read_committed"]
+
+        # unless autocommit reads are off, as they must be behind pgbouncer
+        database.autocommit_reads = False
+        isolation_levels.clear()
+        await SomeModel.fetch(qs)
+        assert isolation_levels == ["read_committed"]
+
+
+@pytest.mark.asyncio
+async def test_transaction(database):
+    await database.create_all()
+
+    async with SomeModel.transaction():
+        await SomeModel(name="ted").save()
+        await SomeModel.update_where(SomeModel.name == "ted", name="ted 2")
+    assert [i.name for i in await SomeModel.scalars(sa.select(SomeModel))] == ["ted 2"]
+
+    with pytest.raises(ValueError):
+        async with SomeModel.transaction():
+            await SomeModel(name="bob").save()
+            raise ValueError()
+    assert len(await SomeModel.scalars(sa.select(SomeModel))) == 1
+
+    # a savepoint in a unit of work
+    async with database.unit_of_work():
+        await SomeModel(name="sue").save()
+        with pytest.raises(ValueError):
+            async with SomeModel.transaction():
+                await SomeModel(name="bob").save()
+                raise ValueError()
+    names = await SomeModel.scalars(sa.select(SomeModel.name).order_by(SomeModel.id))
+    assert names == ["ted 2", "sue"]
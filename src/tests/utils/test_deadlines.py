@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+import pytest
+import sqlalchemy as sa
+
+from app.utils import deadlines
+from app.utils.database import ModelBase
+
+
+async def statement_timeout(session) -> int:
+    value = (await session.execute(sa.text("SHOW statement_timeout"))).scalar()
+    return int(value.rstrip("ms"))
+
+
+@pytest.mark.asyncio
+async def test_remaining():
+    assert deadlines.remaining() is None
+    with deadlines.within(5):
+        assert 4 < deadlines.remaining() <= 5
+        with deadlines.within(None):
+            assert deadlines.remaining() is None
+    assert deadlines.remaining() is None
+
+
+@pytest.mark.asyncio
+async def test_statement_timeout(database):
+    async with database.unit_of_work() as session:
+        # the transaction begins before the deadline is set
+        assert await statement_timeout(session) == 0
+        with deadlines.within(5):
+            assert 4000 < await statement_timeout(session) <= 5000
+        assert await statement_timeout(session) == 0
+
+    with deadlines.within(5):
+        async with database.unit_of_work() as session:
+            assert 4000 < await statement_timeout(session) <= 5000
+
+
+@pytest.mark.asyncio
+async def test_statement_timeout__read_session(database):
+    # reads are in a transaction, so SET LOCAL applies
+    with deadlines.within(5):
+        async with ModelBase.read_session() as session:
+            assert 4000 < await statement_timeout(session) <= 5000
+
+
+@pytest.mark.asyncio
+async def test_statement_cancelled(database):
+    @deadlines.deadline(0.1)
+    async def slow():
+        await ModelBase.execute(sa.text("SELECT pg_sleep(5)"))
+
+    with pytest.raises(sa.exc.DBAPIError) as e:
+        await slow()
+    assert deadlines.is_timeout(e.value)
+    assert deadlines.remaining() is None
+
+    with pytest.raises(sa.exc.DBAPIError) as e:
+        await ModelBase.execute(sa.text("SELECT 1/0"))
+    assert not deadlines.is_timeout(e.value)
+
+
+@pytest.mark.asyncio
+async def test_cancel(database):
+    async with database.unit_of_work() as session:
+        await deadlines.cancel(session)  # nothing running
+
+        slow = asyncio.ensure_future(session.execute(sa.text("SELECT pg_sleep(5)")))
+        await asyncio.sleep(0.2)
+        started = time.monotonic()
+        await deadlines.cancel(session)
+        with pytest.raises(sa.exc.DBAPIError) as e:
+            await slow
+        assert deadlines.is_timeout(e.value)
+        assert time.monotonic() - started < 2
+        await session.rollback()
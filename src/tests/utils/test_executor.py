@@ -0,0 +1,68 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.utils.executor import BoundedExecutor
+
+
+def test_invalid_kind():
+    with pytest.raises(ValueError):
+        BoundedExecutor(kind="fibre")
+
+
+@pytest.mark.asyncio
+async def test_run_returns_result_off_the_event_loop():
+    executor = BoundedExecutor(max_workers=2)
+
+    result = await executor.run(lambda a, b: (a + b, threading.get_ident()), 1, 2)
+
+    assert result[0] == 3
+    assert result[1] != threading.get_ident()
+    assert executor.stats["completed"] == 1
+    executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_run_propagates_errors():
+    executor = BoundedExecutor(max_workers=1)
+
+    def boom():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        await executor.run(boom)
+
+    assert executor.stats == {
+        "waiting": 0,
+        "running": 0,
+        "completed": 1,
+        "max_waiting": 0,
+    }
+    executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_concurrency_is_capped():
+    executor = BoundedExecutor(max_workers=4, max_concurrency=2)
+    peak = 0
+
+    def work():
+        nonlocal peak
+        peak = max(peak, executor.running)
+        time.sleep(0.01)
+
+    await asyncio.gather(*[executor.run(work) for _ in range(6)])
+
+    assert peak == 2
+    assert executor.stats["max_waiting"] == 4
+    assert executor.stats["completed"] == 6
+    executor.shutdown()
+
+
+def test_shutdown_releases_pool():
+    executor = BoundedExecutor()
+    assert executor.executor is executor.executor
+    executor.shutdown()
+    assert executor._executor is None
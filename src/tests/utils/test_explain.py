@@ -0,0 +1,106 @@
+import asyncio
+from unittest import mock
+
+import pytest
+import sqlalchemy as sa
+
+from app.auth.tables import User
+from app.utils import explain, queries
+from app.utils.database import ModelBase
+from app.utils.testing import create_user
+
+PLAN = {
+    "Node Type": "Nested Loop",
+    "Plans": [
+        {
+            "Node Type": "Seq Scan",
+            "Relation Name": "users",
+            "Actual Rows": 10,
+            "Rows Removed by Filter": 990,
+            "Actual Loops": 2,
+        },
+        {
+            "Node Type": "Index Scan",
+            "Relation Name": "scopes",
+            "Index Name": "scopes_pkey",
+            "Actual Rows": 1,
+            "Actual Loops": 10,
+        },
+    ],
+}
+
+
+def test_seq_scans():
+    assert explain.seq_scans(PLAN, 2000) == [{"table": "users", "rows": 2000}]
+    assert explain.seq_scans(PLAN, 2001) == []
+
+
+def test_shape():
+    changed = dict(PLAN, Plans=[dict(PLAN["Plans"][0], **{"Actual Rows": 5})])
+    assert explain.shape(PLAN) == explain.shape(dict(PLAN, **{"Total Cost": 1}))
+    assert explain.shape(PLAN) != explain.shape(changed)
+
+
+def test_fingerprint():
+    assert explain.fingerprint("SELECT * FROM users WHERE id = %s") == (
+        explain.fingerprint("SELECT *\n FROM users WHERE id = 1")
+    )
+    assert explain.fingerprint("SELECT 1") != explain.fingerprint("SELECT 1 FROM a")
+
+
+def test_should_explain():
+    with mock.patch("app.settings.DATABASE_EXPLAIN_THRESHOLD", 0.5):
+        assert explain.should_explain("SELECT 1", 0.5)
+        assert not explain.should_explain("SELECT 1", 0.1)
+        assert not explain.should_explain("UPDATE users SET id = 1", 1)
+        assert not explain.should_explain("SELECT 1 FROM users FOR UPDATE", 1)
+        with mock.patch("app.settings.DATABASE_EXPLAIN_SAMPLE_RATE", 1):
+            assert explain.should_explain("SELECT 1", 0.1)
+
+
+def test_plan_store():
+    store = explain.PlanStore(max_plans=2, interval=60)
+    first = explain.Plan("SELECT 1", "/", 0.1, [{"Plan": PLAN}])
+    store.add(first)
+    assert not first.changed
+    assert not store.due(first.fingerprint)
+
+    # the same statement with another plan
+    other = {"Node Type": "Result"}
+    second = explain.Plan("SELECT 2", "/", 0.2, [{"Plan": other}])
+    store.add(second)
+    assert second.changed
+
+    store.add(explain.Plan("SELECT 3", "/other", 0.3, [{"Plan": other}]))
+    store.add(explain.Plan("SELECT a", "/other", 0.1, [{"Plan": other}]))
+    assert len(store.plans) == 2
+    assert [p["statement"] for p in store.by_route()["/other"]] == [
+        "SELECT ?",
+        "SELECT a",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_observe(database):
+    await create_user("test@example.com", "pass", "Test", "User")
+    explain.plans.clear()
+    qs = sa.select(User).where(User.first_name == "Test")
+
+    with mock.patch.object(queries, "observers", [explain.observe]), mock.patch(
+        "app.settings.DATABASE_EXPLAIN_THRESHOLD", 1e-9
+    ), mock.patch("app.settings.DATABASE_EXPLAIN_SEQ_SCAN_ROWS", 1):
+        with queries.track({"path": "/users"}):
+            assert (await User.first(qs)).first_name == "Test"
+            await ModelBase.execute(sa.update(User).values(is_active=True))
+        # whose parameters postgres can only tell the types of once cast
+        with queries.track({"path": "/sum"}):
+            await ModelBase.execute(sa.select(sa.literal(1) + sa.literal(2)))
+        await asyncio.gather(*explain.plans.tasks)
+
+    assert len(explain.plans.by_route()["/sum"]) == 1
+    [plan] = explain.plans.by_route()["/users"]
+    assert plan["statement"].startswith('SELECT "user".id')
+    assert plan["seq_scans"] == [{"table": "user", "rows": 1}]
+    assert plan["plan"]["Node Type"] == "Seq Scan"
+    assert not plan["changed"]
+    explain.plans.clear()
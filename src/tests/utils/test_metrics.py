@@ -0,0 +1,51 @@
+from app.utils.metrics import Histogram, render
+
+
+def test_histogram():
+    histogram = Histogram(buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.5, 5):
+        histogram.observe(value)
+
+    assert histogram.cumulative()[-1] == (float("inf"), 4)
+    assert histogram.as_dict() == {
+        "buckets": {"0.1": 1, "1": 3, "+Inf": 4},
+        "count": 4,
+        "sum": 6.05,
+    }
+
+
+def test_render():
+    histogram = Histogram(buckets=(1,))
+    histogram.observe(0.5)
+    samples = [
+        ("requests_total", "counter", {"path": '/a"b'}, 2),
+        ("requests_total", "counter", {"path": "/c"}, 3),
+        ("wait_seconds", "histogram", {}, histogram),
+    ]
+    assert render(samples).splitlines() == [
+        "# TYPE requests_total counter",
+        'requests_total{path="/a\\"b"} 2',
+        'requests_total{path="/c"} 3',
+        "# TYPE wait_seconds histogram",
+        'wait_seconds_bucket{le="1"} 1',
+        'wait_seconds_bucket{le="+Inf"} 1',
+        "wait_seconds_count 1",
+        "wait_seconds_sum 0.5",
+    ]
+
+
+def test_render__groups_samples_by_name():
+    samples = [
+        ("pool_size", "gauge", {"database": "primary"}, 5),
+        ("pool_timeouts_total", "counter", {"database": "primary"}, 0),
+        ("pool_size", "gauge", {"database": "replica0"}, 2),
+        ("pool_timeouts_total", "counter", {"database": "replica0"}, 1),
+    ]
+    assert render(samples).splitlines() == [
+        "# TYPE pool_size gauge",
+        'pool_size{database="primary"} 5',
+        'pool_size{database="replica0"} 2',
+        "# TYPE pool_timeouts_total counter",
+        'pool_timeouts_total{database="primary"} 0',
+        'pool_timeouts_total{database="replica0"} 1',
+    ]
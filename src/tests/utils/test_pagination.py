@@ -0,0 +1,127 @@
+import logging
+from datetime import datetime
+
+import pytest
+import sqlalchemy as sa
+from starlette.exceptions import HTTPException
+
+from app.auth.tables import User
+from app.utils import pagination
+
+
+async def create_users(*names):
+    for i, name in enumerate(names):
+        user = User(email=f"{i}@example.com", first_name=name, last_name="")
+        user.last_login = datetime(2021, 1, 1, 12, i)
+        await user.save()
+
+
+async def all_pages(qs, order_by, limit=2):
+    pages, after = [], None
+    while True:
+        page = await User.paginate(qs, order_by, after=after, limit=limit)
+        pages.append([getattr(u, "email", None) or u for u in page])
+        if not page.has_next:
+            return pages
+        after = page.next_cursor
+
+
+@pytest.mark.asyncio
+async def test_paginate(database):
+    await create_users("a", "b", "c", "d", "e")
+    qs = sa.select(User)
+
+    assert await all_pages(qs, [User.email]) == [
+        ["0@example.com", "1@example.com"],
+        ["2@example.com", "3@example.com"],
+        ["4@example.com"],
+    ]
+    assert await all_pages(qs, [User.email.desc()], limit=3) == [
+        ["4@example.com", "3@example.com", "2@example.com"],
+        ["1@example.com", "0@example.com"],
+    ]
+
+    # filtered
+    qs = sa.select(User).where(User.first_name != "c")
+    assert await all_pages(qs, [User.last_login], limit=3) == [
+        ["0@example.com", "1@example.com", "3@example.com"],
+        ["4@example.com"],
+    ]
+
+
+@pytest.mark.asyncio
+async def test_paginate__mixed_directions(database):
+    await create_users("b", "a", "b", "a", "b")
+    qs = sa.select(User)
+
+    pages = await all_pages(qs, [User.first_name, User.id.desc()])
+    assert pages == [
+        ["3@example.com", "1@example.com"],
+        ["4@example.com", "2@example.com"],
+        ["0@example.com"],
+    ]
+
+
+@pytest.mark.asyncio
+async def test_paginate__rows(database):
+    await create_users("a", "b", "c")
+    qs = sa.select(User.email, User.first_name)
+
+    page = await User.paginate(qs, [User.first_name.desc()], limit=2)
+    assert [tuple(row) for row in page] == [
+        ("2@example.com", "c", 3),
+        ("1@example.com", "b", 2),
+    ]
+    page = await User.paginate(qs, [User.first_name.desc()], after=page.next_cursor)
+    assert [tuple(row) for row in page] == [("0@example.com", "a", 1)]
+
+
+@pytest.mark.asyncio
+async def test_paginate__column(database):
+    await create_users("a", "b", "c")
+    qs = sa.select(User.email)
+
+    page = await User.paginate(qs, [User.email], limit=2)
+    assert [tuple(row) for row in page] == [
+        ("0@example.com", 1),
+        ("1@example.com", 2),
+    ]
+    page = await User.paginate(qs, [User.email], after=page.next_cursor)
+    assert [tuple(row) for row in page] == [("2@example.com", 3)]
+
+
+@pytest.mark.asyncio
+async def test_paginate__invalid_cursor(database):
+    await create_users("a", "b", "c")
+    qs = sa.select(User)
+    page = await User.paginate(qs, [User.email], limit=1)
+
+    for cursor in ["junk", page.next_cursor[:-2] + "AA"]:
+        with pytest.raises(HTTPException) as e:
+            await User.paginate(qs, [User.email], after=cursor)
+        assert e.value.status_code == 400
+
+    # made for another sort order
+    with pytest.raises(HTTPException):
+        await User.paginate(qs, [User.email.desc()], after=page.next_cursor)
+
+
+def test_cursor_round_trip():
+    keys = pagination.sort_keys([User.last_login.desc()], User.id)
+    values = [datetime(2021, 1, 1, 12, 30), 5]
+    cursor = pagination.encode_cursor(keys, values)
+    assert pagination.decode_cursor(keys, cursor) == values
+
+
+def test_check_index(caplog):
+    with caplog.at_level(logging.WARNING, logger="app.utils.pagination"):
+        assert pagination.check_index(pagination.sort_keys([User.email], User.id))
+        assert pagination.check_index(pagination.sort_keys([], User.id))
+        assert not pagination.check_index(
+            pagination.sort_keys([User.first_name], User.id)
+        )
+        assert not pagination.check_index(
+            pagination.sort_keys([User.first_name], User.id)
+        )
+    assert len(caplog.records) == 1
+    assert "first_name" in caplog.records[0].getMessage()
@@ -0,0 +1,118 @@
+import pytest
+import sqlalchemy as sa
+
+from app.settings import DATABASE_URL
+from app.utils.database import Database, ModelBase
+from app.utils.pool import (
+    InstrumentedPool,
+    PgBouncerConnection,
+    engine_options,
+    pool_stats,
+)
+
+
+@pytest.mark.asyncio
+async def test_pool_stats(database):
+    db = Database(
+        DATABASE_URL,
+        engine_kwargs={
+            "poolclass": InstrumentedPool,
+            "pool_size": 1,
+            "max_overflow": 0,
+            "pool_timeout": 0.1,
+        },
+    )
+    try:
+        async with db.engine.connect() as conn:
+            stats = pool_stats(db.engine)
+            assert stats["size"] == 1
+            assert stats["checked_out"] == 1
+            assert stats["overflow"] == 0
+
+            # the only connection is in use
+            with pytest.raises(sa.exc.TimeoutError):
+                async with db.engine.connect():
+                    pass
+            await conn.execute(sa.text("SELECT 1"))
+
+        stats = pool_stats(db.engine)
+        assert stats["checked_out"] == 0
+        assert stats["timeouts"] == 1
+        assert stats["wait"]["count"] == 2
+        assert stats["wait"]["sum"] >= 0.1
+
+        # kept when the pool is replaced
+        await db.engine.dispose()
+        assert pool_stats(db.engine)["timeouts"] == 1
+    finally:
+        await db.engine.dispose()
+        ModelBase.db = database
+
+
+def test_pool_stats__other_pools(database):
+    db = Database(DATABASE_URL, engine_kwargs={"poolclass": sa.pool.NullPool})
+    ModelBase.db = database
+    assert pool_stats(db.engine) == {"class": "NullPool"}
+
+
+def test_engine_options():
+    options = engine_options(pool_size=2, max_overflow=1, pool_pre_ping=True)
+    assert options["poolclass"] is InstrumentedPool
+    assert options["pool_size"] == 2
+    assert options["connect_args"]["statement_cache_size"] == 100
+
+    with pytest.raises(ValueError):
+        engine_options(pooler="pgpool")
+    with pytest.raises(ValueError):
+        engine_options(pool_size=0)
+
+
+def test_engine_options__pgbouncer():
+    options = engine_options(
+        pooler="pgbouncer", statement_cache_size=0, autocommit_reads=False
+    )
+    assert options["poolclass"] is InstrumentedPool
+    assert options["connect_args"] == {
+        "statement_cache_size": 0,
+        "prepared_statement_cache_size": 0,
+        "connection_class": PgBouncerConnection,
+    }
+
+    # pooling can be left to pgbouncer
+    options = engine_options(
+        pooler="pgbouncer", pool_size=0, statement_cache_size=0, autocommit_reads=False
+    )
+    assert options["poolclass"] is sa.pool.NullPool
+    assert "pool_size" not in options
+
+    # prepared statements can't be cached behind it
+    with pytest.raises(ValueError):
+        engine_options(
+            pooler="pgbouncer", statement_cache_size=100, autocommit_reads=False
+        )
+    # nor can reads outside a transaction
+    with pytest.raises(ValueError):
+        engine_options(pooler="pgbouncer", statement_cache_size=0)
+
+
+@pytest.mark.asyncio
+async def test_pgbouncer_connection(database):
+    options = engine_options(
+        pooler="pgbouncer", pool_size=1, statement_cache_size=0, autocommit_reads=False
+    )
+    db = Database(DATABASE_URL, engine_kwargs=options)
+    try:
+        async with db.engine.connect() as conn:
+            raw = await conn.get_raw_connection()
+            assert isinstance(raw.driver_connection, PgBouncerConnection)
+            for i in range(3):
+                qs = sa.select(sa.literal(i, sa.Integer))
+                assert (await conn.execute(qs)).scalar() == i
+            # uuids rather than numbers, which another connection could use
+            driver_connection = raw.driver_connection
+            name = driver_connection._get_unique_id("stmt")
+            assert len(name) > 40
+            assert name != driver_connection._get_unique_id("stmt")
+    finally:
+        await db.engine.dispose()
+        ModelBase.db = database
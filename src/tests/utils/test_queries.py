@@ -0,0 +1,68 @@
+import logging
+from unittest import mock
+
+import pytest
+import sqlalchemy as sa
+
+from app.utils import queries
+from app.utils.database import ModelBase
+
+
+def test_normalize():
+    statement = """
+        SELECT users.id FROM users
+        WHERE users.id = $1 AND users.email = 'a''b' AND users.id IN (1, 2, 3)
+        LIMIT 10
+    """
+    assert queries.normalize(statement) == (
+        "SELECT users.id FROM users WHERE users.id = ? AND users.email = ? "
+        "AND users.id IN (?, ...) LIMIT ?"
+    )
+    # as sent by the asyncpg dialect
+    assert (
+        queries.normalize("SELECT %s + 1 WHERE 'a%%' = %s")
+        == "SELECT ? + ? WHERE ? = ?"
+    )
+
+
+def test_request_queries():
+    request_queries = queries.RequestQueries({"path": "/"}, keep=2)
+    for statement, duration in [("a", 0.1), ("b", 0.3), ("c", 0.2), ("d", 0.05)]:
+        request_queries.record(statement, duration)
+
+    assert request_queries.count == 4
+    assert request_queries.duration == pytest.approx(0.65)
+    assert request_queries.slowest == [(0.3, "b"), (0.2, "c")]
+    assert request_queries.route == "/"
+    assert request_queries.server_timing() == 'db;dur=650.0;desc="4 queries"'
+
+
+@pytest.mark.asyncio
+async def test_track(database):
+    count = queries.metrics.duration.count
+    requests = queries.metrics.request_queries.count
+
+    with queries.track({"path": "/"}) as request_queries:
+        assert queries.current() is request_queries
+        await ModelBase.execute(sa.text("SELECT 1"))
+        await ModelBase.execute(sa.text("SELECT 2"))
+    assert queries.current() is None
+
+    # BEGIN isn't sent as a statement, but COMMIT is
+    assert request_queries.count >= 2
+    assert [s for _, s in request_queries.slowest].count("SELECT 1") == 1
+    assert queries.metrics.duration.count >= count + 2
+    assert queries.metrics.request_queries.count == requests + 1
+
+
+@pytest.mark.asyncio
+async def test_slow_query_log(database, caplog):
+    slow = queries.metrics.slow
+    with mock.patch("app.settings.DATABASE_SLOW_QUERY_THRESHOLD", 0.05):
+        with caplog.at_level(logging.WARNING, logger="app.utils.queries"):
+            await ModelBase.execute(sa.text("SELECT pg_sleep(0.1), 'secret'"))
+            await ModelBase.execute(sa.text("SELECT 1"))
+
+    assert queries.metrics.slow == slow + 1
+    [record] = caplog.records
+    assert "in -: SELECT pg_sleep(?), ?" in record.getMessage()
@@ -0,0 +1,129 @@
+import pytest
+import sqlalchemy as sa
+
+from app.utils import rowcache
+from app.utils.cache import MemoryCacheBackend
+from app.utils.database import ModelBase
+
+
+class CachedModel(ModelBase):
+    __cache__ = {"ttl": 300, "max_entries": 2}
+
+    name = sa.Column(sa.String(50))
+
+
+class SharedCacheBackend(MemoryCacheBackend):
+    pass
+
+
+class SharedCachedModel(ModelBase):
+    __cache__ = {"backend": "tests.utils.test_rowcache.SharedCacheBackend"}
+
+
+def count_queries(engine):
+    queries = []
+
+    def before_execute(conn, cursor, statement, *args):
+        queries.append(statement)
+
+    sa.event.listen(engine.sync_engine, "before_cursor_execute", before_execute)
+    return queries
+
+
+@pytest.fixture()
+async def rows(database):
+    await database.create_all()
+    await CachedModel.bulk_insert([{"name": name} for name in ("ted", "bob", "sue")])
+    yield
+    rowcache.caches.clear()
+
+
+@pytest.mark.asyncio
+async def test_get(database, rows):
+    cache = rowcache.get_cache(CachedModel)
+    queries = count_queries(database.engine)
+
+    first = await CachedModel.get(1)
+    second = await CachedModel.get(1)
+    assert len(queries) == 1
+    assert second is not first and second.name == "ted"
+    assert sa.inspect(second).detached
+
+    # missing ids aren't cached
+    assert await CachedModel.get(99) is None
+    assert await CachedModel.get(99) is None
+    assert len(queries) == 3
+
+    instances = await CachedModel.get_many([1, 2, 3])
+    assert [i.name for i in instances] == ["ted", "bob", "sue"]
+    assert len(queries) == 4
+    assert cache.stats["entries"] == 2
+    assert cache.stats["evictions"] == 1
+    assert cache.stats["hits"] == 2
+    assert cache.stats["hit_ratio"] == 2 / 7
+
+    assert rowcache.stats()["cachedmodel"] == cache.stats
+
+
+@pytest.mark.asyncio
+async def test_get__unit_of_work(database, rows):
+    await CachedModel.get(1)
+
+    queries = count_queries(database.engine)
+    async with database.unit_of_work() as session:
+        instance = await CachedModel.get(1)
+        assert instance.name == "ted"
+        assert len(queries) == 0
+
+        # it is the unit of work's instance of the row, and can be saved
+        assert instance in session
+        qs = sa.select(CachedModel).where(CachedModel.id == 1)
+        assert await CachedModel.first(qs) is instance
+        instance.name = "ted 2"
+        await instance.save()
+    assert (await CachedModel.get(1)).name == "ted 2"
+
+
+@pytest.mark.asyncio
+async def test_invalidated_on_save_and_delete(database, rows):
+    cache = rowcache.get_cache(CachedModel)
+
+    instance = await CachedModel.get(1)
+    instance.name = "ted 2"
+    await instance.save()
+    assert await cache.get_many([1]) == {}
+    assert (await CachedModel.get(1)).name == "ted 2"
+
+    async with database.unit_of_work():
+        instance = await CachedModel.get(1)
+        await instance.delete()
+        assert await cache.get_many([1]) == {}
+        assert await CachedModel.get(1) is None
+
+
+@pytest.mark.asyncio
+async def test_invalidated_on_update(database, rows):
+    cache = rowcache.get_cache(CachedModel)
+    await CachedModel.get_many([1, 2])
+
+    # only the rows returned
+    await CachedModel.update(1, name="ted 2")
+    assert list(await cache.get_many([1, 2])) == [2]
+    assert (await CachedModel.get(1)).name == "ted 2"
+
+    # or all of them
+    await CachedModel.execute(sa.update(CachedModel).values(name="all"))
+    assert await cache.get_many([1, 2]) == {}
+
+    await CachedModel.get(2)
+    await CachedModel.bulk_upsert([{"id": 2, "name": "bob 2"}])
+    assert await cache.get_many([2]) == {}
+    assert (await CachedModel.get(2)).name == "bob 2"
+
+
+@pytest.mark.asyncio
+async def test_backend(database):
+    assert isinstance(rowcache.get_cache(SharedCachedModel), SharedCacheBackend)
+    assert rowcache.get_cache(SharedCachedModel).namespace == "sharedcachedmodel"
+    assert rowcache.get_cache(ModelBase) is None
+    rowcache.caches.clear()
@@ -0,0 +1,173 @@
+import json
+from base64 import b64encode, urlsafe_b64decode
+
+import pytest
+
+from app.utils.sessions import get_backend
+from app.utils.sessions.backends import (
+    BaseSessionBackend,
+    CookieSessionBackend,
+    DatabaseSessionBackend,
+    MemorySessionBackend,
+    UnloggedDatabaseSessionBackend,
+)
+from app.utils.sessions.codecs import (
+    COMPRESSED,
+    JSONSessionCodec,
+    MsgpackSessionCodec,
+    SessionSerializer,
+)
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+
+def test_get_backend():
+    assert isinstance(get_backend(), CookieSessionBackend)
+    backend = get_backend(
+        "app.utils.sessions.backends.MemorySessionBackend", max_entries=5
+    )
+    assert isinstance(backend, MemorySessionBackend)
+    assert backend.max_entries == 5
+
+
+@pytest.mark.asyncio
+async def test_base_backend():
+    backend = BaseSessionBackend()
+    with pytest.raises(NotImplementedError):
+        await backend.load("key")
+    with pytest.raises(NotImplementedError):
+        await backend.save(None, {}, 10)
+
+
+@pytest.mark.asyncio
+async def test_cookie_backend():
+    backend = CookieSessionBackend()
+    key = await backend.save(None, {"user": "1"}, 10)
+    assert await backend.load(key) == {"user": "1"}
+
+
+@pytest.mark.asyncio
+async def test_cookie_backend_invalid():
+    backend = CookieSessionBackend()
+    assert await backend.load("") is None
+    assert await backend.load("not base64!") is None
+    assert await backend.load("fwAA") is None  # unknown format
+
+
+def test_serializer_json():
+    serializer = SessionSerializer(JSONSessionCodec(), compress_min_size=0)
+    value = serializer.dumps({"user": "1"})
+    assert serializer.loads(value) == {"user": "1"}
+    assert "=" not in value
+
+
+def test_serializer_compresses_large_sessions():
+    serializer = SessionSerializer(JSONSessionCodec(), compress_min_size=100)
+    small = {"user": "1"}
+    large = {"user": "1", "messages": ["saved"] * 100}
+
+    assert serializer.loads(serializer.dumps(small)) == small
+    assert serializer.loads(serializer.dumps(large)) == large
+    assert len(serializer.dumps(large)) < len(json.dumps(large))
+
+    # any serializer can read compressed sessions
+    plain = SessionSerializer(JSONSessionCodec(), compress_min_size=0)
+    assert plain.loads(serializer.dumps(large)) == large
+
+
+def test_serializer_legacy_cookie():
+    legacy = b64encode(json.dumps({"user": "1"}).encode("utf-8")).decode("utf-8")
+    assert SessionSerializer().loads(legacy) == {"user": "1"}
+
+
+@pytest.mark.parametrize(
+    "data,format_byte",
+    [
+        ({"user": "1"}, JSONSessionCodec.format),
+        ({"messages": ["saved"] * 100}, JSONSessionCodec.format | COMPRESSED),
+    ],
+)
+def test_serializer_format_byte(data, format_byte):
+    serializer = SessionSerializer(JSONSessionCodec(), compress_min_size=100)
+    value = serializer.dumps(data)
+    assert urlsafe_b64decode(value + "=" * (-len(value) % 4))[0] == format_byte
+
+
+@pytest.mark.skipif(msgpack is None, reason="msgpack is not installed")
+def test_serializer_msgpack():
+    serializer = SessionSerializer(MsgpackSessionCodec())
+    value = serializer.dumps({"user": "1"})
+    assert serializer.loads(value) == {"user": "1"}
+
+    # sessions are still read after switching codec
+    assert SessionSerializer(JSONSessionCodec()).loads(value) == {"user": "1"}
+
+
+def test_msgpack_missing():
+    if msgpack is not None:  # pragma: no cover
+        pytest.skip("msgpack is installed")
+    with pytest.raises(ValueError):
+        MsgpackSessionCodec().dumps({})
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "backend",
+    [MemorySessionBackend, DatabaseSessionBackend, UnloggedDatabaseSessionBackend],
+)
+async def test_server_side_backends(backend):
+    backend = backend()
+
+    key = await backend.save(None, {"user": "1"}, 10)
+    assert len(key) >= 32
+    assert await backend.load(key) == {"user": "1"}
+    assert await backend.load("unknown") is None
+
+    # saving again keeps the key
+    assert await backend.save(key, {"user": "2"}, 10) == key
+    assert await backend.load(key) == {"user": "2"}
+
+    # expired sessions aren't loaded
+    await backend.save(key, {"user": "2"}, -1)
+    assert await backend.load(key) is None
+
+    # revoked sessions aren't loaded
+    key = await backend.save(None, {"user": "3"}, 10)
+    await backend.delete(key)
+    assert await backend.load(key) is None
+
+
+@pytest.mark.asyncio
+async def test_memory_backend_evicts_least_recently_used():
+    backend = MemorySessionBackend(max_entries=2)
+    first = await backend.save(None, {"n": 1}, 10)
+    second = await backend.save(None, {"n": 2}, 10)
+    await backend.load(first)
+    await backend.save(None, {"n": 3}, 10)
+
+    assert await backend.load(first) == {"n": 1}
+    assert await backend.load(second) is None
+
+
+@pytest.mark.asyncio
+async def test_memory_backend_copies_data():
+    backend = MemorySessionBackend()
+    key = await backend.save(None, {"items": [1]}, 10)
+    data = await backend.load(key)
+    data["items"].append(2)
+    assert await backend.load(key) == {"items": [1]}
+
+
+@pytest.mark.asyncio
+async def test_database_backend_cleanup():
+    backend = DatabaseSessionBackend(cleanup_every=3, cleanup_batch_size=1)
+    await backend.save(None, {}, -1)
+    await backend.save(None, {}, -1)
+    # the third save deletes one of the expired sessions
+    await backend.save(None, {}, 10)
+    assert backend.saves == 3
+    assert await backend.cleanup() == 1
+    assert await backend.cleanup() == 0
@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+
+from app.utils.singleflight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_shares_call_in_flight():
+    flights = SingleFlight()
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"a": 1}
+
+    results = await asyncio.gather(*[flights.do("key", fn) for _ in range(3)])
+    assert results == [({"a": 1}, False), ({"a": 1}, True), ({"a": 1}, True)]
+    assert len(calls) == 1
+    assert flights.stats == {"in_flight": 0, "leaders": 1, "shared": 2}
+
+    # once it is done the next call is made again
+    assert await flights.do("key", fn) == ({"a": 1}, False)
+    await asyncio.gather(flights.do("key", fn), flights.do("other", fn))
+    assert len(calls) == 4
+
+
+@pytest.mark.asyncio
+async def test_shares_errors():
+    flights = SingleFlight()
+
+    async def fn():
+        await asyncio.sleep(0.01)
+        raise ValueError("failed")
+
+    results = await asyncio.gather(
+        flights.do("key", fn), flights.do("key", fn), return_exceptions=True
+    )
+    assert all(isinstance(result, ValueError) for result in results)
+    assert flights.calls == {}
+
+    # or the others make the call again
+    flights = SingleFlight(share_errors=False)
+    calls = []
+
+    async def fails_first():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        if len(calls) == 1:
+            raise ValueError("failed")
+        return 1
+
+    results = await asyncio.gather(
+        flights.do("key", fails_first),
+        flights.do("key", fails_first),
+        return_exceptions=True,
+    )
+    assert isinstance(results[0], ValueError)
+    assert results[1] == (1, False)
+    assert flights.calls == {}
+
+
+@pytest.mark.asyncio
+async def test_timeout():
+    flights = SingleFlight()
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        return 1
+
+    leader = asyncio.ensure_future(flights.do("key", slow))
+    await asyncio.sleep(0)
+    with pytest.raises(asyncio.TimeoutError):
+        await flights.do("key", slow, timeout=0.01)
+    # the call itself carries on for the others
+    assert await leader == (1, False)
+
+    with pytest.raises(asyncio.TimeoutError):
+        await SingleFlight(timeout=0.01).do("key", slow)
+
+
+@pytest.mark.asyncio
+async def test_leader_cancelled():
+    flights = SingleFlight()
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    leader = asyncio.ensure_future(flights.do("key", fn))
+    await asyncio.sleep(0)
+    follower = asyncio.ensure_future(flights.do("key", fn))
+    await asyncio.sleep(0)
+    leader.cancel()
+
+    # the follower makes the call itself
+    assert await follower == (2, False)
+    assert leader.cancelled()
+
+
+@pytest.mark.asyncio
+async def test_leader_timed_out():
+    flights = SingleFlight()
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        if len(calls) == 1:
+            await asyncio.sleep(0.05)
+        return len(calls)
+
+    leader = asyncio.ensure_future(flights.do("key", fn, timeout=0.01))
+    await asyncio.sleep(0)
+    follower = asyncio.ensure_future(flights.do("key", fn, timeout=1))
+
+    # the follower isn't failed with the leader's timeout
+    with pytest.raises(asyncio.TimeoutError):
+        await leader
+    assert await follower == (2, False)
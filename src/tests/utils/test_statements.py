@@ -0,0 +1,113 @@
+import json
+from unittest import mock
+
+import pytest
+
+from app.auth.tables import User
+from app.report_statements import report
+from app.utils import queries, statements
+
+
+def stat(query, calls, total_time, rows=0):
+    return {
+        "queryid": hash(query),
+        "query": query,
+        "calls": calls,
+        "total_time": total_time,
+        "rows": rows,
+        "shared_blks_hit": 0,
+        "shared_blks_read": 0,
+    }
+
+
+BEFORE = {
+    "1": stat('SELECT "user".id FROM "user" WHERE "user".id = $1::INTEGER', 10, 5),
+    "2": stat("SELECT $1", 5, 1),
+    "3": stat("UPDATE scope SET code = $1", 1, 1),
+}
+AFTER = {
+    "1": stat('SELECT "user".id FROM "user" WHERE "user".id = $1::INTEGER', 30, 25),
+    "2": stat("SELECT $1", 5, 1),
+    "3": stat("UPDATE scope SET code = $1", 0, 0),
+    "4": stat("DELETE FROM user_scopes WHERE id = ANY($1::INTEGER[])", 2, 50),
+}
+
+
+def test_key():
+    sent = 'SELECT "user".id FROM "user" WHERE "user".id = %s'
+    assert statements.key(sent) == statements.key(AFTER["1"]["query"])
+    assert statements.key("SELECT $1::timestamp with time zone") == "SELECT ?"
+    assert statements.key("SELECT a = ANY($1::INTEGER[])") == "SELECT a = ANY(?)"
+
+
+def test_diff():
+    changed = statements.diff(BEFORE, AFTER)
+    # unchanged statements are left out, reset ones are counted in full
+    assert sorted(changed) == ["1", "4"]
+    assert changed["1"]["calls"] == 20
+    assert changed["1"]["total_time"] == 20
+    assert changed["4"]["calls"] == 2
+
+
+def test_top():
+    rows = statements.top(AFTER)
+    assert [row["queryid"] for row in rows] == [AFTER["4"]["queryid"]] + [
+        AFTER[k]["queryid"] for k in ("1", "2")
+    ]
+    assert rows[0]["mean_time"] == 25
+    assert rows[0]["share"] == pytest.approx(50 / 76)
+
+    assert statements.top(AFTER, "calls", limit=1)[0]["calls"] == 30
+    with pytest.raises(ValueError):
+        statements.top(AFTER, "queryid")
+
+
+def test_attribute():
+    def endpoint():
+        pass
+
+    sent = 'SELECT "user".id FROM "user" WHERE "user".id = %s'
+    with mock.patch.object(queries, "seen", {sent: {endpoint, None}}):
+        rows = statements.attribute(statements.top(AFTER), statements.model_tables())
+
+    assert rows[0]["models"] == []  # user_scopes is a table without a model
+    assert rows[1]["models"] == ["User"]
+    assert rows[1]["endpoints"] == ["-", __name__ + ".test_attribute.<locals>.endpoint"]
+    assert rows[2]["endpoints"] == []
+
+
+def test_model_tables():
+    assert statements.model_tables()["user"] is User
+
+
+@pytest.mark.asyncio
+async def test_report(database, tmp_path, capsys):
+    with mock.patch.object(statements, "available", mock.AsyncMock(return_value=False)):
+        assert await report() == 1
+    assert "pg_stat_statements isn't installed" in capsys.readouterr().err
+
+    saved = tmp_path / "before.json"
+    with mock.patch.object(
+        statements, "available", mock.AsyncMock(return_value=True)
+    ), mock.patch.object(statements, "snapshot", mock.AsyncMock(return_value=BEFORE)):
+        assert await report(save=str(saved)) == 0
+    assert json.loads(saved.read_text()) == BEFORE
+    assert "Saved 3 statements" in capsys.readouterr().out
+
+    with mock.patch.object(
+        statements, "available", mock.AsyncMock(return_value=True)
+    ), mock.patch.object(statements, "snapshot", mock.AsyncMock(return_value=AFTER)):
+        assert await report(since=str(saved), limit=1) == 0
+    out = capsys.readouterr().out
+    assert "Statements run since" in out
+    assert "DELETE FROM user_scopes WHERE id = ANY(?)" in out
+    assert 'FROM "user"' not in out
+
+
+@pytest.mark.asyncio
+async def test_snapshot(database):
+    async with database.engine.connect() as conn:
+        if not await statements.available(conn):
+            pytest.skip("pg_stat_statements isn't installed")
+        stats = await statements.snapshot(conn)
+    assert all(s["calls"] >= 0 for s in stats.values())